@@ -20,18 +20,44 @@ from collections import defaultdict
 import gc
 import multiprocessing as mp
 import subprocess
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 # import custom functions
 from custom_functions.manipulate_seqids import indSID_to_allSID, get_seqIDs_in_nodes, dict_to_2d_array
-from custom_functions.run_mmseqs import run_mmseqs_search, mmseqs_createdb, mmseqs_concatdbs
+from custom_functions.run_mmseqs import run_mmseqs_search, run_mmseqs_search_targets, mmseqs_createdb, mmseqs_concatdbs, \
+    mmseqs_search_reference, mmseqs_db_size, mmseqs_copydb, mmseqs_linkdb, set_search_backend, \
+    set_db_cache, set_sensitivity_schedule, mmseqs_writedb
 from panaroo_functions.load_graphs import load_graphs
 from panaroo_functions.write_gml_metadata import format_metadata_for_gml
 from panaroo_functions.context_search import collapse_families, single_linkage
 from panaroo_functions.merge_nodes import merge_node_cluster, gen_edge_iterables, gen_node_iterables, iter_del_dups, del_dups
 from custom_functions.relabel_nodes import relabel_nodes_preserve_attrs,sync_names
 from custom_functions.context_similarity import context_similarity_seq
-from custom_functions.context_similarity import build_ident_lookup, init_parallel, compute_scores_parallel
-from custom_functions.sqlite import sqlite_connect, sqlite_init_schema, sqlite_create_indexes, add_metadata_to_sqlite
+from custom_functions.context_similarity import build_ident_lookup, init_parallel, compute_scores_parallel, compute_collapse_parallel
+from custom_functions.collapse import accept_pairs, contract_pair
+from custom_functions.sqlite import sqlite_connect, sqlite_init_schema, sqlite_create_indexes, add_component_ids_to_sqlite
+from custom_functions.merge_order import choose_merge_order
+from custom_functions.hits import read_hits, concat_hits, hits_from_rows, best_one_to_one, mapping_hits, rename_nodes, suffix_targets
+from custom_functions.memory import MemoryBudget, parse_memory
+from custom_functions.scratch import ScratchStager
+from custom_functions.export import export_iteration, strip_metadata, SnapshotWriter
+from custom_functions.scheduler import ThreadScheduler
+from custom_functions.assign import run_assign
+from custom_functions.outputs import restore_run, read_removed_nodes, removed_nodes_path
+from custom_functions.remove import run_remove
+from custom_functions.extract import run_extract
+from custom_functions.components import load_component_graph, component_graph_path, component_reference, \
+    component_query_db, component_removed_nodes, component_proteins, component_genomes, component_gene_ids
+from custom_functions.tiering import TierStore, tier_sizes
+from custom_functions.decision_log import DecisionLog, decision_log_path, read_decision_log, replay_components
+from custom_functions.target_index import TargetIndex
+from custom_functions.shards import ShardedDb
+from custom_functions.hit_store import HitStore, nodes_added_since
+from custom_functions.sequence_index import SequenceIndex, sequence_index_path, split_exact_queries
+from custom_functions.db_cache import DbCache
+from custom_functions.sensitivity import SensitivitySchedule, sensitivity_metrics_path
+from custom_functions.mapping_cascade import linclust_queries
 
 from .__init__ import __version__
 
@@ -45,8 +71,11 @@ def get_options():
     IO = parser.add_argument_group('Input and output options')
     IO.add_argument('--mode',
                     default='run',
-                    choices=['run', 'test'],
-                    help='Run pan-genome gene graph merge ("run") or calculate clustering accuracy metrics for merge ("test"). '
+                    choices=['run', 'test', 'assign', 'remove', 'extract', 'replay'],
+                    help='Run pan-genome gene graph merge ("run"), calculate clustering accuracy metrics for merge ("test"), '
+                        'assign the nodes of new component graphs to the COGs of a finished merge without changing it ("assign"), '
+                        'remove genomes from a finished merge ("remove"), extract the subgraph of a set of genomes ("extract"), '
+                        'or rebuild the merged graph of a finished run at any iteration from its decision log ("replay"). '
                         '[Default = Run] ')
     IO.add_argument('--outdir',
                     required=True,
@@ -58,7 +87,8 @@ def get_options():
                     required=False,
                     help='Tab-separated list of paths to Panaroo output directories of component subgraphs. \
                     Each directory must contain final_graph.gml and pan_genome_reference.fa. If running in test mode, \
-                    must also contain gene_data.csv. Graphs will be merged in the order presented in the file.')
+                    must also contain gene_data.csv. Output directories of finished pangenomerge runs may also be given, \
+                    to merge separate merges with each other. Graphs will be merged in the order presented in the file.')
     IO.add_argument('--iterative',
                     dest='iterative',
                     default=None,
@@ -66,6 +96,38 @@ def get_options():
                     help='Tab-separated list of GFFs and their sample IDs for iterative updating of the graph. \
                     Use only for single samples or sets of samples too diverse to create an initial pan-genome. \
                     Samples will be merged in the order presented in the file.')
+    IO.add_argument('--reference',
+                    dest='reference',
+                    default=None,
+                    required=False,
+                    help='Output directory of a finished pangenomerge run. Required for assign, remove, extract and replay modes, where the \
+                    component graphs are assigned to its final merged graph, genomes are removed from or extracted out of it, \
+                    or its merge is replayed from decisions.log.')
+    IO.add_argument('--genomes',
+                    dest='genomes',
+                    default=None,
+                    required=False,
+                    help='File listing the genomes to remove (remove mode) or extract (extract mode), one per line, by genome name \
+                    (isolateNames of the component graphs) or member ID (<index in component graph>_g<component number>, e.g. 12_g3).')
+    IO.add_argument('--extract-format',
+                    dest='extract_format',
+                    default='gml',
+                    choices=['gml', 'tsv'],
+                    required=False,
+                    help='Output format of extract mode: a GML graph, or node and edge tables. [Default = gml]')
+    IO.add_argument('--replay-to',
+                    dest='replay_to',
+                    default=None,
+                    type=int,
+                    required=False,
+                    help='Last iteration to rebuild in replay mode. [Default = last logged iteration]')
+    IO.add_argument('--append-to',
+                    dest='append_to',
+                    default=None,
+                    required=False,
+                    help='Output directory of a finished pangenomerge run. Its final merged graph, base MMseqs2 database and \
+                    SQLite database are restored and the component graphs are merged onto it, continuing the iteration numbering. \
+                    May be the same as --outdir to update the run in place.')
     IO.add_argument('--graph-all',
                     dest='graph_all',
                     default=None,
@@ -78,6 +140,14 @@ def get_options():
                     required=False,
                     help='Retains metadata in the final graph GML (in addition to the SQLite database). Dramatically increases \
                     runtime and memory consumption. Not recommended with >10k isolates.')
+    IO.add_argument('--order',
+                    dest='order',
+                    default='tsv',
+                    choices=['tsv', 'auto'],
+                    required=False,
+                    help='Order in which component graphs are merged. "tsv" merges in the order presented in --component-graphs; \
+                    "auto" sketches the gene content of each pan_genome_reference.fa and merges the least novel components first \
+                    to keep intermediate graphs small. [Default = tsv]')
 
     parameters = parser.add_argument_group('Parameters')
     parameters.add_argument('--family-threshold',
@@ -99,6 +169,147 @@ def get_options():
                     default=1,
                     type=int,
                     help='Number of threads')
+    other.add_argument('--search-backend',
+                    dest='search_backend',
+                    choices=['mmseqs', 'native'],
+                    default='mmseqs',
+                    help='Homology search backend. "native" searches in-process (k-mer prefilter and edlib alignments, \
+                    with protein FASTA files in place of MMseqs2 databases) and does not need MMseqs2; it is meant for \
+                    small merges and testing. [Default = mmseqs]')
+    other.add_argument('--adaptive-sensitivity',
+                    dest='adaptive_sensitivity',
+                    action='store_true',
+                    help='Run the MMseqs2 sensitivity steps (-s 1, 3.35, 5.7) of the mapping and collapse searches one at a \
+                    time and record how many queries first find a hit at each step. After --sensitivity-probes searches of a \
+                    type, its searches stop after the last step that still found hits for at least 0.1%% of queries (every \
+                    10th search runs all steps again). Yields are written to sensitivity_metrics.tsv.')
+    other.add_argument('--sensitivity-probes',
+                    dest='sensitivity_probes',
+                    default=3,
+                    type=int,
+                    required=False,
+                    help='Number of searches of each type that run every sensitivity step before --adaptive-sensitivity \
+                    chooses the steps. Default: 3.')
+    other.add_argument('--db-cache',
+                    dest='db_cache',
+                    default=None,
+                    required=False,
+                    help='Directory for a cache of translated component databases, keyed by the content of each \
+                    pan_genome_reference.fa and shared between runs and output directories. Repeat runs over the same \
+                    components (threshold sweeps, test mode) skip translation. Default: no cache.')
+    other.add_argument('--db-cache-size',
+                    dest='db_cache_size',
+                    default='20G',
+                    required=False,
+                    help='Size limit of --db-cache (e.g. 20G; plain numbers are MB). The least recently used databases are \
+                    evicted beyond it. Default: 20G.')
+    other.add_argument('--adaptive-threads',
+                    dest='adaptive_threads',
+                    action='store_true',
+                    help='Choose the number of threads for each phase (MMseqs2 steps, context scoring) from its measured \
+                    scaling instead of always using --threads, and build the next component\'s MMseqs2 database while the \
+                    current iteration is exported.')
+    other.add_argument('--speculative-search',
+                    dest='speculative_search',
+                    action='store_true',
+                    help='Start the next component\'s mapping search against the current base database while the current \
+                    iteration is still merging; once it finishes, only the nodes it added are searched and the hits combined.')
+    other.add_argument('--single-search',
+                    dest='single_search',
+                    action='store_true',
+                    help='Run one MMseqs2 search per iteration, at the family threshold. The one-to-one mapping is derived \
+                    from its hits at >= 98%% identity (coverage approximated from alignment length) and the remaining hits are \
+                    reused as collapse candidates, instead of searching the new nodes against the base database a second time.')
+    other.add_argument('--dedup-sequences',
+                    dest='dedup_sequences',
+                    action='store_true',
+                    help='Keep a hash index of the protein sequences in the base pangenome database. Queries identical to a \
+                    stored sequence are mapped by hash without MMseqs2 (and searched after all if they lose that node in the \
+                    one-to-one mapping), and nodes with identical sequences are stored in the \
+                    base database once (their hits are shared). The index is written to sequence_index.tsv.')
+    other.add_argument('--mapping-cascade',
+                    dest='mapping_cascade',
+                    action='store_true',
+                    help='Run the mapping search as a cascade: queries identical to a base sequence are mapped by hash \
+                    (implies --dedup-sequences), the rest are clustered with the base database by MMseqs2 linclust at the \
+                    mapping thresholds without copying the base database, and only queries left without a hit go to the \
+                    mapping search (queries losing their hash or cluster match in the one-to-one mapping are searched after \
+                    all). Not used with --single-search.')
+    other.add_argument('--direct-db',
+                    dest='direct_db',
+                    action='store_true',
+                    help='Write the MMseqs2 databases of the base pangenome and of the collapse queries directly from the \
+                    merged graph (sequence and header databases with their .index, .dbtype, .lookup and .source files), \
+                    instead of writing FASTA files and running mmseqs createdb on them. The new_nodes_<N>.fa files are \
+                    then only written with --hit-store.')
+    other.add_argument('--hit-store',
+                    dest='hit_store',
+                    action='store_true',
+                    help='Keep the collapse search hits of every iteration in an on-disk store (mmseqs_tmp/hit_store.sqlite) \
+                    indexed by query sequence. Sequences searched in an earlier iteration are only searched against the nodes \
+                    added since, and their stored hits reused; stored identities between existing nodes are also used for \
+                    context similarity. Not used with --single-search.')
+    other.add_argument('--target-index',
+                    dest='target_index',
+                    action='store_true',
+                    help='Keep a precomputed MMseqs2 index (createindex) of the base pangenome database, shared by the \
+                    mapping and collapse searches of every iteration. New nodes go into a small indexed side database that is \
+                    compacted into the main index once it reaches --index-compact-fraction of its size.')
+    other.add_argument('--index-compact-fraction',
+                    dest='index_compact_fraction',
+                    default=0.2,
+                    type=float,
+                    required=False,
+                    help='Size of the --target-index side database, as a fraction of the main database, at which it is \
+                    compacted into the main index. Default: 0.2.')
+    other.add_argument('--sharded-db',
+                    dest='sharded_db',
+                    action='store_true',
+                    help='Keep the base pangenome database as append-only shards instead of writing a complete copy every \
+                    iteration: new nodes go into a new shard, searches run over all shards and the newest shards are \
+                    merged as they grow. Superseded databases are deleted, and the complete base database is only written \
+                    after the last iteration. With --target-index, each shard is indexed.')
+    other.add_argument('--background-export',
+                    dest='background_export',
+                    action='store_true',
+                    help='Write each iteration\'s SQLite metadata and merged graph GML from a snapshot of the graph in a helper \
+                    process while the next iteration runs. At most one snapshot is written at a time.')
+    other.add_argument('--parallel-collapse',
+                    dest='parallel_collapse',
+                    action='store_true',
+                    help='Partition candidate paralog pairs into independent groups and score, accept and plan their \
+                    collapse in parallel worker processes. Gives the same result as the default serial collapse.')
+    other.add_argument('--max-memory',
+                    dest='max_memory',
+                    default=None,
+                    required=False,
+                    help='Memory limit for the run (e.g. 150G; plain numbers are MB, as in Slurm). RSS is monitored per stage and \
+                    hit files are read and filtered in chunks, worker pools shrunk and memory released before the limit is reached. \
+                    Chunked reading only bounds the raw search output: the hits passing the thresholds are still held in memory \
+                    (the collapse hit table is not spilled to disk). Every such decision is logged. Default: no limit.')
+    other.add_argument('--scratch',
+                    dest='scratch',
+                    default=None,
+                    required=False,
+                    help='Node-local directory for MMseqs2 databases, temp files and the live SQLite database. \
+                    Databases are copied back to --outdir in the background; the SQLite database is copied back at the end.')
+    other.add_argument('--cold-below',
+                    dest='cold_below',
+                    default=None,
+                    type=int,
+                    required=False,
+                    help='Move nodes and edges present in fewer than this many genomes out of the working graph at each \
+                    checkpoint. Cold nodes are brought back when a new node maps to or is a candidate paralog of them, and all \
+                    nodes are reconciled at checkpoints and at the end. Cold nodes stay in the base database and are still searched \
+                    every iteration (this saves graph memory, not search time). Intermediate graphs between checkpoints only \
+                    contain the working graph. Default: off.')
+    other.add_argument('--tier-checkpoint',
+                    dest='tier_checkpoint',
+                    default=10,
+                    type=int,
+                    required=False,
+                    help='Number of iterations between checkpoints at which --cold-below tiers are reconciled and \
+                    recomputed. Default: 10.')
     other.add_argument('--sqlite-cache',
                     dest="sqlite_cache",
                     default=2000,
@@ -118,7 +329,14 @@ def main():
     # parse command line arguments
     options = get_options()
 
-    if options.component_graphs is None and options.iterative is None:
+    # set logging to 'debug' or 'info' (default)
+    if options.debug:
+        logging.basicConfig(level=logging.DEBUG, format="[%(levelname)s] %(message)s")
+    else:
+        logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+    # remove, extract and replay modes work on a finished run only
+    if options.mode not in ('remove', 'extract', 'replay') and options.component_graphs is None and options.iterative is None:
         logging.critical("Specifying either --component-graphs or --iterative is required!")
     if options.mode == 'test' and options.graph_all is None:
         logging.critical("Specifying --graph-all is required for test mode!")
@@ -132,18 +350,108 @@ def main():
         logging.warning(f"Keeping metadata in graph is required for test mode! Running with --metadata-in-graph...")
         options.keep_metadata_in_graph = True
 
-    # set logging to 'debug' or 'info' (default)
-    if options.debug:
-        logging.basicConfig(level=logging.DEBUG, format="[%(levelname)s] %(message)s")
-    else:
-        logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    # homology search backend for every mode (MMseqs2 or in-process)
+    set_search_backend(options.search_backend)
+    if options.search_backend == 'native':
+        logging.info("Using the native search backend (no MMseqs2)")
+
+    # sensitivity steps of the mapping and collapse searches chosen from their hit yields
+    sensitivity = None
+    if options.adaptive_sensitivity:
+        Path(options.outdir).mkdir(parents=True, exist_ok=True)
+        sensitivity = SensitivitySchedule(sensitivity_metrics_path(options.outdir), probe_searches=options.sensitivity_probes)
+        set_sensitivity_schedule(sensitivity)
+
+    # translated component databases are reused across runs if a cache is given
+    db_cache = None
+    if options.db_cache:
+        db_cache = DbCache(options.db_cache, parse_memory(options.db_cache_size))
+        set_db_cache(db_cache)
+        logging.info(f"Using translated database cache {options.db_cache} (limit {options.db_cache_size})")
+
+    # monitor memory against limit if specified
+    budget = MemoryBudget(parse_memory(options.max_memory)) if options.max_memory else None
+    if budget:
+        logging.info(f"Memory budget: {options.max_memory} (degrading above {budget.soft_limit / 1024**3:.2f}G)")
+
+    # assign mode: read-only against a finished merge
+    if options.mode == 'assign':
+        if options.reference is None:
+            logging.critical("Specifying --reference is required for assign mode!")
+            sys.exit(1)
+        logging.info(f"Assigning component graphs to {options.reference}...")
+        Path(options.outdir).mkdir(parents=True, exist_ok=True)
+        component_dirs = [str(p) for p in pd.read_csv(options.component_graphs, sep='\t', header=None)[0]]
+        run_assign(component_dirs, options.reference, options.outdir, options.threads,
+                   float(options.family_threshold), float(options.context_threshold), options.sqlite_cache)
+        logging.info('Finished successfully.')
+        return
+
+    # remove mode: update a finished merge without rebuilding it
+    if options.mode == 'remove':
+        if options.reference is None or options.genomes is None:
+            logging.critical("Specifying --reference and --genomes is required for remove mode!")
+            sys.exit(1)
+        Path(options.outdir).mkdir(parents=True, exist_ok=True)
+        run_remove(options.reference, options.outdir, options.genomes, options.sqlite_cache)
+        logging.info('Finished successfully.')
+        return
+
+    # extract mode: subgraph of a genome list, read from the SQLite database of a finished merge
+    if options.mode == 'extract':
+        if options.reference is None or options.genomes is None:
+            logging.critical("Specifying --reference and --genomes is required for extract mode!")
+            sys.exit(1)
+        Path(options.outdir).mkdir(parents=True, exist_ok=True)
+        run_extract(options.reference, options.outdir, options.genomes, options.sqlite_cache, options.extract_format)
+        logging.info('Finished successfully.')
+        return
+
+    if options.append_to is not None and options.mode in ('test', 'replay'):
+        logging.critical(f"--append-to is not supported in {options.mode} mode!")
+        sys.exit(1)
+
+    # replay mode: rebuild the merge of a finished run from its decision log (no MMseqs2 or context scoring)
+    replay = None
+    replay_to = None
+    if options.mode == 'replay':
+        if options.reference is None:
+            logging.critical("Specifying --reference is required for replay mode!")
+            sys.exit(1)
+        if Path(options.reference).resolve() == Path(options.outdir).resolve():
+            logging.critical("Replay mode must write to a different --outdir than --reference!")
+            sys.exit(1)
+        replay = read_decision_log(decision_log_path(options.reference))
+        replay_to = options.replay_to if options.replay_to is not None else max(replay, default=0)
+        logging.info(f"Replaying {options.reference} to iteration {replay_to}...")
+
+    # continuing a run in place: keep its databases
+    append_in_place = options.append_to is not None and Path(options.append_to).resolve() == Path(options.outdir).resolve()
 
     ### create outdir
 
     # first remove any existing files in mmseqs outdir (can cause problems)
-    subprocess.run(f'rm -rf {str(options.outdir)}/mmseqs_tmp/*', shell=True, check=True, capture_output=True)
+    if not append_in_place:
+        subprocess.run(f'rm -rf {str(options.outdir)}/mmseqs_tmp/*', shell=True, check=True, capture_output=True)
 
-    mmseqs_dir = Path(options.outdir) / "mmseqs_tmp"
+    (Path(options.outdir) / "mmseqs_tmp").mkdir(parents=True, exist_ok=True)
+
+    # stage working databases, temp files and live SQLite database on node-local disk if requested
+    stager = ScratchStager(options.scratch, options.outdir) if options.scratch else None
+    work_dir = stager.root if stager else Path(options.outdir)
+
+    try:
+        run_merge(options, stager, work_dir, replay, replay_to, append_in_place, budget, sensitivity, db_cache)
+    except BaseException:
+        # the live SQLite database is only copied back at the end of a merge, so it must not be removed with the scratch
+        if stager:
+            logging.error(f"Merge failed; scratch directory {stager.root} (with the live SQLite database) is left in place")
+        raise
+
+# merge the component graphs (run, test and replay modes), staging working files in work_dir
+def run_merge(options, stager, work_dir, replay, replay_to, append_in_place, budget, sensitivity, db_cache):
+
+    mmseqs_dir = work_dir / "mmseqs_tmp"
     mmseqs_dir.mkdir(parents=True, exist_ok=True)
 
     # this will always point to the current combined pangenome db
@@ -153,28 +461,107 @@ def main():
     sqlite_path = Path(options.outdir) / "pangenome_metadata.sqlite"
 
     # delete any existing sqlite database
-    if sqlite_path.exists():
+    if sqlite_path.exists() and not append_in_place:
         logging.info(f"Removing existing SQLite database: {sqlite_path}")
         sqlite_path.unlink()
 
     # create new sqlite database
-    con = sqlite_connect(database=sqlite_path, sqlite_cache=options.sqlite_cache)
+    live_sqlite_path = work_dir / "pangenome_metadata.sqlite"
+
+    # restore merged graph, base database and SQLite database of a finished run
+    previous_iterations = 0
+    restored_db = None
+    if options.append_to is not None:
+        logging.info(f"Appending to {options.append_to}...")
+        previous_iterations, merged_graph, base_db = restore_run(options.append_to, mmseqs_dir, live_sqlite_path)
+        restored_db = base_db
+        logging.info(f"Restored iteration {previous_iterations} ({len(merged_graph.nodes())} nodes)")
+
+    # nodes removed from the previous run are still in its base database; ignore hits to them
+    removed_nodes = read_removed_nodes(options.append_to) if options.append_to is not None else set()
+    if removed_nodes and not append_in_place:
+        with open(removed_nodes_path(options.outdir), "w") as f:
+            for node_id in sorted(removed_nodes):
+                f.write(f"{node_id}\n")
+
+    con = sqlite_connect(database=live_sqlite_path, sqlite_cache=options.sqlite_cache)
     sqlite_init_schema(con)
 
     ### read in two graphs
 
-    graph_files = pd.read_csv(options.component_graphs, sep='\t', header=None)
-    n_graphs = int(len(graph_files))
-    graph_count = 0
+    if replay is not None:
+        component_dirs = replay_components(replay, replay_to)
+    else:
+        component_dirs = [str(p) for p in pd.read_csv(options.component_graphs, sep='\t', header=None)[0]]
+
+    # optionally reorder components to reduce intermediate graph size
+    if options.order == 'auto' and replay is None:
+        logging.info("Sketching component graphs to choose merge order...")
+        order = choose_merge_order(component_dirs, options.outdir)
+        component_dirs = [component_dirs[i] for i in order]
+
+    # when appending, components already merged occupy the first positions (g1 ... g{N+1})
+    if options.append_to is not None:
+        component_dirs = [None] * (previous_iterations + 1) + component_dirs
+    n_graphs = len(component_dirs)
+    graph_count = previous_iterations
+
+    # per-phase thread budget (see --adaptive-threads)
+    sched = ThreadScheduler(options.threads, adaptive=options.adaptive_threads)
+    prefetch = None
+
+    # background export of each iteration (see --background-export)
+    snapshot_writer = SnapshotWriter(live_sqlite_path, options.sqlite_cache) if options.background_export else None
+
+    # background mapping search for the next component (see --speculative-search)
+    speculation = None
+    speculation_executor = ThreadPoolExecutor(max_workers=1) if options.speculative_search and replay is None else None
+
+    # persistent target index of the base database (see --target-index)
+    target_index = TargetIndex(mmseqs_dir / "target_index", options.index_compact_fraction) \
+        if options.target_index and not options.sharded_db and replay is None else None
+
+    # append-only shards of the base database (see --sharded-db; indexed per shard with --target-index)
+    shards = ShardedDb(mmseqs_dir / "shards", indexed=options.target_index) \
+        if options.sharded_db and replay is None else None
+
+    # collapse search hits kept across iterations (see --hit-store)
+    hit_store = HitStore(mmseqs_dir / "hit_store.sqlite", options.sqlite_cache) \
+        if options.hit_store and replay is None else None
+
+    # exact-sequence index of the base database (see --dedup-sequences)
+    seq_index = None
+    if (options.dedup_sequences or options.mapping_cascade) and replay is None:
+        if options.append_to is not None and sequence_index_path(options.append_to).exists():
+            seq_index = SequenceIndex.read(sequence_index_path(options.append_to))
+        elif options.append_to is not None:
+            seq_index = SequenceIndex.from_proteins(component_proteins(options.append_to))
+        else:
+            seq_index = SequenceIndex()
+
+    # cluster and reciprocal-best-hit stages of the mapping search (see --mapping-cascade)
+    mapping_cascade = options.mapping_cascade and not options.single_search and replay is None
+
+    # hot/cold tiers of the merged graph (see --cold-below)
+    tier = TierStore(options.cold_below) if options.cold_below else None
 
-    for graph in range(1, int(n_graphs)):
+    # log each iteration's decisions so the merge can be replayed (continuing the previous log when appending)
+    decision_log = None
+    if replay is None:
+        if options.append_to is not None and not append_in_place and decision_log_path(options.append_to).exists():
+            shutil.copy2(decision_log_path(options.append_to), decision_log_path(options.outdir))
+        decision_log = DecisionLog(decision_log_path(options.outdir), truncate=options.append_to is None)
+
+    for graph in range(graph_count+1, int(n_graphs)):
         
+        # components may be Panaroo output directories or finished pangenomerge runs
         if graph_count == 0:
-            graph_file_1 = str(Path(graph_files.iloc[0][0]) / "final_graph.gml")
-            graph_file_2 = str(Path(graph_files.iloc[1][0]) / "final_graph.gml")
+            graph_file_1 = str(component_graph_path(component_dirs[0]))
+            graph_file_2 = str(component_graph_path(component_dirs[1]))
         else:
-            graph_file_1 = str(Path(options.outdir) / f"merged_graph_{graph_count}.gml")
-            graph_file_2 = str(Path(graph_files.iloc[int(graph_count+1)][0]) / "final_graph.gml")
+            previous_outdir = options.append_to if graph_count == previous_iterations else options.outdir
+            graph_file_1 = str(Path(previous_outdir) / f"merged_graph_{graph_count}.gml")
+            graph_file_2 = str(component_graph_path(component_dirs[graph_count+1]))
 
         logging.info(f"Beginning iteration {graph_count+1} of {n_graphs-1}...")
         logging.info(f"graph_file_1: {graph_file_1}")
@@ -182,13 +569,16 @@ def main():
 
         # keep merged graph in memory instead of repeatedly reading in
         if graph_count == 0:
-            graph_1, isolate_names, id_mapping = load_graphs([graph_file_1])
-            graph_1 = graph_1[0]
+            graph_1 = load_component_graph(component_dirs[0])
         else:
             graph_1 = merged_graph
 
-        graph_2, isolate_names, id_mapping = load_graphs([graph_file_2])
-        graph_2 = graph_2[0]
+        graph_2 = load_component_graph(component_dirs[graph_count+1])
+
+        # genome names of the members of the components merged in this iteration (stored with the export)
+        component_ids = [(component_dirs[graph_count+1], graph_count+2, component_genomes(component_dirs[graph_count+1], graph_2))]
+        if graph_count == 0:
+            component_ids.insert(0, (component_dirs[0], 1, component_genomes(component_dirs[0], graph_1)))
 
         if options.mode == 'test':
 
@@ -197,11 +587,11 @@ def main():
             ### match clustering_ids from overall run to clustering_ids from individual runs using annotation_ids (test only)
 
             gene_data_all = pd.read_csv(str(Path(options.graph_all) / "gene_data.csv"))
-            gene_data_g2 = pd.read_csv(str(Path(graph_files.iloc[int(graph_count+1)][0]) / "gene_data.csv"))
+            gene_data_g2 = pd.read_csv(str(Path(component_dirs[graph_count+1]) / "gene_data.csv"))
 
             if graph_count == 0:
                 logging.debug("Applying gene data...")
-                gene_data_g1 = pd.read_csv(str(Path(graph_files.iloc[int(graph_count)][0]) / "gene_data.csv"))
+                gene_data_g1 = pd.read_csv(str(Path(component_dirs[graph_count]) / "gene_data.csv"))
             else:
                 gene_data_g1 = None
                 # not necessary because merged graph already has gene_all seqIDs mapped
@@ -258,92 +648,305 @@ def main():
 
         # read in pangenome reference from graph 1
         if graph_count == 0:
-            pangenome_reference_g1 = str(Path(graph_files.iloc[0][0]) / "pan_genome_reference.fa")
+            pangenome_reference_g1 = component_reference(component_dirs[0])
         else:
             pangenome_reference_g1 = str(Path(options.outdir) / f"pan_genome_reference_{graph_count}.fa")
         
         # read in pangenome reference from graph 2
-        pangenome_reference_g2 = str(Path(graph_files.iloc[int(graph_count+1)][0]) / "pan_genome_reference.fa")
+        # (pangenomerge outputs have no reference but an amino acid database that is used as the query directly)
+        pangenome_reference_g2 = component_reference(component_dirs[graph_count+1])
+        query_db_g2 = component_query_db(component_dirs[graph_count+1])
+
+        # their databases may still hold removed nodes
+        removed_queries = component_removed_nodes(component_dirs[graph_count+1])
+        if graph_count == 0:
+            removed_nodes |= component_removed_nodes(component_dirs[0])
 
         # debug statement...
         logging.debug(f"pangenome reference g1: {pangenome_reference_g1}")
         logging.debug(f"pangenome reference g2: {pangenome_reference_g2}")
 
-        # info statement...
-        logging.info("Creating MMSeqs2 database(s)...")
+        if replay is None:
 
-        ### create mmseqs databases for faster search
+            if budget:
+                budget.check(f"iteration {graph_count+1}: mapping search")
 
-        # define paths for new databases
-        base_db = str(Path(options.outdir) / "mmseqs_tmp" / f"pan_genome_db_{graph_count+1}")
-        temp_db = str(Path(options.outdir) / "mmseqs_tmp" / f"temp_db")
-        
-        # always create new AA database for new graph
-        mmseqs_createdb(fasta=pangenome_reference_g2, outdb=temp_db, threads=options.threads, nt2aa=True)
+            # info statement...
+            logging.info("Creating MMSeqs2 database(s)...")
 
-        # create AA database for base graph on first iter only
-        if graph_count == 0:
-            mmseqs_createdb(fasta=pangenome_reference_g1, outdb=base_db, threads=options.threads, nt2aa=True)
+            ### create mmseqs databases for faster search
 
-        # info statement...
-        logging.info("Running MMSeqs2...")
-
-        ### run mmseqs on the two pangenome references
-        run_mmseqs_search(
-            targetdb=base_db,
-            querydb=temp_db,
-            resultdb = str(Path(options.outdir) / "mmseqs_tmp" / "resultdb"),
-            resultm8 = str(Path(options.outdir) / "mmseqs_tmp" / "mmseqs_clusters.m8"),
-            tmpdir = str(Path(options.outdir) / "mmseqs_tmp"),
-            threads=options.threads,
-            fident=0.98,
-            coverage=0.95
-        )
+            # define paths for new databases
+            # (sharded runs keep the last complete base database, as pan_genome_db_{N+1} is only written at the end)
+            if shards is None or graph_count == 0:
+                base_db = str(mmseqs_dir / f"pan_genome_db_{graph_count+1}")
+            temp_db = str(mmseqs_dir / f"temp_db")
         
-        # info statement...
-        logging.info("MMSeqs2 complete. Reading and filtering results...")
+            # the first base database is indexed under the first component's names
+            if seq_index is not None and graph_count == 0:
+                seq_index = SequenceIndex.from_proteins(component_proteins(component_dirs[0]))
+
+            # hits to removed nodes are dropped as they are read, except hits to a removed stored sequence
+            # that other nodes share, which are only dropped after expanding to those nodes
+            hit_exclude = seq_index.prefilter_targets(removed_nodes) if seq_index is not None else removed_nodes
+
+            # always create new AA database for new graph (unless already created by a speculative search or prefetch)
+            exact_hits = None
+            cascade_fa = None
+            unsearched = set() # queries only matched by hash or clustering
+            if speculation is not None:
+                temp_db = speculation["querydb"]
+            elif prefetch is not None:
+                temp_db = prefetch["querydb"]
+                prefetch["future"].result()
+            elif seq_index is not None:
+                # map queries identical to a base sequence by hash; only the rest are searched
+                query_fa = mmseqs_dir / "mapping_query.fa"
+                exact_hits, n_queries = split_exact_queries(
+                    component_proteins(component_dirs[graph_count+1]), seq_index, query_fa,
+                    exclude_targets=hit_exclude, exclude_queries=removed_queries)
+                unsearched = set(exact_hits["query"])
+                if n_queries and mapping_cascade:
+                    cascade_fa = query_fa # clustered with the base database below
+                elif n_queries:
+                    threads = sched.threads_for("createdb")
+                    with sched.phase("createdb", threads, units=os.path.getsize(query_fa)):
+                        mmseqs_createdb(fasta=query_fa, outdb=temp_db, threads=threads, nt2aa=False)
+                else:
+                    temp_db = None
+            elif query_db_g2 is not None:
+                temp_db = query_db_g2
+            else:
+                threads = sched.threads_for("createdb")
+                with sched.phase("createdb", threads, units=os.path.getsize(pangenome_reference_g2)):
+                    mmseqs_createdb(fasta=pangenome_reference_g2, outdb=temp_db, threads=threads, nt2aa=True)
+            prefetch = None
 
-        # read mmseqs results
-        # each "group_" refers to the centroid of that group in the pan_genomes_reference.fa
-        mmseqs = pd.read_csv(str(Path(options.outdir) / "mmseqs_tmp" / "mmseqs_clusters.m8"), sep='\t')
+            # create AA database for base graph on first iter only
+            if graph_count == 0:
+                if pangenome_reference_g1 is None:
+                    mmseqs_copydb(component_query_db(component_dirs[0]), base_db)
+                else:
+                    threads = sched.threads_for("createdb")
+                    with sched.phase("createdb", threads, units=os.path.getsize(pangenome_reference_g1)):
+                        mmseqs_createdb(fasta=pangenome_reference_g1, outdb=base_db, threads=threads, nt2aa=True)
+                if stager and shards is None: # sharded runs only copy back the final base database
+                    stager.copy_db_back(base_db)
+
+            # mapping search thresholds (one family-threshold search also serving the collapse stage with --single-search)
+            if options.single_search:
+                search_fident = options.family_threshold
+                search_coverage = float(round((options.family_threshold * 0.95), 3))
+                mapping_search_type = "single"
+            else:
+                search_fident, search_coverage = 0.98, 0.95
+                mapping_search_type = "mapping"
+
+            # index the base database once (first iteration, or the restored database when appending)
+            if target_index is not None and target_index.main is None:
+                threads = sched.threads_for("createindex")
+                with sched.phase("createindex", threads, units=mmseqs_db_size(base_db) / 1e9):
+                    target_index.rebuild(base_db, threads)
+            if shards is not None and not shards.targets:
+                threads = sched.threads_for("createindex")
+                with sched.phase("createindex", threads, units=mmseqs_db_size(base_db) / 1e9):
+                    shards.reset(base_db, threads)
+            if shards is not None:
+                target_dbs = shards.targets
+            elif target_index is not None:
+                target_dbs = target_index.targets
+            else:
+                target_dbs = [base_db]
+            target_size = sum(mmseqs_db_size(db) for db in target_dbs)
 
-        ### match hits from mmseqs
+            # info statement...
+            logging.info("Running MMSeqs2...")
+
+            # map the queries clustering with base nodes; only the rest are searched (see --mapping-cascade)
+            if cascade_fa is not None:
+                threads = sched.threads_for("mapping_search")
+                with sched.phase("mapping_search", threads, units=(os.path.getsize(cascade_fa) + target_size) / 1e9):
+                    cluster_hits, n_queries = linclust_queries(
+                        query_fa=cascade_fa, target_dbs=target_dbs, leftover_fa=mmseqs_dir / "mapping_leftover.fa",
+                        workdir=mmseqs_dir / "cascade", fident=0.98, coverage=0.95, threads=threads,
+                        exclude_targets=hit_exclude)
+                exact_hits = concat_hits([exact_hits, cluster_hits])
+                unsearched |= set(cluster_hits["query"])
+                if n_queries:
+                    threads = sched.threads_for("createdb")
+                    with sched.phase("createdb", threads, units=os.path.getsize(mmseqs_dir / "mapping_leftover.fa")):
+                        mmseqs_createdb(fasta=mmseqs_dir / "mapping_leftover.fa", outdb=temp_db, threads=threads,
+                                        nt2aa=False)
+                else:
+                    temp_db = None
+
+            if temp_db is None:
+
+                # every query was mapped by hash
+                mapping_m8s = []
+
+            elif speculation is not None:
+
+                # search against the previous base database was started during the last iteration
+                logging.info("Waiting for speculative MMSeqs2 search against previous base database...")
+                speculative_m8s = speculation["future"].result()
+                mapping_m8s = list(speculative_m8s)
+
+                # only the nodes added in the last iteration remain to be searched (none if they were all duplicates)
+                if new_nodes_db is not None:
+                    logging.info("Running MMSeqs2 delta search against nodes added in previous iteration...")
+                    threads = sched.threads_for("mapping_search")
+                    with sched.phase("mapping_search", threads, units=mmseqs_db_size(temp_db) * mmseqs_db_size(new_nodes_db) / 1e12):
+                        run_mmseqs_search(
+                            targetdb=new_nodes_db,
+                            querydb=temp_db,
+                            resultdb = str(mmseqs_dir / "resultdb"),
+                            resultm8 = str(mmseqs_dir / "mmseqs_clusters.m8"),
+                            tmpdir = str(mmseqs_dir),
+                            threads=threads,
+                            fident=search_fident,
+                            coverage=search_coverage,
+                            search_type=mapping_search_type
+                        )
+                    mapping_m8s.append(str(mmseqs_dir / "mmseqs_clusters.m8"))
 
-        # change the second graph node names to the first graph node names for nodes that match according to mmseqs
+            else:
 
-        # make sure metrics are numeric
-        mmseqs["fident"] = pd.to_numeric(mmseqs["fident"], errors='coerce')
-        mmseqs["evalue"] = pd.to_numeric(mmseqs["evalue"], errors='coerce')
-        mmseqs["tlen"] = pd.to_numeric(mmseqs["tlen"], errors='coerce')
-        mmseqs["qlen"] = pd.to_numeric(mmseqs["qlen"], errors='coerce')
+                ### run mmseqs on the two pangenome references
+                threads = sched.threads_for("mapping_search")
+                with sched.phase("mapping_search", threads, units=mmseqs_db_size(temp_db) * target_size / 1e12):
+                    mapping_m8s = run_mmseqs_search_targets(
+                        targetdbs=target_dbs,
+                        querydb=temp_db,
+                        resultdb = str(mmseqs_dir / "resultdb"),
+                        resultm8 = str(mmseqs_dir / "mmseqs_clusters.m8"),
+                        tmpdir = str(mmseqs_dir),
+                        threads=threads,
+                        fident=search_fident,
+                        coverage=search_coverage,
+                        search_type=mapping_search_type
+                    )
 
-        # define length difference
-        max_len = np.maximum(mmseqs['tlen'], mmseqs['qlen'])
-        mmseqs["len_dif"] = 1 - (np.abs(mmseqs["tlen"] - mmseqs["qlen"]) / max_len)
+            # info statement...
+            logging.info("MMSeqs2 complete. Reading and filtering results...")
+
+            # read mmseqs results (combining speculative and delta hits if present)
+            # each "group_" refers to the centroid of that group in the pan_genomes_reference.fa
+            # filter for fraction nt identity >= 98% (global) and length difference <= 5%
+            # only the best hit per query and table can be part of the one-to-one mapping, so no more is kept
+            def read_mapping_hits(mapping_m8):
+                chunksize = budget.hits_chunksize(mapping_m8, "mapping hits") if budget else None
+                if options.single_search:
+                    # keep every family-threshold hit for the collapse stage
+                    return read_hits(mapping_m8, min_fident=options.family_threshold,
+                                     min_len_dif=options.family_threshold*0.95, chunksize=chunksize,
+                                     exclude_targets=hit_exclude, exclude_queries=removed_queries)
+                return read_hits(mapping_m8, min_fident=0.98, min_len_dif=0.95, chunksize=chunksize,
+                                 exclude_targets=hit_exclude, exclude_queries=removed_queries, best_only=True)
+
+            hit_tables = [exact_hits] if exact_hits is not None else []
+            for mapping_m8 in mapping_m8s:
+                hit_tables.append(read_mapping_hits(mapping_m8))
+            mmseqs = concat_hits(hit_tables)
+            del hit_tables
+
+            # hits to a stored sequence also apply to the nodes sharing it
+            if seq_index is not None:
+                mmseqs = seq_index.expand(mmseqs, exclude_targets=removed_nodes)
+
+            # derive the 98% mapping hits from the family-threshold hits (coverage approximated from alignment length)
+            if options.single_search:
+                family_hits = mmseqs
+                mmseqs = mapping_hits(family_hits, min_fident=0.98, min_len_dif=0.95, min_coverage=0.95)
+
+            # start the next component's mapping search against the current base database while this iteration merges
+            # (from the second iteration on, when base database node names are final)
+            speculation = None
+            if speculation_executor is not None and graph_count >= 1 and graph_count + 2 < n_graphs:
+                slot = (graph_count + 1) % 2 # alternate paths so the next speculation can't overwrite the current one
+                spec_dir = mmseqs_dir / f"speculative_{slot}"
+                speculation = {"querydb": component_query_db(component_dirs[graph_count+2]) or str(spec_dir / "query_db")}
+                speculation["future"] = speculation_executor.submit(
+                    mmseqs_search_reference,
+                    fasta=component_reference(component_dirs[graph_count+2]),
+                    querydb=speculation["querydb"],
+                    targetdb=list(target_dbs),
+                    resultdb=str(spec_dir / "resultdb"),
+                    resultm8=str(spec_dir / "mmseqs_clusters.m8"),
+                    tmpdir=str(spec_dir / "tmp"),
+                    fident=search_fident,
+                    coverage=search_coverage,
+                    threads=options.threads,
+                    search_type=mapping_search_type,
+                )
+                logging.info(f"Started speculative mapping search for component {graph_count+3} against "
+                             f"{', '.join(Path(db).name for db in target_dbs)}")
 
-        # filter for fraction nt identity >= 98% (global) and length difference <= 5%
-        mmseqs = mmseqs[(mmseqs["fident"] >= 0.98) & (mmseqs["len_dif"] >= 0.95)].copy()
+            ### match hits from mmseqs
 
-        ### iterate over query with each unique value of query, and pick the match with the highest fident, then highest len_dif (see calculation)
-        # if still multiple matches, pick the first one
+            # change the second graph node names to the first graph node names for nodes that match according to mmseqs
 
-        # sort by fident (highest first), len_dif (highest first -- see calculation), and evalue (lowest first)
-        mmseqs_sorted = mmseqs.sort_values(by=["fident", "len_dif", "evalue"], ascending=[False, False, True],)
+            # debug statement...
+            logging.debug(f" {len(mmseqs)} hits above thresholds.")
+            logging.debug(f"{mmseqs}")
+
+            ### iterate over query with each unique value of query, and pick the match with the highest fident, then highest len_dif (see calculation)
+            # if still multiple matches, pick the first one
+            mmseqs_filtered = best_one_to_one(mmseqs)
+
+            # queries mapped by hash or clustering only have hits to the nodes they matched there; those losing
+            # every such node in the one-to-one mapping are searched after all, so they can still map to their
+            # next-best base node (and get family-threshold hits with --single-search), as without those stages
+            while True:
+                research = unsearched - set(mmseqs_filtered["query"])
+                if not research:
+                    break
+                unsearched -= research
+                logging.info(f"Searching {len(research)} queries that lost their hash or cluster match...")
+                research_fa = mmseqs_dir / "research_query.fa"
+                with open(research_fa, "w") as f:
+                    for name, protein in component_proteins(component_dirs[graph_count+1]):
+                        if name in research:
+                            f.write(f">{name}\n{protein}\n")
+                research_db = str(mmseqs_dir / "research_db")
+                threads = sched.threads_for("mapping_search")
+                with sched.phase("mapping_search", threads, units=os.path.getsize(research_fa) * target_size / 1e12):
+                    mmseqs_createdb(fasta=research_fa, outdb=research_db, threads=threads, nt2aa=False)
+                    research_m8s = run_mmseqs_search_targets(
+                        targetdbs=target_dbs,
+                        querydb=research_db,
+                        resultdb = str(mmseqs_dir / "research_resultdb"),
+                        resultm8 = str(mmseqs_dir / "research_clusters.m8"),
+                        tmpdir = str(mmseqs_dir),
+                        threads=threads,
+                        fident=search_fident,
+                        coverage=search_coverage,
+                        search_type=mapping_search_type
+                    )
+                research_hits = concat_hits([read_mapping_hits(m8) for m8 in research_m8s])
+                if seq_index is not None:
+                    research_hits = seq_index.expand(research_hits, exclude_targets=removed_nodes)
+                if options.single_search:
+                    family_hits = concat_hits([family_hits, research_hits])
+                    research_hits = mapping_hits(research_hits, min_fident=0.98, min_len_dif=0.95, min_coverage=0.95)
+                mmseqs = concat_hits([mmseqs, research_hits])
+                mmseqs_filtered = best_one_to_one(mmseqs)
 
-        # debug statement...
-        logging.debug(f" {len(mmseqs_sorted)} one-to-one hits.")
-        logging.debug(f"{mmseqs_sorted}")
+            # debug statement...
+            logging.debug(f"Filtered to {len(mmseqs_filtered)} one-to-one hits.")
+            logging.debug(f"{mmseqs_filtered}")
+            dups_query = mmseqs_filtered["query"].duplicated().sum()
+            dups_target = mmseqs_filtered["target"].duplicated().sum()
+            logging.debug(f"Remaining duplicates — query: {dups_query}, target: {dups_target}")
 
-        # only keep the first occurrence per unique query (highest fident, lowest length difference, then smallest evalue if tie)
-        mmseqs_filtered = mmseqs_sorted.drop_duplicates(subset=["query"], keep="first")
-        mmseqs_filtered = mmseqs_filtered.drop_duplicates(subset=["target"], keep="first") # test if dropping target vs. query duplicates first changes results
+        else:
 
-        # debug statement...
-        logging.debug(f"Filtered to {len(mmseqs_filtered)} one-to-one hits.")
-        logging.debug(f"{mmseqs_filtered}")
-        dups_query = mmseqs_filtered["query"].duplicated().sum()
-        dups_target = mmseqs_filtered["target"].duplicated().sum()
-        logging.debug(f"Remaining duplicates — query: {dups_query}, target: {dups_target}")
+            # replay: one-to-one mapping from the decision log
+            mmseqs_filtered = pd.DataFrame(replay[graph_count+1]["mapping"], columns=["query", "target"])
+
+        # bring back cold nodes that new nodes map to
+        if tier is not None and len(tier):
+            tier.promote(graph_1, mmseqs_filtered["target"])
 
         # info statement...
         logging.info("Hits filtered. Mapping between graphs...")
@@ -428,6 +1031,7 @@ def main():
         # convert df to dictionary with "query" as keys and "target" as values
         # this maps groups from graph_1 to groups from graph_2
         mapping = dict(zip(mmseqs_filtered["query"], mmseqs_filtered["target"]))
+        mapping_pairs = list(mapping.items())
 
         ### to avoid matching nodes from query that have the same group_id but are not the same:
         # append all nodes in target graph with _target
@@ -449,7 +1053,7 @@ def main():
 
         # reduce memory by removing intermediate files
         for name in [
-            "mmseqs", "mmseqs_sorted", "mmseqs_filtered",
+            "mmseqs", "mmseqs_filtered",
             "mapping_groups_1", "mapping_groups_2",
             "groupmapped_graph_1", "groupmapped_graph_2",
             "graph_1", "graph_2",
@@ -555,6 +1159,9 @@ def main():
 
         ### merge graphs
 
+        if budget:
+            budget.check(f"iteration {graph_count+1}: graph merge")
+
         # info statement...
         logging.info("Beginning graph merge...")
 
@@ -722,6 +1329,9 @@ def main():
             del relabeled_graph_2
         gc.collect()
 
+        if budget:
+            budget.check(f"iteration {graph_count+1}: collapse")
+
         # info statement...
         logging.info("Collapsing spurious paralogs...")
 
@@ -732,149 +1342,231 @@ def main():
         family_threshold = float(options.family_threshold)  # sequence identity threshold
         context_threshold = float(options.context_threshold)  # contextual similarity threshold 
 
-        # write query centroid fasta (stream to reduce memory)
+        # query centroid proteins (streamed to reduce memory)
+        def centroid_records(G):
+            for node, data in G.nodes(data=True):
+                name = node
+                if name.endswith("_target") or "_target" in name:
+                    # pre-existing nodes -- already in target db
+                    continue
+                else:
+                    # new nodes
+                    seqs = data["protein"]
+                    if isinstance(seqs, (list, tuple)):
+                        seqs = max(seqs, key=len) # if list, pick longest sequence
+                    if isinstance(seqs, str):
+                        parts = seqs.split(";") # if string split on semicolon and pick longest
+                        seqs = max(parts, key=len)
+                    seqs = seqs.rstrip('*') # remove trailing stop
+                    yield name, seqs
+
+        # write query centroid fasta
         def write_centroids_to_fasta(G, query_fa):
             with open(query_fa, "w") as ft:
-                for node, data in G.nodes(data=True):
-                    name = node
-                    if name.endswith("_target") or "_target" in name:
-                        # pre-existing nodes -- already in target db
-                        continue
-                    else:
-                        # new nodes
-                        seqs = data["protein"]
-                        if isinstance(seqs, (list, tuple)):
-                            seqs = max(seqs, key=len) # if list, pick longest sequence
-                        if isinstance(seqs, str):
-                            parts = seqs.split(";") # if string split on semicolon and pick longest
-                            seqs = max(parts, key=len)
-                        seqs = seqs.rstrip('*') # remove trailing stop
-                        name = node
-                        ft.write(f">{name}\n{seqs}\n")
-
-        query_fa = Path(options.outdir) / "mmseqs_tmp" / "centroids_query.fa"
-        write_centroids_to_fasta(merged_graph, query_fa)
-
-        # info statement
-        logging.info("Computing pairwise identities...")
+                for name, seqs in centroid_records(G):
+                    ft.write(f">{name}\n{seqs}\n")
 
-        # info statement...
-        logging.info("Creating MMSeqs2 database...")
+        if replay is None:
 
-        # create AA mmseqs database for query
-        query_db = Path(options.outdir) / "mmseqs_tmp" / "query_db"
-        mmseqs_createdb(fasta=query_fa, outdb=query_db, threads=options.threads, nt2aa=False)
+            if options.single_search:
 
-        # info statement...
-        logging.info("Running MMSeqs2...")
-
-        # run mmseqs to get hits, keeping only those above the minimum useful threshold (family_threshold, which is LOWER than context threshold)
-        run_mmseqs_search(
-            targetdb=base_db,
-            querydb=query_db,
-            resultdb = str(Path(options.outdir) / "mmseqs_tmp" / "resultdb"),
-            resultm8=str(Path(options.outdir) / "mmseqs_tmp" / "mmseqs_clusters.m8"),
-            tmpdir=str(Path(options.outdir) / "mmseqs_tmp"),
-            threads=options.threads,
-            fident=options.family_threshold,
-            coverage=float(round((options.family_threshold * 0.95), 3))
-        )
+                # collapse candidates come from this iteration's single search (see --single-search):
+                # hits of the nodes added to the merged graph, under their merged names
+                mmseqs = family_hits[family_hits["query"].isin(list(mapping_groups_new))].copy()
+                mmseqs = rename_nodes(mmseqs, "query", mapping_groups_new)
+                del family_hits
 
-        # info statement...
-        logging.info("MMSeqs2 complete. Reading and filtering results...")
+            else:
 
-        # read mmseqs results
-        mmseqs = pd.read_csv(Path(options.outdir) / "mmseqs_tmp" / "mmseqs_clusters.m8", sep="\t")
+                # (the hit store splits the queries by sequence, so it needs them as FASTA)
+                query_fa = mmseqs_dir / "centroids_query.fa"
+                query_db = mmseqs_dir / "query_db"
+                direct_query = options.direct_db and hit_store is None
+                if direct_query:
+                    n_collapse_queries = mmseqs_writedb(centroid_records(merged_graph), query_db)
+                else:
+                    write_centroids_to_fasta(merged_graph, query_fa)
+
+                # queries searched in an earlier iteration are only searched against the nodes added since,
+                # and their earlier hits reused (see --hit-store; base node names are final from the second iteration)
+                query_digests, stored_hits, collapse_m8s = None, None, []
+                collapse_fident = options.family_threshold
+                collapse_coverage = float(round((options.family_threshold * 0.95), 3))
+                if hit_store is not None and graph_count >= 1:
+                    search_fa = mmseqs_dir / "centroids_search.fa"
+                    reuse_fa = mmseqs_dir / "centroids_reuse.fa"
+                    query_digests, reused, searched_in = hit_store.split_queries(query_fa, search_fa, reuse_fa)
+                    query_fa = search_fa
+                    if reused:
+                        stored_hits = hit_store.stored_hits(reused, query_digests, exclude_targets=hit_exclude)
+                        added_fa = mmseqs_dir / "nodes_added.fa"
+                        if nodes_added_since(mmseqs_dir, searched_in, graph_count, added_fa):
+                            reuse_db = mmseqs_dir / "reuse_db"
+                            added_db = mmseqs_dir / "nodes_added_db"
+                            threads = sched.threads_for("createdb")
+                            with sched.phase("createdb", threads, units=os.path.getsize(reuse_fa) + os.path.getsize(added_fa)):
+                                mmseqs_createdb(fasta=reuse_fa, outdb=reuse_db, threads=threads, nt2aa=False)
+                                mmseqs_createdb(fasta=added_fa, outdb=added_db, threads=threads, nt2aa=False)
+                            threads = sched.threads_for("collapse_search")
+                            with sched.phase("collapse_search", threads, units=mmseqs_db_size(reuse_db) * mmseqs_db_size(added_db) / 1e12):
+                                run_mmseqs_search(
+                                    querydb=reuse_db,
+                                    targetdb=added_db,
+                                    resultdb=str(mmseqs_dir / "resultdb_reuse"),
+                                    resultm8=str(mmseqs_dir / "mmseqs_clusters_reuse.m8"),
+                                    tmpdir=str(mmseqs_dir),
+                                    threads=threads,
+                                    fident=collapse_fident,
+                                    coverage=collapse_coverage,
+                                    search_type="collapse"
+                                )
+                            collapse_m8s.append(str(mmseqs_dir / "mmseqs_clusters_reuse.m8"))
+
+                if (n_collapse_queries > 0) if direct_query else (os.path.getsize(query_fa) > 0):
+
+                    # info statement
+                    logging.info("Computing pairwise identities...")
+
+                    # info statement...
+                    logging.info("Creating MMSeqs2 database...")
+
+                    # create AA mmseqs database for query (already written with --direct-db)
+                    if not direct_query:
+                        threads = sched.threads_for("createdb")
+                        with sched.phase("createdb", threads, units=os.path.getsize(query_fa)):
+                            mmseqs_createdb(fasta=query_fa, outdb=query_db, threads=threads, nt2aa=False)
+
+                    # info statement...
+                    logging.info("Running MMSeqs2...")
+
+                    # run mmseqs to get hits, keeping only those above the minimum useful threshold (family_threshold, which is LOWER than context threshold)
+                    threads = sched.threads_for("collapse_search")
+                    with sched.phase("collapse_search", threads, units=mmseqs_db_size(query_db) * target_size / 1e12):
+                        collapse_m8s += run_mmseqs_search_targets(
+                            targetdbs=target_dbs,
+                            querydb=query_db,
+                            resultdb = str(mmseqs_dir / "resultdb"),
+                            resultm8=str(mmseqs_dir / "mmseqs_clusters.m8"),
+                            tmpdir=str(mmseqs_dir),
+                            threads=threads,
+                            fident=collapse_fident,
+                            coverage=collapse_coverage,
+                            search_type="collapse"
+                        )
+
+                # info statement...
+                logging.info("MMSeqs2 complete. Reading and filtering results...")
+
+                # read mmseqs results
+                # filter for identity ≥ 70% and length difference ≥ 70%
+                hit_tables = []
+                for collapse_m8 in collapse_m8s:
+                    chunksize = budget.hits_chunksize(collapse_m8, "collapse hits") if budget else None
+                    hit_tables.append(read_hits(collapse_m8, min_fident=family_threshold, min_len_dif=family_threshold*0.95,
+                                                chunksize=chunksize, exclude_targets=hit_exclude))
+                mmseqs = concat_hits(hit_tables) if hit_tables else hits_from_rows([])
+                del hit_tables
+
+                # store this iteration's hits (before expanding duplicates) and add the stored hits of reused queries
+                if query_digests is not None:
+                    hit_store.record(mmseqs, query_digests, graph_count)
+                    if stored_hits is not None:
+                        mmseqs = concat_hits([mmseqs, stored_hits])
+                    del stored_hits
+
+                if seq_index is not None:
+                    mmseqs = seq_index.expand(mmseqs, exclude_targets=removed_nodes)
+
+                # remove self-matches (target == query; compared by name codes)
+                mmseqs = mmseqs[mmseqs["target"] != mmseqs["query"]]
+
+            # bring back cold nodes that are candidate paralogs of new nodes (base nodes carry _target here)
+            if tier is not None and len(tier):
+                tier.promote(merged_graph, mmseqs["target"].unique(), suffix="_target")
+
+            # add _target to target node names (renames the name dictionary, not every row)
+            mmseqs = suffix_targets(mmseqs, "_target")
+
+            # debugging statements...
+            logging.debug(f"mmseqs filtered: {len(mmseqs)} hits remaining")
+            logging.debug(f"filtered mmseqs hits: {mmseqs.head()}")
 
-        # debugging statements...
-        logging.debug(f"Unfiltered: {len(mmseqs)} one-to-one hits.")
-        logging.debug(f"{mmseqs}")
+            # info statement...
+            logging.debug(f"Beginning context search...")
 
-        # ensure numeric columns
-        for col in ["fident", "evalue", "tlen", "qlen"]:
-            mmseqs[col] = pd.to_numeric(mmseqs[col], errors="coerce")
+            ### compute contextual similarity
 
-        # define length difference
-        max_len = np.maximum(mmseqs["tlen"], mmseqs["qlen"])
-        mmseqs["len_dif"] = 1 - (np.abs(mmseqs["tlen"] - mmseqs["qlen"]) / max_len)
+            # can still accidentally map together things from same genome by mapping a target node that's been merged into with a g2 node
+            # thus we check that member sets for the nodes are disjoint (don't contain any of the same genomes)
 
-        # filter for identity ≥ 70% and length difference ≥ 70%
-        mmseqs = mmseqs[(mmseqs["fident"] >= family_threshold) & (mmseqs["len_dif"] >= family_threshold*0.95)].copy()
+            # with --hit-store, identities between base nodes around the candidates come from earlier iterations' searches
+            base_pairs = ()
+            if hit_store is not None and graph_count >= 1 and len(mmseqs):
+                sources = {n for n in itertools.chain(mmseqs["query"].unique(), mmseqs["target"].unique()) if n in merged_graph}
+                around = nx.multi_source_dijkstra_path_length(merged_graph, sources, cutoff=3)
+                base_nodes = [n[:-len("_target")] for n in around if n.endswith("_target")]
+                base_pairs = [(f"{q}_target", f"{t}_target", fident) for q, t, fident in hit_store.hits_between(base_nodes)]
+                logging.debug(f"[hit store] {len(base_pairs)} stored identities between base nodes")
 
-        # remove self-matches (target == query)
-        mmseqs = mmseqs[mmseqs["target"] != mmseqs["query"]]
+            ident_lookup = build_ident_lookup(mmseqs, base_pairs)
+            init_parallel(merged_graph, ident_lookup, context_threshold, family_threshold)
 
-        # add _target to target node names
-        # possibly pretty memory/time intensive for big dataframes, see if can make this more efficient later
-        mmseqs["target"] += "_target"
+            # size worker pool (each forked worker dirties part of the parent's memory)
+            n_jobs = sched.threads_for("context_scoring")
+            if budget:
+                n_jobs = budget.pool_size(n_jobs, f"iteration {graph_count+1}: context scoring")
 
-        # debugging statements...
-        logging.debug(f"mmseqs filtered: {len(mmseqs)} hits remaining")
-        logging.debug(f"filtered mmseqs hits: {mmseqs.head()}")
+            if options.parallel_collapse:
 
-        # info statement...
-        logging.debug(f"Beginning context search...")
+                # score, accept and plan contractions per independent partition of candidate pairs
+                with sched.phase("context_scoring", n_jobs, units=len(mmseqs)):
+                    collapse_pairs = compute_collapse_parallel(mmseqs, n_jobs)
 
-        ### compute contextual similarity
+                # debug statement...
+                logging.debug(f"accepted pairs (by partition): {collapse_pairs[:10]}")
 
-        # can still accidentally map together things from same genome by mapping a target node that's been merged into with a g2 node
-        # thus we check that member sets for the nodes are disjoint (don't contain any of the same genomes)
+            else:
 
-        ident_lookup = build_ident_lookup(mmseqs)
-        init_parallel(merged_graph, ident_lookup, context_threshold)
-        scores = compute_scores_parallel(mmseqs, options.threads)
+                with sched.phase("context_scoring", n_jobs, units=len(mmseqs)):
+                    scores = compute_scores_parallel(mmseqs, n_jobs)
 
-        # debug statement...
-        logging.debug(f"scores: {scores[:5]}")
+                # debug statement...
+                logging.debug(f"scores: {scores[:5]}")
 
-        # sort dataframe by scores
-        scores_sorted = sorted(
-            scores,
-            key=lambda x: (x[2], x[3][0], x[3][1], x[3][2]),
-            reverse=True
-        )
+                # sort dataframe by scores
+                scores_sorted = sorted(
+                    scores,
+                    key=lambda x: (x[2], x[3][0], x[3][1], x[3][2]),
+                    reverse=True
+                )
 
-        # debug statement...
-        logging.debug(f"scores_sorted: {scores_sorted[:5]}")
-
-        # filter accepted pairs by identity + context thresholds
-        accepted_pairs = []
-        for nA, nB, ident, sims in scores_sorted:
-            if (
-                ident >= family_threshold
-                and sims[0] >= context_threshold
-                and (sims[1] >= context_threshold or sims[2] >= context_threshold)
-                and set(merged_graph.nodes[nA]['members']).isdisjoint(set(merged_graph.nodes[nB]['members'])) # check they do not share any members (genes within same genome will not be merged)
-            ):
-                accepted_pairs.append((nA, nB, ident, sims))
+                # debug statement...
+                logging.debug(f"scores_sorted: {scores_sorted[:5]}")
 
-        # debug statement...
-        logging.debug(f"accepted pairs (by context): {accepted_pairs[:10]}")
+                # filter accepted pairs by identity + context thresholds, keeping only the best match per node
+                # (reordered so 'a' is always the node with '_target')
+                collapse_pairs = [
+                    (a, b, ident, sims, None)
+                    for a, b, ident, sims in accept_pairs(merged_graph, scores_sorted, family_threshold, context_threshold)
+                ]
 
-        # filter out any duplicates (in order, so best match kept)
-        unique_pairs = []
-        seen_nodes = set()
-        for nA, nB, ident, sims in accepted_pairs:
-            if nA not in seen_nodes and nB not in seen_nodes:
-                unique_pairs.append((nA, nB, ident, sims))
-                seen_nodes.add(nA)
-                seen_nodes.add(nB)
+                # debug statement...
+                logging.debug(f"accepted pairs (reordered): {collapse_pairs[:10]}")
 
-        # debug statement...
-        logging.debug(f"accepted pairs (duplicates removed): {accepted_pairs[:10]}")
-
-        # reorder to ensure 'a' is always the node with '_target'
-        reordered_pairs = []
-        for a, b, ident, sims in unique_pairs:
-            if "_target" in b and "_target" not in a:
-                a, b = b, a
-            reordered_pairs.append((a, b))
-        
-        # debug statement...
-        logging.debug(f"accepted pairs (reordered): {reordered_pairs[:10]}")
+        else:
+
+            # replay: accepted pairs (with their scores) from the decision log
+            collapse_pairs = replay[graph_count+1]["collapse"]
+            if tier is not None and len(tier):
+                tier.promote(merged_graph, [a[:-len("_target")] for a, *_ in collapse_pairs], suffix="_target")
+
+        # record this iteration's decisions
+        if decision_log is not None:
+            components = component_dirs[:2] if graph_count == 0 else [component_dirs[graph_count+1]]
+            decision_log.append(graph_count+1, components, mapping_pairs, mapping_groups_new.values(), collapse_pairs)
 
         # reduce memory by removing intermediate files
-        for name in ["mmseqs", "scores", "scores_sorted", "accepted_pairs", "unique_pairs"]:
+        for name in ["mmseqs", "scores", "scores_sorted"]:
             if name in locals():
                 del locals()[name]
         gc.collect()
@@ -883,59 +1575,13 @@ def main():
         logging.info("Merging nodes and edges...")
 
         # merge the two sets of unique nodes into one set of unique nodes
-        for a,b in reordered_pairs:
-
-            # add metadata from second node
-
-            # seqIDs
-            merged_set = list(set(merged_graph.nodes[a]["seqIDs"]) | set(merged_graph.nodes[b]["seqIDs"]))
-            merged_graph.nodes[a]["seqIDs"] = merged_set
+        for a, b, ident, sims, attrs in collapse_pairs:
+            contract_pair(merged_graph, a, b, attrs)
 
-            # geneIDs
-            merged_set = ";".join([merged_graph.nodes[a]["geneIDs"], merged_graph.nodes[b]["geneIDs"]])
-            merged_graph.nodes[a]["geneIDs"] = merged_set
-
-            # members
-            merged_set = list(set(merged_graph.nodes[a]["members"]) | set(merged_graph.nodes[b]["members"]))
-            merged_graph.nodes[a]["members"] = merged_set
-
-            # genome IDs
-            merged_graph.nodes[a]["genomeIDs"] = ";".join([merged_graph.nodes[a]["genomeIDs"], merged_graph.nodes[b]["genomeIDs"]])
-
-            # size
-            size = len(merged_graph.nodes[a]["members"])
-
-            # lengths
-            merged_set = merged_graph.nodes[a]["lengths"] + merged_graph.nodes[b]["lengths"]
-            merged_graph.nodes[a]["lengths"] = merged_set
-
-            # move edges from b onto a before removing b
-            for neighbor in list(merged_graph.neighbors(b)):
-                #if neighbor == a:
-                #    continue
-                
-                # get edge attributes of b
-                edge_attrs = dict(merged_graph.get_edge_data(b, neighbor))
-                
-                # warn if don't have edge connecting neighbor
-                if not merged_graph.has_edge(b, neighbor):
-                    #edge_attrs = {}
-                    logging.critical("neighbor not connected by edge -- this shouldn't happen!")
-
-                if merged_graph.has_edge(a, neighbor):
-                    # if the edge exists, merge metadata
-                    merged_edge = merged_graph.edges[a, neighbor]
-                    merged_members = set(merged_edge.get("members", [])) | set(edge_attrs.get("members", []))
-                    merged_edge["members"] = list(merged_members)
-                    merged_edge["size"] = len(merged_members)
-                else:
-                    # otherwise add the edge
-                    merged_graph.add_edge(a, neighbor, **edge_attrs)
-            
-            # remove second node
-            merged_graph.remove_node(b)
-
-            # (don't add centroid/longCentroidID/annotation/dna/protein/hasEnd/mergedDNA/paralog/maxLenId -- keep as original for now)
+        # reconcile hot and cold tiers at checkpoints and at the end
+        tier_checkpoint = tier is not None and ((graph_count+1) % options.tier_checkpoint == 0 or graph_count == (n_graphs-2))
+        if tier_checkpoint and len(tier.cold):
+            tier.reconcile(merged_graph, suffix="_target")
 
         # update degrees across graph
         for node in merged_graph:
@@ -1054,6 +1700,8 @@ def main():
 
         # ensure metadata written in correct format
         format_metadata_for_gml(merged_graph)
+        if tier is not None:
+            tier.add_cold_degrees(merged_graph)
 
         # debug statement...
         logging.debug("After formatting metadata:")
@@ -1068,12 +1716,12 @@ def main():
         #        node_centroid_seq = max(seqs, key=len)
         #        fasta_out.write(f">{node}\n{node_centroid_seq}\n")
 
-        # after first iter, update base mmseqs database so first graph has _g1 appended node names
-        if graph_count == 0:
-            updated_node_names = Path(options.outdir) / "mmseqs_tmp" / f"tmp.fa"
-            with open(updated_node_names, "w") as fasta_out:
-                for node in merged_graph.nodes():
-                    name = node
+        # in replay mode there is no base database to update
+        if replay is None:
+
+            # base database proteins of merged graph nodes, skipping sequences already stored (see --dedup-sequences)
+            def base_records(nodes):
+                for node in nodes:
                     seqs = merged_graph.nodes[node]["protein"]
                     if isinstance(seqs, (list, tuple)):
                         seqs = max(seqs, key=len) # if list, pick longest sequence
@@ -1081,103 +1729,169 @@ def main():
                         parts = seqs.split(";") # if string split on semicolon and pick longest
                         seqs = max(parts, key=len)
                     seqs = seqs.rstrip('*') # remove trailing stop
-                    fasta_out.write(f">{node}\n{seqs}\n")
-
-            outdb = str(Path(options.outdir) / "mmseqs_tmp" / f"pan_genome_db_{graph_count+2}")
-            mmseqs_createdb(fasta=updated_node_names, outdb=outdb, threads=options.threads, nt2aa=False)
-            base_db = outdb
-            
-        else:
-            # write new nodes to fasta to update mmseqs db
-            new_nodes_fasta = Path(options.outdir) / "mmseqs_tmp" / f"new_nodes_{graph_count+2}.fa"
-            with open(new_nodes_fasta, "w") as fasta_out:
-                for node in merged_graph.nodes():
-                    name = node
-                    if name.endswith(f'_g{graph_count+2}'):
-                        seqs = merged_graph.nodes[node]["protein"]
-                        if isinstance(seqs, (list, tuple)):
-                            seqs = max(seqs, key=len) # if list, pick longest sequence
-                        if isinstance(seqs, str):
-                            parts = seqs.split(";") # if string split on semicolon and pick longest
-                            seqs = max(parts, key=len)
-                        seqs = seqs.rstrip('*') # remove trailing stop
-                        fasta_out.write(f">{node}\n{seqs}\n")
-
-            # update mmseqs database
-            new_nodes_db = str(Path(options.outdir) / "mmseqs_tmp" / f"tmp_db")
-            outdb = str(Path(options.outdir) / "mmseqs_tmp" / f"pan_genome_db_{graph_count+2}")
-
-            mmseqs_createdb(fasta=new_nodes_fasta, outdb=new_nodes_db, threads=options.threads, nt2aa=False)
-            mmseqs_concatdbs(db1=base_db, db2=new_nodes_db, outdb=outdb, tmpdir=str(Path(options.outdir) / "mmseqs_tmp"), threads=options.threads)
-            base_db = outdb
+                    if seq_index is not None and not seq_index.add(node, seqs):
+                        continue # identical sequence already in the base database
+                    yield node, seqs
 
-        # info statement...
-        logging.info('Writing new metadata to SQLite database...')
-
-        # add metadata to SQLite database
-        add_metadata_to_sqlite(G=merged_graph, iteration=graph_count+1, con=con)
-
-        # ensure WAL doesn't increase dramatically (execute after iteration finishes)
-        con.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+            # after first iter, update base mmseqs database so first graph has _g1 appended node names
+            if graph_count == 0:
+                if seq_index is not None:
+                    seq_index.clear() # reindexed under the merged names
+                outdb = str(mmseqs_dir / f"pan_genome_db_{graph_count+2}")
 
-        # info statement...
-        logging.info('Writing merged graph to outdir...')
+                if options.direct_db:
+                    # stream the node proteins straight into the database (see --direct-db)
+                    mmseqs_writedb(base_records(merged_graph.nodes()), outdb)
+                else:
+                    updated_node_names = mmseqs_dir / f"tmp.fa"
+                    with open(updated_node_names, "w") as fasta_out:
+                        for node, seqs in base_records(merged_graph.nodes()):
+                            fasta_out.write(f">{node}\n{seqs}\n")
+
+                    threads = sched.threads_for("createdb")
+                    with sched.phase("createdb", threads, units=os.path.getsize(updated_node_names)):
+                        mmseqs_createdb(fasta=updated_node_names, outdb=outdb, threads=threads, nt2aa=False)
+            
+            else:
+                # new nodes of this iteration
+                new_nodes = (node for node in merged_graph.nodes() if node.endswith(f'_g{graph_count+2}'))
+                new_nodes_fasta = mmseqs_dir / f"new_nodes_{graph_count+2}.fa"
+
+                # update mmseqs database
+                new_nodes_db = str(mmseqs_dir / f"tmp_db")
+                outdb = str(mmseqs_dir / f"pan_genome_db_{graph_count+2}")
+
+                if options.direct_db:
+                    # stream the new nodes straight into their database (see --direct-db)
+                    # (their FASTA is only kept for the hit store, which searches the nodes added since a search)
+                    n_new_sequences = mmseqs_writedb(base_records(new_nodes), new_nodes_db,
+                                                     fasta=new_nodes_fasta if hit_store is not None else None)
+                else:
+                    # write new nodes to fasta to update mmseqs db
+                    n_new_sequences = 0
+                    with open(new_nodes_fasta, "w") as fasta_out:
+                        for node, seqs in base_records(new_nodes):
+                            fasta_out.write(f">{node}\n{seqs}\n")
+                            n_new_sequences += 1
+
+                if n_new_sequences == 0:
+                    # nothing new to store (every new node duplicates a stored sequence)
+                    new_nodes_db = None
+                elif not options.direct_db:
+                    threads = sched.threads_for("createdb")
+                    with sched.phase("createdb", threads, units=os.path.getsize(new_nodes_fasta)):
+                        mmseqs_createdb(fasta=new_nodes_fasta, outdb=new_nodes_db, threads=threads, nt2aa=False)
+
+                if shards is not None:
+                    # new nodes go into a new shard; the complete base database is only written after the last iteration
+                    threads = sched.threads_for("concatdbs")
+                    with sched.phase("concatdbs", threads, units=(mmseqs_db_size(new_nodes_db) if new_nodes_db else 0) / 1e9):
+                        superseded_shards = shards.append(new_nodes_db, threads) if new_nodes_db is not None else []
+                        if graph_count == n_graphs - 2:
+                            shards.consolidate(outdb, threads)
+                        else:
+                            outdb = None
+                elif new_nodes_db is None:
+                    mmseqs_linkdb(base_db, outdb)
+                else:
+                    threads = sched.threads_for("concatdbs")
+                    with sched.phase("concatdbs", threads, units=mmseqs_db_size(base_db) / 1e9):
+                        mmseqs_concatdbs(db1=base_db, db2=new_nodes_db, outdb=outdb, tmpdir=str(mmseqs_dir), threads=threads)
+
+                if seq_index is not None:
+                    logging.info(f"[dedup] base database stores {len(seq_index)} sequences for "
+                                 f"{len(seq_index) + seq_index.n_duplicates()} nodes")
+
+            # update the target index: renamed nodes of the first iteration need a new main index,
+            # later iterations only add their new nodes to the side database
+            if target_index is not None:
+                threads = sched.threads_for("createindex")
+                with sched.phase("createindex", threads, units=mmseqs_db_size(outdb) / 1e9):
+                    if graph_count == 0:
+                        superseded = target_index.rebuild(outdb, threads)
+                    elif new_nodes_db is not None:
+                        superseded = target_index.add(new_nodes_db, outdb, threads)
+                    else:
+                        superseded = []
+                if speculation is not None:
+                    speculation["future"].result() # speculative search still reads the superseded databases
+                target_index.remove(superseded)
+
+            # with --sharded-db, the renamed first base database becomes the only shard and
+            # superseded shards and complete base databases of this run are deleted
+            if shards is not None:
+                if graph_count == 0:
+                    threads = sched.threads_for("createindex")
+                    with sched.phase("createindex", threads, units=mmseqs_db_size(outdb) / 1e9):
+                        superseded_shards = shards.reset(outdb, threads)
+                if outdb is not None and base_db != restored_db:
+                    superseded_shards.append(base_db)
+                if speculation is not None:
+                    speculation["future"].result() # speculative search still reads the superseded databases
+                if stager and outdb is not None and base_db in superseded_shards:
+                    superseded_shards.remove(base_db)
+                    stager.remove_db(base_db)
+                shards.remove(superseded_shards)
+                if graph_count == n_graphs - 2:
+                    shards.remove(shards.targets) # written out as the final base database
+
+            # copy new base database back to outdir in the background and drop the superseded one from scratch
+            # (sharded runs only write the final base database)
+            if stager and outdb is not None and (shards is None or graph_count == n_graphs - 2):
+                stager.copy_db_back(outdb)
+                if speculation is not None:
+                    speculation["future"].result() # speculative search still reads the superseded database
+                stager.remove_db(base_db)
+            if outdb is not None:
+                base_db = outdb
+
+        if budget:
+            budget.check(f"iteration {graph_count+1}: export")
 
         # define new graph name 
         output_path = Path(options.outdir) / f"merged_graph_{graph_count+1}.gml"
+        nometadata_path = None
+        if graph_count == (n_graphs-2):
+            nometadata_path = Path(options.outdir) / f"merged_graph_{graph_count+1}_nometadata.gml"
+
+        # build the next component's database while this iteration is exported (single-threaded Python)
+        if options.adaptive_threads and replay is None and speculation is None and graph_count + 2 < n_graphs \
+                and component_query_db(component_dirs[graph_count+2]) is None:
+            prefetch = {"querydb": str(mmseqs_dir / "temp_db_prefetch")}
+            prefetch["future"] = sched.submit(
+                "createdb", sched.total - 1, mmseqs_createdb,
+                fasta=component_reference(component_dirs[graph_count+2]),
+                outdb=prefetch["querydb"], nt2aa=True,
+                units=os.path.getsize(component_reference(component_dirs[graph_count+2])),
+            )
 
-        if options.keep_metadata_in_graph is True:
-            # write new graph to GML with all metadata
-            nx.write_gml(merged_graph, str(output_path))
-
-        if options.keep_metadata_in_graph is not True:
-            # write new graph to GML without metadata (to allow for slow nx write speed)
-            for n in merged_graph.nodes():
-                degrees = merged_graph.nodes[n]["degrees"]
-                merged_graph.nodes[n].clear()
-                merged_graph.nodes[n]["name"] = n
-                merged_graph.nodes[n]["seqIDs"] = []
-                merged_graph.nodes[n]["geneIDs"] = ''
-                merged_graph.nodes[n]["members"] = []
-                merged_graph.nodes[n]["genomeIDs"] = ''
-                merged_graph.nodes[n]["size"] = 1
-                merged_graph.nodes[n]["lengths"] = []
-                merged_graph.nodes[n]['longCentroidID'] = [] 
-                merged_graph.nodes[n]['maxLenId'] = ''
-                merged_graph.nodes[n]['centroid'] = []
-                merged_graph.nodes[n]['dna'] = [""]
-                merged_graph.nodes[n]['protein'] = [""]
-                merged_graph.nodes[n]["hasEnd"] = 0
-                merged_graph.nodes[n]["annotation"] = ''
-                merged_graph.nodes[n]["description"] = ''
-                merged_graph.nodes[n]["paralog"] = 0
-                merged_graph.nodes[n]["mergedDNA"] = ''
-                merged_graph.nodes[n]["degrees"] = degrees
-                
-            for u, v in merged_graph.edges():
-                merged_graph[u][v].clear()
-                merged_graph[u][v]["name"] = n
-                merged_graph[u][v]["size"] = 1
-                merged_graph[u][v]["members"] = []
-                merged_graph[u][v]['genomeIDs'] = ''
-            
-            nx.write_gml(merged_graph, str(output_path))
-
-        if options.keep_metadata_in_graph is True:
-            # write an additional version of the final graph that doesn't have metadata
-            if graph_count == (n_graphs-2):
-                output_path = Path(options.outdir) / f"merged_graph_{graph_count+1}_nometadata.gml"
-                for n in merged_graph.nodes():
-                    merged_graph.nodes[n].clear()
-                for u, v in merged_graph.edges():
-                    merged_graph[u][v].clear()
-                nx.write_gml(merged_graph, str(output_path))
+        # member genome names and seqID -> geneID pairs of the new components, used by the remove and extract modes
+        # (seqIDs are not suffixed in test mode); written before the snapshot so only one process writes at a time
+        if snapshot_writer is not None:
+            snapshot_writer.wait()
+        for component_dir, number, genomes in component_ids:
+            add_component_ids_to_sqlite(con, number, genomes,
+                                        component_gene_ids(component_dir) if options.mode != 'test' else [])
+
+        if snapshot_writer is not None:
+            # export from a snapshot in a helper process while this process moves on to the next iteration
+            snapshot_writer.submit(merged_graph, graph_count+1, output_path, options.keep_metadata_in_graph, nometadata_path)
+            if options.keep_metadata_in_graph is not True:
+                strip_metadata(merged_graph)
+        else:
+            export_iteration(merged_graph, graph_count+1, con, output_path, options.keep_metadata_in_graph, nometadata_path)
+
+        # recompute tiers from the sizes just exported (the last iteration stays reconciled)
+        if tier_checkpoint and graph_count < (n_graphs-2):
+            if snapshot_writer is not None:
+                snapshot_writer.wait()
+            tier.demote(merged_graph, *tier_sizes(merged_graph, con, options.keep_metadata_in_graph))
 
         # reduce memory by removing intermediate files
         for name in [
             "mapping", "mapping_target", "mapping_groups_new",
             "centroids_fa",
-            "reordered_pairs",
+            "collapse_pairs",
         ]:
             if name in locals():
                 del locals()[name]
@@ -1189,12 +1903,42 @@ def main():
         # print progress statement...
         logging.info(f"Iteration {graph_count} of {n_graphs-1} complete.")
     
+    if speculation_executor is not None:
+        speculation_executor.shutdown()
+
+    # wait for the last background export
+    if snapshot_writer is not None:
+        snapshot_writer.wait()
+
+    sched.shutdown()
+    if options.adaptive_threads:
+        sched.summary()
+
+    # keep the sequence index so the run can be appended to or assigned against
+    if seq_index is not None:
+        seq_index.write(sequence_index_path(options.outdir))
+
     # create indexes for SQLite database
     sqlite_create_indexes(con)
 
     # close connection to sqlite db
     con.close()
 
+    # copy SQLite database back and wait for outstanding copies before removing scratch
+    if stager:
+        logging.info("Copying SQLite database from scratch to outdir...")
+        stager.copy_file_back(live_sqlite_path)
+        stager.cleanup()
+
+    if hit_store is not None:
+        hit_store.close()
+
+    if sensitivity is not None:
+        sensitivity.summary()
+
+    if options.db_cache:
+        logging.info(f"[db cache] {db_cache.hits} translated databases reused, {db_cache.misses} built")
+
     # info statement...
     logging.info('Finished successfully.')
 
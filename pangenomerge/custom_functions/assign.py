@@ -0,0 +1,173 @@
+import logging
+import multiprocessing as mp
+from collections import defaultdict
+import networkx as nx
+import pandas as pd
+from pathlib import Path
+
+from custom_functions.run_mmseqs import run_mmseqs_search, mmseqs_createdb
+from custom_functions.hits import read_hits, best_one_to_one
+from custom_functions.relabel_nodes import relabel_nodes_preserve_attrs
+from custom_functions.context_similarity import build_ident_lookup, init_parallel, score_pair_context
+from custom_functions.collapse import accept_pairs
+from custom_functions.outputs import latest_iteration, merged_graph_path, base_db_path, read_removed_nodes, \
+    load_merged_graph, sqlite_path
+from custom_functions.sqlite import sqlite_connect_readonly
+from custom_functions.components import load_component_graph, component_query_db, component_reference
+from custom_functions.sequence_index import SequenceIndex, sequence_index_path
+
+# frozen base graph shared with forked workers
+BASE_GRAPH = None
+REMOVED_NODES = set()
+SEQ_INDEX = None # nodes sharing a stored sequence, if the reference was merged with --dedup-sequences
+
+# removed nodes whose hits can be dropped as they are read (see SequenceIndex.prefilter_targets)
+def hit_exclude():
+    return SEQ_INDEX.prefilter_targets(REMOVED_NODES) if SEQ_INDEX is not None else REMOVED_NODES
+
+# hits to a stored sequence also apply to the nodes sharing it
+def expand_hits(hits):
+    return SEQ_INDEX.expand(hits, exclude_targets=REMOVED_NODES) if SEQ_INDEX is not None else hits
+
+# relabel integer node labels from load_graphs() to their group names (no-op for pangenomerge outputs)
+def group_named_graph(G):
+    return relabel_nodes_preserve_attrs(G, {n: str(G.nodes[n].get("name", "error")) for n in G.nodes()})
+
+# merged graph of a finished run with its node members restored from the run's SQLite
+# (the exported GML carries no metadata, and members are needed to keep genes of one genome apart)
+def load_base_graph(reference, iteration, sqlite_cache: int):
+    G = load_merged_graph(merged_graph_path(reference, iteration))
+    con = sqlite_connect_readonly(database=sqlite_path(reference), sqlite_cache=sqlite_cache)
+    members = defaultdict(list)
+    for node_id, member in con.execute("SELECT node_id, member FROM node_members"):
+        members[node_id].append(member)
+    con.close()
+    for n in G.nodes():
+        G.nodes[n]["members"] = members.get(n) or G.nodes[n].get("members") or []
+    return G
+
+# depth-limited neighbourhood of a set of base nodes (enough context for depth-3 scoring)
+def base_neighbourhood(G, nodes, depth: int = 3):
+    keep = set()
+    for n in nodes:
+        if n in G:
+            keep.update(nx.single_source_shortest_path_length(G, n, cutoff=depth).keys())
+    return G.subgraph(keep).copy()
+
+# assign the nodes of one component graph to COGs of the frozen base without changing it
+def assign_component(task):
+
+    component_dir, workdir, base_db, threads, family_threshold, context_threshold = task
+    component_dir = Path(component_dir)
+    workdir = Path(workdir)
+    mmseqs_dir = workdir / "mmseqs_tmp"
+    mmseqs_dir.mkdir(parents=True, exist_ok=True)
+
+    logging.info(f"Assigning {component_dir}...")
+
+    component = group_named_graph(load_component_graph(component_dir))
+
+    # pangenomerge outputs are searched with their own database
+    query_db = component_query_db(component_dir)
+    if query_db is None:
+        query_db = str(mmseqs_dir / "query_db")
+        mmseqs_createdb(fasta=component_reference(component_dir), outdb=query_db, threads=threads, nt2aa=True)
+
+    # one-to-one mapping at >= 98% identity and length difference <= 5% (as in the merge)
+    run_mmseqs_search(
+        querydb=query_db,
+        targetdb=base_db,
+        resultdb=str(mmseqs_dir / "resultdb"),
+        resultm8=str(mmseqs_dir / "mapping.m8"),
+        tmpdir=str(mmseqs_dir),
+        fident=0.98,
+        coverage=0.95,
+        threads=threads)
+    mapped = expand_hits(read_hits(str(mmseqs_dir / "mapping.m8"), min_fident=0.98, min_len_dif=0.95, exclude_targets=hit_exclude()))
+    mapped = best_one_to_one(mapped[mapped["query"].isin(list(component.nodes))])
+    mapping = dict(zip(mapped["query"], mapped["target"]))
+
+    # family-threshold search for the remaining nodes, to be scored by context
+    run_mmseqs_search(
+        querydb=query_db,
+        targetdb=base_db,
+        resultdb=str(mmseqs_dir / "resultdb"),
+        resultm8=str(mmseqs_dir / "family.m8"),
+        tmpdir=str(mmseqs_dir),
+        fident=family_threshold,
+        coverage=float(round((family_threshold * 0.95), 3)),
+        threads=threads)
+    hits = expand_hits(read_hits(str(mmseqs_dir / "family.m8"), min_fident=family_threshold, min_len_dif=family_threshold*0.95,
+                                 exclude_targets=hit_exclude()))
+    hits = hits[~hits["query"].isin(list(mapping)) & hits["query"].isin(list(component.nodes))].copy()
+
+    # combined context graph: base neighbourhood of all candidates, plus the component with
+    # mapped nodes under their base names and unmapped nodes as <name>_query
+    # component members are tagged (as in the merge) and mapped nodes add theirs to the base node,
+    # so a gene is not assigned to a node that already holds a gene of the same genome
+    names = {n: mapping.get(n, f"{n}_query") for n in component.nodes}
+    H = base_neighbourhood(BASE_GRAPH, set(hits["target"]) | set(mapping.values()))
+    for n, data in component.nodes(data=True):
+        members = [f"{member}_query" for member in data.get("members", [])]
+        if names[n] in H:
+            H.nodes[names[n]]["members"] = list(set(H.nodes[names[n]].get("members") or []) | set(members))
+        else:
+            H.add_node(names[n], **{**data, "members": members})
+    for u, v in component.edges():
+        if names[u] != names[v]:
+            H.add_edge(names[u], names[v])
+    for n in H.nodes():
+        H.nodes[n]["members"] = H.nodes[n].get("members") or []
+
+    hits["query"] = hits["query"].map(names)
+    init_parallel(H, build_ident_lookup(hits) if len(hits) else {}, context_threshold, family_threshold)
+    scores = [score_pair_context(row) for row in hits.to_dict(orient="records")]
+    scores_sorted = sorted(scores, key=lambda x: (x[2], x[3][0], x[3][1], x[3][2]), reverse=True)
+    accepted = accept_pairs(H, scores_sorted, family_threshold, context_threshold)
+
+    # write assignment table and novel genes
+    rows = [(q, t, "mapping", f, None, None, None) for q, t, f in zip(mapped["query"], mapped["target"], mapped["fident"])]
+    for a, b, ident, sims in accepted:
+        query, target = (a, b) if a.endswith("_query") else (b, a)
+        rows.append((query[:-len("_query")], target, "context", ident, sims[0], sims[1], sims[2]))
+    assignments = pd.DataFrame(rows, columns=["query", "assigned_node", "method", "fident", "context_1", "context_2", "context_3"])
+    assignments.to_csv(workdir / "assignments.tsv", sep="\t", index=False)
+
+    assigned = set(assignments["query"])
+    novel = sorted(n for n in component.nodes if n not in assigned)
+    with open(workdir / "novel_genes.txt", "w") as f:
+        for n in novel:
+            f.write(f"{n}\n")
+
+    logging.info(f"{component_dir}: {len(mapping)} mapped, {len(accepted)} assigned by context, {len(novel)} novel")
+    return str(workdir), len(mapping), len(accepted), len(novel)
+
+# assign every component in parallel against a finished merge
+def run_assign(component_dirs, reference, outdir, threads, family_threshold, context_threshold, sqlite_cache: int):
+    global BASE_GRAPH, REMOVED_NODES, SEQ_INDEX
+
+    iteration = latest_iteration(reference)
+    base_db = str(base_db_path(reference, iteration))
+    logging.info(f"Loading frozen reference graph {merged_graph_path(reference, iteration)}...")
+    BASE_GRAPH = load_base_graph(reference, iteration, sqlite_cache)
+    REMOVED_NODES = read_removed_nodes(reference)
+    if sequence_index_path(reference).exists():
+        SEQ_INDEX = SequenceIndex.read(sequence_index_path(reference))
+
+    n_workers = max(1, min(len(component_dirs), threads))
+    threads_per_worker = max(1, threads // n_workers)
+    tasks = []
+    for i, component_dir in enumerate(component_dirs):
+        workdir = Path(outdir) / "assign" / f"{i+1}_{Path(component_dir).name}"
+        tasks.append((component_dir, str(workdir), base_db, threads_per_worker, family_threshold, context_threshold))
+
+    # fork so workers share the frozen base graph
+    ctx = mp.get_context("fork")
+    with ctx.Pool(processes=n_workers) as pool:
+        results = pool.map(assign_component, tasks, chunksize=1)
+
+    summary = pd.DataFrame(results, columns=["workdir", "mapped", "context_assigned", "novel"])
+    summary.insert(0, "component", component_dirs)
+    summary.to_csv(Path(outdir) / "assign" / "assignment_summary.tsv", sep="\t", index=False)
+
+    return summary
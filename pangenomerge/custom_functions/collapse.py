@@ -0,0 +1,70 @@
+import logging
+
+# filter scored pairs by identity + context thresholds, then keep the best match per node
+# scores must already be sorted best first; each node is used at most once
+def accept_pairs(G, scores_sorted, family_threshold, context_threshold):
+
+    unique_pairs = []
+    seen_nodes = set()
+    for nA, nB, ident, sims in scores_sorted:
+        if nA in seen_nodes or nB in seen_nodes:
+            continue
+        if (
+            ident >= family_threshold
+            and sims[0] >= context_threshold
+            and (sims[1] >= context_threshold or sims[2] >= context_threshold)
+            and set(G.nodes[nA]['members']).isdisjoint(set(G.nodes[nB]['members'])) # check they do not share any members (genes within same genome will not be merged)
+        ):
+            unique_pairs.append((nA, nB, ident, sims))
+            seen_nodes.add(nA)
+            seen_nodes.add(nB)
+
+    # reorder to ensure 'a' is always the node with '_target'
+    reordered_pairs = []
+    for a, b, ident, sims in unique_pairs:
+        if "_target" in b and "_target" not in a:
+            a, b = b, a
+        reordered_pairs.append((a, b, ident, sims))
+
+    return reordered_pairs
+
+# combined metadata of node a after absorbing node b
+# (don't add centroid/longCentroidID/annotation/dna/protein/hasEnd/mergedDNA/paralog/maxLenId -- keep as original for now)
+def merged_pair_attrs(G, a, b):
+    A = G.nodes[a]
+    B = G.nodes[b]
+    return {
+        "seqIDs": list(set(A["seqIDs"]) | set(B["seqIDs"])),
+        "geneIDs": ";".join([A["geneIDs"], B["geneIDs"]]),
+        "members": list(set(A["members"]) | set(B["members"])),
+        "genomeIDs": ";".join([A["genomeIDs"], B["genomeIDs"]]),
+        "lengths": A["lengths"] + B["lengths"],
+    }
+
+# collapse node b into node a, moving b's edges onto a before removing b
+# attrs can be precomputed (e.g. by a worker process) with merged_pair_attrs
+def contract_pair(G, a, b, attrs=None):
+
+    if attrs is None:
+        attrs = merged_pair_attrs(G, a, b)
+    G.nodes[a].update(attrs)
+
+    for neighbor in list(G.neighbors(b)):
+
+        # get edge attributes of b
+        edge_attrs = dict(G.get_edge_data(b, neighbor))
+
+        if G.has_edge(a, neighbor):
+            # if the edge exists, merge metadata
+            merged_edge = G.edges[a, neighbor]
+            merged_members = set(merged_edge.get("members", [])) | set(edge_attrs.get("members", []))
+            merged_edge["members"] = list(merged_members)
+            merged_edge["size"] = len(merged_members)
+        else:
+            # otherwise add the edge
+            G.add_edge(a, neighbor, **edge_attrs)
+
+    # remove second node
+    G.remove_node(b)
+
+    return G
@@ -0,0 +1,138 @@
+import csv
+import sqlite3
+from pathlib import Path
+from collections import defaultdict
+from Bio import SeqIO
+from custom_functions.outputs import latest_iteration, merged_graph_path, base_db_path, sqlite_path, \
+    load_merged_graph, read_removed_nodes
+from custom_functions.sqlite import sqlite_has_table
+from panaroo_functions.load_graphs import load_graphs
+from panaroo_functions.merge_nodes import del_dups
+
+# component inputs are Panaroo output directories (final_graph.gml, pan_genome_reference.fa)
+# or finished pangenomerge runs (merged_graph_<N>.gml, pangenome_metadata.sqlite, mmseqs_tmp/pan_genome_db_<N+1>)
+
+def is_pangenomerge_output(component_dir) -> bool:
+    return sqlite_path(component_dir).exists() and any(Path(component_dir).glob("merged_graph_*.gml"))
+
+def component_graph_path(component_dir) -> Path:
+    if is_pangenomerge_output(component_dir):
+        return merged_graph_path(component_dir, latest_iteration(component_dir))
+    return Path(component_dir) / "final_graph.gml"
+
+# Panaroo reference FASTA (None for pangenomerge outputs, which have an MMseqs2 database instead)
+def component_reference(component_dir):
+    if is_pangenomerge_output(component_dir):
+        return None
+    return str(Path(component_dir) / "pan_genome_reference.fa")
+
+# amino acid MMseqs2 database of a pangenomerge output, usable directly as a query database
+def component_query_db(component_dir):
+    if is_pangenomerge_output(component_dir):
+        return str(base_db_path(component_dir, latest_iteration(component_dir)))
+    return None
+
+# nodes of a component that are still in its database but no longer in its graph
+def component_removed_nodes(component_dir) -> set:
+    return read_removed_nodes(component_dir) if is_pangenomerge_output(component_dir) else set()
+
+# (name, protein) of each gene cluster of a component
+def component_proteins(component_dir):
+    if not is_pangenomerge_output(component_dir):
+        for record in SeqIO.parse(str(Path(component_dir) / "pan_genome_reference.fa"), "fasta"):
+            yield record.id, str(record.seq.translate()).replace("*", "")
+        return
+    con = sqlite3.connect(str(sqlite_path(component_dir)))
+    for node_id, protein in con.execute("SELECT node_id, protein FROM node_sequences WHERE protein IS NOT NULL"):
+        yield node_id, max(protein.split(";"), key=len).replace("*", "")
+    con.close()
+
+# (member, genome name) of each member of a component: Panaroo numbers members by their index in isolateNames
+def component_genomes(component_dir, G):
+    if not is_pangenomerge_output(component_dir):
+        return list(enumerate(G.graph.get("isolateNames", [])))
+    return _component_rows(component_dir, "member_genomes", "SELECT member, genome FROM member_genomes")
+
+# (seqID, geneID) pairs of a component, from Panaroo's gene_data.csv (clustering_id, annotation_id)
+# (empty if the component has none, e.g. outputs of older pangenomerge runs)
+def component_gene_ids(component_dir):
+    if is_pangenomerge_output(component_dir):
+        return _component_rows(component_dir, "seqid_geneids", "SELECT seqid, geneid FROM seqid_geneids")
+    gene_data = Path(component_dir) / "gene_data.csv"
+    if not gene_data.exists():
+        return []
+    with open(gene_data, newline="") as f:
+        return [(row["clustering_id"], row["annotation_id"]) for row in csv.DictReader(f)]
+
+def _component_rows(component_dir, table, query):
+    con = sqlite3.connect(str(sqlite_path(component_dir)))
+    rows = con.execute(query).fetchall() if sqlite_has_table(con, table) else []
+    con.close()
+    return rows
+
+# rows of a (node_id, value) table grouped by node
+def _grouped(con, query):
+    grouped = defaultdict(list)
+    for node_id, value in con.execute(query):
+        grouped[node_id].append(value)
+    return grouped
+
+# merged graph of a pangenomerge output with its metadata restored from SQLite, in the form load_graphs() gives
+def load_pangenomerge_graph(component_dir):
+
+    G = load_merged_graph(component_graph_path(component_dir))
+
+    con = sqlite3.connect(str(sqlite_path(component_dir)))
+    members = _grouped(con, "SELECT node_id, member FROM node_members")
+    seqids = _grouped(con, "SELECT node_id, seqid FROM node_seqids")
+    geneids = _grouped(con, "SELECT node_id, geneid FROM node_geneids")
+    centroids = _grouped(con, "SELECT node_id, centroid FROM node_centroids")
+    longcids = _grouped(con, "SELECT node_id, tag FROM node_longCentroidID")
+    lengths = defaultdict(list)
+    for node_id, length, count in con.execute("SELECT node_id, length, count FROM node_lengths"):
+        lengths[node_id].extend([length] * count)
+    sequences = {n: (dna, protein) for n, dna, protein in con.execute("SELECT node_id, dna, protein FROM node_sequences")}
+    nodes = {row[0]: row[1:] for row in con.execute(
+        "SELECT node_id, maxLenId, hasEnd, annotation, description, paralog, mergedDNA FROM nodes")}
+    edge_members = defaultdict(list)
+    for u, v, member in con.execute("SELECT u, v, member FROM edge_members"):
+        edge_members[(u, v)].append(member)
+    con.close()
+
+    for n in G.nodes():
+        maxLenId, hasEnd, annotation, description, paralog, mergedDNA = nodes.get(n, ("", 0, "", "", 0, ""))
+        dna, protein = sequences.get(n, ("", ""))
+        data = G.nodes[n]
+        data["name"] = n
+        data["members"] = members.get(n, [])
+        data["size"] = len(data["members"])
+        data["genomeIDs"] = ";".join(data["members"])
+        data["seqIDs"] = set(seqids.get(n, []))
+        data["geneIDs"] = ";".join(geneids.get(n, []))
+        data["centroid"] = centroids.get(n, [])
+        data["longCentroidID"] = longcids.get(n, [])
+        data["lengths"] = lengths.get(n, [])
+        data["dna"] = del_dups((dna or "").split(";"))
+        data["protein"] = del_dups((protein or "").replace("*", "J").split(";"))
+        data["maxLenId"] = maxLenId or ""
+        data["hasEnd"] = int(hasEnd or 0)
+        data["annotation"] = annotation or ""
+        data["description"] = description or ""
+        data["paralog"] = int(paralog or 0)
+        data["mergedDNA"] = mergedDNA or ""
+        data["degrees"] = int(G.degree[n])
+
+    for u, v in G.edges():
+        edge = edge_members.get((u, v), edge_members.get((v, u), []))
+        G[u][v]["members"] = edge
+        G[u][v]["genomeIDs"] = ";".join(edge)
+        G[u][v]["size"] = str(len(edge))
+
+    return G
+
+# load one component graph (Panaroo or pangenomerge output)
+def load_component_graph(component_dir):
+    if is_pangenomerge_output(component_dir):
+        return load_pangenomerge_graph(component_dir)
+    graphs, _, _ = load_graphs([str(component_graph_path(component_dir))])
+    return graphs[0]
@@ -1,18 +1,24 @@
 import networkx as nx
 import logging
 import pandas as pd
-from itertools import product
+from itertools import product, chain
 from concurrent.futures import ProcessPoolExecutor
 import multiprocessing as mp
+from custom_functions.collapse import accept_pairs, merged_pair_attrs
 
 # pre-index mmseqs for faster lookups of max identity per unordered pair
-def build_ident_lookup(mmseqs: pd.DataFrame) -> dict:
+# extra: further (query, target, fident) identities, e.g. from earlier iterations (see --hit-store)
+def build_ident_lookup(mmseqs: pd.DataFrame, extra=()) -> dict:
     
-    # use unordered pairs so (A,B) and (B,A) are the same key
-    keys = mmseqs.apply(lambda r: frozenset((r["query"], r["target"])), axis=1)
-    
-    # take max fident per unordered pair
-    return mmseqs.assign(_key=keys).groupby("_key")["fident"].max().to_dict()
+    # use unordered pairs so (A,B) and (B,A) are the same key, taking max fident per unordered pair
+    # (zip over the columns rather than a row-wise apply)
+    lookup = {}
+    hits = zip(mmseqs["query"], mmseqs["target"], mmseqs["fident"].to_numpy(dtype=float).tolist())
+    for q, t, fident in chain(hits, extra):
+        key = frozenset((q, t))
+        if fident > lookup.get(key, -1.0):
+            lookup[key] = fident
+    return lookup
 
 # define context similarity function
 def context_similarity_seq(G: nx.Graph, nA, nB, ident_lookup: dict, depth: int = 1) -> float:
@@ -59,15 +65,74 @@ def score_pair_context(row: dict):
 GLOBAL_GRAPH = None
 GLOBAL_IDENT_LOOKUP = None
 GLOBAL_CONTEXT_THRESHOLD = None
-def init_parallel(merged_graph, ident_lookup, context_threshold):
-    global GLOBAL_GRAPH, GLOBAL_IDENT_LOOKUP, GLOBAL_CONTEXT_THRESHOLD
+GLOBAL_FAMILY_THRESHOLD = None
+def init_parallel(merged_graph, ident_lookup, context_threshold, family_threshold=None):
+    global GLOBAL_GRAPH, GLOBAL_IDENT_LOOKUP, GLOBAL_CONTEXT_THRESHOLD, GLOBAL_FAMILY_THRESHOLD
     GLOBAL_GRAPH = merged_graph
     GLOBAL_IDENT_LOOKUP = ident_lookup
     GLOBAL_CONTEXT_THRESHOLD = context_threshold
+    GLOBAL_FAMILY_THRESHOLD = family_threshold
 
 # parallel computation of scores
 def compute_scores_parallel(mmseqs: pd.DataFrame, n_jobs: int):
     rows = mmseqs.to_dict(orient="records")
     ctx = mp.get_context("fork")
     with ctx.Pool(processes=n_jobs) as pool:
-        return pool.map(score_pair_context, rows)
\ No newline at end of file
+        return pool.map(score_pair_context, rows)
+
+# split candidate pairs into independent groups: connected components of the candidate-pair graph
+# pairs in different groups share no nodes, so greedy best-first acceptance can run per group
+# (workers read the forked graph, so the depth-3 context around each group needn't be copied)
+def partition_candidate_pairs(mmseqs: pd.DataFrame, n_parts: int):
+
+    parent = {}
+    def find(x):
+        while parent.setdefault(x, x) != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for q, t in zip(mmseqs["query"], mmseqs["target"]):
+        rq, rt = find(q), find(t)
+        if rq != rt:
+            parent[rq] = rt
+
+    # group row positions by component (rows stay in their original order within a group)
+    groups = {}
+    for i, q in enumerate(mmseqs["query"]):
+        groups.setdefault(find(q), []).append(i)
+
+    # pack components into roughly equal bins, largest first
+    bins = [[] for _ in range(max(1, n_parts))]
+    loads = [0] * len(bins)
+    for rows in sorted(groups.values(), key=len, reverse=True):
+        i = loads.index(min(loads))
+        bins[i].append(rows)
+        loads[i] += len(rows)
+
+    return [b for b in bins if b]
+
+# score, sort and greedily match every component in one bin, returning contraction payloads
+def collapse_partition(partition):
+
+    G = GLOBAL_GRAPH
+    result = []
+    for rows in partition:
+        scores = [score_pair_context(row) for row in rows]
+        scores_sorted = sorted(scores, key=lambda x: (x[2], x[3][0], x[3][1], x[3][2]), reverse=True)
+        for a, b, ident, sims in accept_pairs(G, scores_sorted, GLOBAL_FAMILY_THRESHOLD, GLOBAL_CONTEXT_THRESHOLD):
+            result.append((a, b, ident, sims, merged_pair_attrs(G, a, b)))
+    return result
+
+# parallel scoring, acceptance and contraction planning by independent partitions
+def compute_collapse_parallel(mmseqs: pd.DataFrame, n_jobs: int):
+    rows = mmseqs.to_dict(orient="records")
+    partitions = [
+        [[rows[i] for i in component] for component in part]
+        for part in partition_candidate_pairs(mmseqs, n_jobs * 4)
+    ]
+    logging.debug(f"Collapsing {len(rows)} candidate pairs in {len(partitions)} partitions")
+    ctx = mp.get_context("fork")
+    with ctx.Pool(processes=n_jobs) as pool:
+        results = pool.map(collapse_partition, partitions)
+    return [pair for part in results for pair in part]
@@ -0,0 +1,93 @@
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from custom_functions.run_mmseqs import mmseqs_db_files, mmseqs_copydb
+from custom_functions.memory import fmt_bytes
+
+# persistent cache of translated component databases, shared between runs and output directories (see --db-cache)
+# entries are keyed by the content of the reference FASTA (and the search backend that built them) and stored as
+# <cache>/<key>/db; an entry's mtime is its last use, and the least recently used entries are evicted once the
+# cache grows past max_size
+
+# bump when the layout of cached databases changes, so old entries are not reused
+CACHE_VERSION = "1"
+
+class DbCache:
+
+    def __init__(self, directory, max_size: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = int(max_size)
+        self.hits = 0
+        self.misses = 0
+
+    # content hash of a FASTA file
+    def key(self, fasta, variant: str) -> str:
+        digest = hashlib.blake2b(f"{CACHE_VERSION}:{variant}:".encode(), digest_size=16)
+        with open(fasta, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    # copy the cached database of fasta to outdb, building it with build(db) first if it isn't cached
+    def fetch(self, fasta, outdb, variant: str, build):
+
+        key = self.key(fasta, variant)
+        entry = self.directory / key
+
+        if (entry / "complete").exists():
+            self.hits += 1
+            os.utime(entry) # mark as recently used
+            logging.debug(f"[db cache] hit for {fasta} ({key})")
+        else:
+            self.misses += 1
+            # build in a private directory and move it into place, so concurrent runs never see a partial entry
+            building = Path(tempfile.mkdtemp(prefix=f".{key}_", dir=self.directory))
+            try:
+                build(str(building / "db"))
+                # mmseqs translatenucs soft-links the header, lookup and source files to the nucleotide database
+                for f in mmseqs_db_files(building / "db"):
+                    if f.is_symlink():
+                        source = f.resolve()
+                        f.unlink()
+                        shutil.copy2(source, f)
+                for f in building.iterdir(): # intermediate (e.g. nucleotide) databases are not kept
+                    if f not in mmseqs_db_files(building / "db"):
+                        f.unlink()
+                (building / "complete").touch()
+                os.rename(building, entry)
+                logging.debug(f"[db cache] stored {fasta} ({key})")
+            except OSError:
+                if not (entry / "complete").exists():
+                    raise
+                # another run stored the same database first
+            finally:
+                shutil.rmtree(building, ignore_errors=True)
+            self.evict(keep=key)
+
+        mmseqs_copydb(entry / "db", outdb) # copied: databases in the output directory may be rewritten in place
+
+    # size on disk of each complete entry, least recently used first
+    def entries(self):
+        entries = []
+        for entry in self.directory.iterdir():
+            if entry.is_dir() and (entry / "complete").exists():
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                entries.append((entry.stat().st_mtime, entry, size))
+        return sorted(entries)
+
+    # remove least recently used entries until the cache fits in max_size (the entry just stored is kept)
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for _, _, size in entries)
+        for _, entry, size in entries:
+            if total <= self.max_size:
+                break
+            if entry.name == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            logging.info(f"[db cache] evicted {entry.name} ({fmt_bytes(size)}); cache now {fmt_bytes(total)}")
@@ -0,0 +1,55 @@
+import struct
+from pathlib import Path
+
+# write MMseqs2 protein databases directly from (name, protein) records in one streaming pass (see --direct-db),
+# in the layout mmseqs createdb gives an amino acid FASTA without compression:
+#   <db>, <db>_h         entries of "<sequence>\n\0" and "<name>\n\0", keys 0..n-1 in input order
+#   <db>.index, <db>_h.index   "key\toffset\tlength" per entry (length includes the null byte)
+#   <db>.dbtype, <db>_h.dbtype  4-byte little-endian database type (amino acids, generic)
+#   <db>.lookup, <db>.source   "key\tname\tfile" per entry and "file\tname" of the (single) input
+
+AA_DBTYPE = 0
+HEADER_DBTYPE = 12
+
+class DbWriter:
+
+    def __init__(self, outdb, fasta=None):
+        self.outdb = Path(outdb)
+        self.outdb.parent.mkdir(parents=True, exist_ok=True)
+        self.data = open(self.outdb, "wb")
+        self.headers = open(f"{self.outdb}_h", "wb")
+        self.index = open(f"{self.outdb}.index", "w")
+        self.header_index = open(f"{self.outdb}_h.index", "w")
+        self.lookup = open(f"{self.outdb}.lookup", "w")
+        self.fasta = open(fasta, "w") if fasta is not None else None # optional FASTA copy of the records
+        self.n = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, name, protein):
+        key = self.n
+        entry = f"{protein}\n".encode() + b"\0"
+        header = f"{name}\n".encode() + b"\0"
+        self.index.write(f"{key}\t{self.data.tell()}\t{len(entry)}\n")
+        self.header_index.write(f"{key}\t{self.headers.tell()}\t{len(header)}\n")
+        self.data.write(entry)
+        self.headers.write(header)
+        self.lookup.write(f"{key}\t{name}\t0\n")
+        if self.fasta is not None:
+            self.fasta.write(f">{name}\n{protein}\n")
+        self.n += 1
+
+    def close(self):
+        for f in (self.data, self.headers, self.index, self.header_index, self.lookup, self.fasta):
+            if f is not None:
+                f.close()
+        with open(f"{self.outdb}.dbtype", "wb") as f:
+            f.write(struct.pack("<i", AA_DBTYPE))
+        with open(f"{self.outdb}_h.dbtype", "wb") as f:
+            f.write(struct.pack("<i", HEADER_DBTYPE))
+        with open(f"{self.outdb}.source", "w") as f:
+            f.write(f"0\t{self.outdb.name}\n")
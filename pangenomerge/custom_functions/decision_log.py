@@ -0,0 +1,71 @@
+import json
+import zlib
+import struct
+import logging
+from pathlib import Path
+
+# append-only binary log of the decisions made in each iteration
+# (node mapping, added nodes, contracted pairs with scores), enough to replay the merge without MMseqs2 or context scoring
+#
+# record layout: header <4sHIII> (magic, version, iteration, raw payload bytes, compressed payload bytes)
+# followed by the zlib-compressed JSON payload
+MAGIC = b"PGDL"
+VERSION = 1
+HEADER = struct.Struct("<4sHIII")
+
+def decision_log_path(outdir) -> Path:
+    return Path(outdir) / "decisions.log"
+
+class DecisionLog:
+
+    def __init__(self, path, truncate: bool = True):
+        self.path = Path(path)
+        if truncate or not self.path.exists():
+            self.path.write_bytes(b"")
+
+    def append(self, iteration: int, components, mapping, new_nodes, collapse_pairs):
+        record = {
+            "components": [str(c) for c in components],
+            "mapping": [[str(q), str(t)] for q, t in mapping],
+            "new_nodes": [str(n) for n in new_nodes],
+            "collapse": [[a, b, float(ident), [float(s) for s in sims]] for a, b, ident, sims, *_ in collapse_pairs],
+        }
+        raw = json.dumps(record, separators=(",", ":")).encode()
+        payload = zlib.compress(raw, 6)
+        with open(self.path, "ab") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, int(iteration), len(raw), len(payload)))
+            f.write(payload)
+        logging.debug(f"Logged decisions of iteration {iteration} ({len(payload)} bytes)")
+
+# read all records of a decision log, keyed by iteration (later records of an iteration replace earlier ones)
+def read_decision_log(path) -> dict:
+    records = {}
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(HEADER.size)
+            if not header:
+                break
+            if len(header) < HEADER.size:
+                logging.warning(f"Ignoring truncated record at the end of {path}")
+                break
+            magic, version, iteration, n_raw, n_payload = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise RuntimeError(f"{path} is not a version {VERSION} pangenomerge decision log")
+            payload = f.read(n_payload)
+            if len(payload) < n_payload:
+                logging.warning(f"Ignoring truncated record of iteration {iteration} in {path}")
+                break
+            record = json.loads(zlib.decompress(payload))
+            record["collapse"] = [(a, b, ident, tuple(sims), None) for a, b, ident, sims in record["collapse"]]
+            records[iteration] = record
+    return records
+
+# component directories in merge order (g1, g2, ...) as recorded for iterations 1..n
+def replay_components(records: dict, n: int):
+    missing = [i for i in range(1, n + 1) if i not in records]
+    if missing:
+        raise RuntimeError(f"Decision log has no record of iteration(s) {missing}")
+    components = list(records[1]["components"])
+    for i in range(2, n + 1):
+        components.extend(records[i]["components"])
+    return components
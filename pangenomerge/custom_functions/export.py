@@ -0,0 +1,142 @@
+import logging
+import multiprocessing as mp
+import networkx as nx
+from custom_functions.sqlite import sqlite_connect, add_metadata_to_sqlite, node_has_metadata, edge_has_metadata
+
+# replace node and edge metadata with placeholders (metadata lives in the SQLite database)
+def strip_metadata(G):
+    for n in G.nodes():
+        degrees = G.nodes[n]["degrees"]
+        G.nodes[n].clear()
+        G.nodes[n]["name"] = n
+        G.nodes[n]["seqIDs"] = []
+        G.nodes[n]["geneIDs"] = ''
+        G.nodes[n]["members"] = []
+        G.nodes[n]["genomeIDs"] = ''
+        G.nodes[n]["size"] = 1
+        G.nodes[n]["lengths"] = []
+        G.nodes[n]['longCentroidID'] = []
+        G.nodes[n]['maxLenId'] = ''
+        G.nodes[n]['centroid'] = []
+        G.nodes[n]['dna'] = [""]
+        G.nodes[n]['protein'] = [""]
+        G.nodes[n]["hasEnd"] = 0
+        G.nodes[n]["annotation"] = ''
+        G.nodes[n]["description"] = ''
+        G.nodes[n]["paralog"] = 0
+        G.nodes[n]["mergedDNA"] = ''
+        G.nodes[n]["degrees"] = degrees
+
+    for u, v in G.edges():
+        G[u][v].clear()
+        G[u][v]["name"] = n
+        G[u][v]["size"] = 1
+        G[u][v]["members"] = []
+        G[u][v]['genomeIDs'] = ''
+
+    return G
+
+# write metadata of one iteration to SQLite and the merged graph to GML
+# the graph is left stripped of metadata unless keep_metadata is set
+def export_iteration(G, iteration: int, con, output_path, keep_metadata: bool, nometadata_path=None):
+
+    # info statement...
+    logging.info('Writing new metadata to SQLite database...')
+
+    # add metadata to SQLite database
+    add_metadata_to_sqlite(G=G, iteration=iteration, con=con)
+
+    # ensure WAL doesn't increase dramatically (execute after iteration finishes)
+    con.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+
+    # info statement...
+    logging.info('Writing merged graph to outdir...')
+
+    if keep_metadata is True:
+        # write new graph to GML with all metadata
+        nx.write_gml(G, str(output_path))
+
+        # write an additional version of the final graph that doesn't have metadata
+        if nometadata_path is not None:
+            for n in G.nodes():
+                G.nodes[n].clear()
+            for u, v in G.edges():
+                G[u][v].clear()
+            nx.write_gml(G, str(nometadata_path))
+
+    else:
+        # write new graph to GML without metadata (to allow for slow nx write speed)
+        strip_metadata(G)
+        nx.write_gml(G, str(output_path))
+
+    return G
+
+# what an export needs of a graph whose GML is written without metadata: the node order and degrees and the edges
+# of the stripped graph, and the attributes of the nodes and edges still carrying metadata (those changed since the
+# last export; the others were stripped after it)
+def graph_snapshot(G):
+    nodes = [(n, data["degrees"]) for n, data in G.nodes(data=True)]
+    edges = list(G.edges())
+    node_metadata = {n: dict(data) for n, data in G.nodes(data=True) if node_has_metadata(data)}
+    edge_metadata = {(u, v): dict(data) for u, v, data in G.edges(data=True) if edge_has_metadata(data)}
+    return nodes, edges, node_metadata, edge_metadata
+
+# rebuild the graph of a snapshot (stripped nodes keep only their degrees, which is all strip_metadata reads)
+def graph_from_snapshot(snapshot):
+    nodes, edges, node_metadata, edge_metadata = snapshot
+    G = nx.Graph()
+    G.add_nodes_from((n, {"degrees": degrees}) for n, degrees in nodes)
+    G.add_edges_from(edges)
+    for n, data in node_metadata.items():
+        G.nodes[n].update(data)
+    for (u, v), data in edge_metadata.items():
+        G[u][v].update(data)
+    return G
+
+# export one iteration in a separate process (see SnapshotWriter)
+def _export_snapshot(snapshot, iteration: int, database, sqlite_cache: int, output_path, keep_metadata: bool,
+                     nometadata_path, log_level: int):
+    logging.basicConfig(level=log_level, format="[%(levelname)s] %(message)s")
+    G = snapshot if keep_metadata is True else graph_from_snapshot(snapshot)
+    con = sqlite_connect(database=database, sqlite_cache=sqlite_cache)
+    export_iteration(G, iteration, con, output_path, keep_metadata, nometadata_path)
+    con.close()
+
+# export iterations from a helper process while the merge starts the next iteration, like a background save
+# the process is started by a fork server (or spawned) rather than forked from the merge, whose threads (speculative
+# search, scratch copy-back, prefetch) may hold locks a forked child would inherit, and it opens its own SQLite
+# connection. it is sent a snapshot of the graph (graph_snapshot): the node and edge lists plus the metadata of the
+# nodes changed this iteration; with --metadata-in-graph the whole graph is sent, as its GML keeps every attribute.
+# at most one snapshot is in flight
+class SnapshotWriter:
+
+    def __init__(self, database, sqlite_cache: int):
+        self.database = database
+        self.sqlite_cache = sqlite_cache
+        self.ctx = mp.get_context("forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn")
+        self.process = None
+        self.iteration = None
+
+    # wait for the snapshot in flight (if any) and raise if it failed
+    def wait(self):
+        if self.process is None:
+            return
+        self.process.join()
+        process, iteration = self.process, self.iteration
+        self.process = None
+        self.iteration = None
+        if process.exitcode != 0:
+            raise RuntimeError(f"Background export of iteration {iteration} failed (exit code {process.exitcode})")
+        logging.debug(f"Background export of iteration {iteration} complete")
+
+    def submit(self, G, iteration: int, output_path, keep_metadata: bool, nometadata_path=None):
+
+        self.wait()
+
+        self.process = self.ctx.Process(
+            target=_export_snapshot,
+            args=(G if keep_metadata is True else graph_snapshot(G), iteration, self.database, self.sqlite_cache, output_path, keep_metadata, nometadata_path,
+                  logging.getLogger().getEffectiveLevel()))
+        self.process.start()
+        self.iteration = iteration
+        logging.info(f"Exporting iteration {iteration} in background (pid {self.process.pid})")
@@ -0,0 +1,155 @@
+import re
+import logging
+from itertools import groupby
+from pathlib import Path
+from custom_functions.sqlite import sqlite_connect_readonly, sqlite_has_table
+from custom_functions.outputs import sqlite_path
+from custom_functions.remove import member_of_seqid, read_genome_list, resolve_members
+
+# build the subgraph induced by a set of genomes straight from the SQLite database
+# and stream it to GML (readable by networkx) or TSV without building the full graph in memory
+
+# escape a string the way networkx.write_gml does
+def gml_string(value) -> str:
+    value = re.sub(r'[^ -~]|[&"]', lambda m: f"&#{ord(m.group())};", str(value))
+    return f'"{value}"'
+
+# GML lines for one attribute (lists use networkx's repeated-key convention)
+def gml_attr(key, value, indent="    "):
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return [f'{indent}{key} "[]"']
+        lines = [f'{indent}{key} "_networkx_list_start"'] if len(value) == 1 else []
+        for v in value:
+            lines.extend(gml_attr(key, v, indent))
+        return lines
+    if isinstance(value, bool):
+        return [f"{indent}{key} {int(value)}"]
+    if isinstance(value, int):
+        return [f"{indent}{key} {value}"]
+    return [f"{indent}{key} {gml_string('' if value is None else value)}"]
+
+# per-subset members of every edge touching the subset, keyed by (u, v)
+def subset_edges(cur):
+    rows = cur.execute("""
+        SELECT em.u, em.v, em.member FROM subset_members s
+        JOIN edge_members em ON em.member = s.member
+        ORDER BY em.u, em.v
+    """)
+    return {uv: [m for _, _, m in group] for uv, group in groupby(rows, key=lambda r: (r[0], r[1]))}
+
+# stream subset nodes with their stored attributes and per-subset members, ordered by node_id
+def subset_nodes(cur, members):
+    rows = cur.execute("""
+        SELECT nm.node_id, nm.member, n.name, n.annotation, n.description, n.hasEnd, n.paralog,
+               n.maxLenId, seq.dna, seq.protein
+        FROM subset_members s
+        JOIN node_members nm ON nm.member = s.member
+        LEFT JOIN nodes n ON n.node_id = nm.node_id
+        LEFT JOIN node_sequences seq ON seq.node_id = nm.node_id
+        ORDER BY nm.node_id
+    """)
+    seq_cur = cur.connection.cursor()
+    has_geneids = sqlite_has_table(cur.connection, "seqid_geneids") # runs of older versions have no pairs
+    for node_id, group in groupby(rows, key=lambda r: r[0]):
+        group = list(group)
+        _, _, name, annotation, description, hasEnd, paralog, maxLenId, dna, protein = group[0]
+        node_members = [r[1] for r in group]
+        seqids = [s for (s,) in seq_cur.execute("SELECT seqid FROM node_seqids WHERE node_id = ?", (node_id,))
+                  if member_of_seqid(s) in members]
+        # geneIDs are the annotation IDs of the seqIDs, or the seqIDs themselves (see remove_members_sqlite)
+        subset_geneids = set(seqids)
+        if has_geneids:
+            for seqid in seqids:
+                subset_geneids.update(g for (g,) in seq_cur.execute(
+                    "SELECT geneid FROM seqid_geneids WHERE seqid = ?", (seqid,)).fetchall())
+        geneids = [g for (g,) in seq_cur.execute("SELECT geneid FROM node_geneids WHERE node_id = ?", (node_id,))
+                   if g in subset_geneids]
+        centroids = [c for (c,) in seq_cur.execute("SELECT centroid FROM node_centroids WHERE node_id = ?", (node_id,))]
+        yield node_id, {
+            "name": name or node_id,
+            "size": len(node_members),
+            "members": node_members,
+            "genomeIDs": ";".join(node_members),
+            "seqIDs": seqids,
+            "geneIDs": ";".join(geneids),
+            "centroid": ";".join(centroids),
+            "maxLenId": maxLenId or "",
+            "hasEnd": int(hasEnd or 0),
+            "paralog": int(paralog or 0),
+            "annotation": annotation or "",
+            "description": description or "",
+            "dna": dna or "",
+            "protein": protein or "",
+        }
+
+def write_gml(cur, members, output):
+    edges = subset_edges(cur)
+    degrees = {}
+    for u, v in edges:
+        degrees[u] = degrees.get(u, 0) + 1
+        degrees[v] = degrees.get(v, 0) + 1
+
+    ids = {}
+    n_edges = 0
+    with open(output, "w") as f:
+        f.write("graph [\n")
+        for node_id, data in subset_nodes(cur, members):
+            ids[node_id] = len(ids)
+            data["degrees"] = degrees.get(node_id, 0)
+            lines = ["  node [", f"    id {ids[node_id]}", f"    label {gml_string(node_id)}"]
+            for key, value in data.items():
+                lines.extend(gml_attr(key, value))
+            lines.append("  ]")
+            f.write("\n".join(lines) + "\n")
+        for (u, v), edge_members in edges.items():
+            if u not in ids or v not in ids:
+                continue
+            lines = ["  edge [", f"    source {ids[u]}", f"    target {ids[v]}"]
+            lines.extend(gml_attr("size", len(edge_members)))
+            lines.extend(gml_attr("members", edge_members))
+            lines.extend(gml_attr("genomeIDs", ";".join(edge_members)))
+            lines.append("  ]")
+            f.write("\n".join(lines) + "\n")
+            n_edges += 1
+        f.write("]\n")
+
+    return len(ids), n_edges
+
+def write_tsv(cur, members, output):
+    output = Path(output)
+    n_nodes = 0
+    with open(output.with_name(output.stem + "_nodes.tsv"), "w") as f:
+        f.write("node_id\tsize\tgenomeIDs\tannotation\tdescription\n")
+        for node_id, data in subset_nodes(cur, members):
+            f.write(f"{node_id}\t{data['size']}\t{data['genomeIDs']}\t{data['annotation']}\t{data['description']}\n")
+            n_nodes += 1
+    edges = subset_edges(cur)
+    with open(output.with_name(output.stem + "_edges.tsv"), "w") as f:
+        f.write("u\tv\tsize\tgenomeIDs\n")
+        for (u, v), edge_members in edges.items():
+            f.write(f"{u}\t{v}\t{len(edge_members)}\t{';'.join(edge_members)}\n")
+    return n_nodes, len(edges)
+
+# extract the subgraph of a genome list from a finished merge
+def run_extract(reference, outdir, genomes_file, sqlite_cache: int, fmt: str = "gml"):
+
+    genomes = read_genome_list(genomes_file)
+    logging.info(f"Extracting subgraph of {len(genomes)} genomes from {sqlite_path(reference)}...")
+
+    # the reference is only read (finished runs already have their member indexes)
+    con = sqlite_connect_readonly(database=sqlite_path(reference), sqlite_cache=sqlite_cache)
+    members = resolve_members(con, genomes)
+    cur = con.cursor()
+    cur.execute("CREATE TEMP TABLE subset_members (member TEXT PRIMARY KEY) WITHOUT ROWID;")
+    cur.executemany("INSERT OR IGNORE INTO subset_members(member) VALUES (?)", [(m,) for m in members])
+
+    output = Path(outdir) / f"subgraph.{fmt}"
+    if fmt == "gml":
+        n_nodes, n_edges = write_gml(cur, members, output)
+    else:
+        n_nodes, n_edges = write_tsv(cur, members, output)
+    con.close()
+
+    logging.info(f"Wrote subgraph with {n_nodes} nodes and {n_edges} edges to {output}")
+    return output
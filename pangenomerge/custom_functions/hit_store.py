@@ -0,0 +1,112 @@
+import logging
+from pathlib import Path
+from Bio import SeqIO
+from custom_functions.sqlite import sqlite_connect
+from custom_functions.sequence_index import protein_digest
+from custom_functions.hits import hits_from_rows, drop_targets
+
+# collapse search hits kept across iterations (see --hit-store)
+# hits are stored by the digest of the query sequence, with the iteration whose base database it was searched
+# against: base databases only grow, so a sequence searched before only needs to be searched against the nodes
+# added since (the new_nodes_<N>.fa of later iterations), and its earlier hits are reused under the query's
+# current node name. stored identities between base nodes also complete the context similarity lookup
+class HitStore:
+
+    def __init__(self, path, sqlite_cache: int = 2000):
+        self.path = Path(path)
+        self.con = sqlite_connect(database=str(self.path), sqlite_cache=sqlite_cache)
+        self.con.executescript("""
+        CREATE TABLE IF NOT EXISTS hits (
+            digest BLOB,
+            query TEXT,
+            target TEXT,
+            fident REAL,
+            alnlen INTEGER,
+            qlen INTEGER,
+            tlen INTEGER,
+            evalue REAL
+        );
+        CREATE INDEX IF NOT EXISTS hits_digest ON hits(digest);
+        CREATE INDEX IF NOT EXISTS hits_query ON hits(query);
+        CREATE TABLE IF NOT EXISTS searched (
+            digest BLOB PRIMARY KEY,
+            iteration INTEGER
+        ) WITHOUT ROWID;
+        """)
+
+    # split the queries of query_fa into sequences not searched before (written to search_fa) and sequences
+    # searched in an earlier iteration (written to reuse_fa); returns {name: digest} of every query,
+    # the names of the reused queries and the earliest iteration they were searched in
+    def split_queries(self, query_fa, search_fa, reuse_fa):
+
+        digests, reused = {}, []
+        searched_in = None
+        with open(search_fa, "w") as search_out, open(reuse_fa, "w") as reuse_out:
+            for record in SeqIO.parse(str(query_fa), "fasta"):
+                digest = protein_digest(str(record.seq))
+                digests[record.id] = digest
+                row = self.con.execute("SELECT iteration FROM searched WHERE digest = ?", (digest,)).fetchone()
+                if row is None:
+                    search_out.write(f">{record.id}\n{record.seq}\n")
+                else:
+                    reuse_out.write(f">{record.id}\n{record.seq}\n")
+                    reused.append(record.id)
+                    searched_in = row[0] if searched_in is None else min(searched_in, row[0])
+
+        logging.info(f"[hit store] {len(reused)} of {len(digests)} collapse queries searched before; "
+                     f"{len(digests) - len(reused)} searched against the full base database")
+        return digests, reused, searched_in
+
+    # stored hits of the given queries, under their current names, without hits to exclude_targets
+    def stored_hits(self, names, digests, exclude_targets=None):
+        rows = []
+        for name in names:
+            for target, fident, alnlen, qlen, tlen, evalue in self.con.execute(
+                    "SELECT target, fident, alnlen, qlen, tlen, evalue FROM hits WHERE digest = ?", (digests[name],)):
+                rows.append((name, target, fident, alnlen, qlen, tlen, evalue))
+        # (queries sharing a sequence were each searched, so the same hit can be stored more than once)
+        mmseqs = hits_from_rows(rows).drop_duplicates(subset=["query", "target"], keep="first")
+        return drop_targets(mmseqs, exclude_targets)
+
+    # record the hits of this iteration's searches and mark every query as searched against this iteration's base
+    def record(self, mmseqs, digests, iteration: int):
+        cur = self.con.cursor()
+        cur.execute("BEGIN;")
+        cur.executemany(
+            "INSERT INTO hits(digest, query, target, fident, alnlen, qlen, tlen, evalue) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(digests[q], q, t, float(f), int(a), int(ql), int(tl), float(e)) for q, t, f, a, ql, tl, e in zip(
+                mmseqs["query"], mmseqs["target"], mmseqs["fident"], mmseqs["alnlen"],
+                mmseqs["qlen"], mmseqs["tlen"], mmseqs["evalue"]) if q in digests])
+        cur.executemany("INSERT OR REPLACE INTO searched(digest, iteration) VALUES (?, ?)",
+                        [(d, iteration) for d in set(digests.values())])
+        cur.execute("COMMIT;")
+
+    # (query, target, fident) of stored hits between the given nodes
+    def hits_between(self, nodes):
+        cur = self.con.cursor()
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_nodes (node TEXT PRIMARY KEY) WITHOUT ROWID;")
+        cur.execute("DELETE FROM lookup_nodes;")
+        cur.executemany("INSERT OR IGNORE INTO lookup_nodes(node) VALUES (?)", [(n,) for n in nodes])
+        pairs = cur.execute("""
+            SELECT h.query, h.target, h.fident FROM hits h
+            JOIN lookup_nodes q ON q.node = h.query
+            JOIN lookup_nodes t ON t.node = h.target
+        """).fetchall()
+        self.con.commit() # end the implicit transaction of the temp table rows
+        return pairs
+
+    def close(self):
+        self.con.close()
+
+# FASTA of the nodes added to the base database after a given iteration's search (new_nodes_<N>.fa files)
+def nodes_added_since(mmseqs_dir, iteration: int, current: int, outfa) -> int:
+    n = 0
+    with open(outfa, "w") as out:
+        for k in range(iteration + 2, current + 2):
+            path = Path(mmseqs_dir) / f"new_nodes_{k}.fa"
+            if not path.exists():
+                continue
+            for record in SeqIO.parse(str(path), "fasta"):
+                out.write(f">{record.id}\n{record.seq}\n")
+                n += 1
+    return n
@@ -0,0 +1,129 @@
+import logging
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals, is_numeric_dtype
+
+# column types of convertalis output (query,target,fident,alnlen,qlen,tlen,evalue)
+# node names are dictionary-encoded (categorical), so a hit costs ~30 bytes instead of two Python strings
+HIT_DTYPES = {
+    "query": "category",
+    "target": "category",
+    "fident": "float64",
+    "alnlen": "int32",
+    "qlen": "int32",
+    "tlen": "int32",
+    "evalue": "float64",
+}
+
+# sort order for the best hit: highest fident, then highest len_dif (see calculation), then smallest evalue
+BEST_HIT_ORDER = (["fident", "len_dif", "evalue"], [False, False, True])
+
+# make sure metrics are numeric and define length difference
+def prepare_hits(mmseqs: pd.DataFrame) -> pd.DataFrame:
+
+    for col in ["fident", "evalue", "tlen", "qlen"]:
+        if not is_numeric_dtype(mmseqs[col]):
+            mmseqs[col] = pd.to_numeric(mmseqs[col], errors="coerce")
+
+    tlen = mmseqs["tlen"].to_numpy(dtype=np.float64)
+    qlen = mmseqs["qlen"].to_numpy(dtype=np.float64)
+    mmseqs["len_dif"] = 1 - (np.abs(tlen - qlen) / np.maximum(tlen, qlen))
+
+    return mmseqs
+
+# give the query and target columns of one or more hit tables one shared dictionary of node names,
+# so names can be compared across columns and tables by their integer codes
+def share_categories(tables):
+    columns = [t[col].astype("category") for t in tables for col in ("query", "target")]
+    # empty tables have object-typed categories; give all columns the same category dtype before the union
+    columns = [c.cat.set_categories(c.cat.categories.astype(str)) for c in columns]
+    categories = union_categoricals(columns).categories
+    for t in tables:
+        for col in ("query", "target"):
+            t[col] = t[col].astype("category").cat.set_categories(categories)
+    return tables
+
+# hit table from (query, target, fident, alnlen, qlen, tlen, evalue) tuples, typed as if read from convertalis
+def hits_from_rows(rows) -> pd.DataFrame:
+    table = pd.DataFrame(rows, columns=list(HIT_DTYPES)).astype(HIT_DTYPES)
+    return concat_hits([prepare_hits(table)])
+
+# concatenate hit tables, keeping node names dictionary-encoded
+def concat_hits(tables) -> pd.DataFrame:
+    tables = share_categories(list(tables))
+    return pd.concat(tables, ignore_index=True) if len(tables) > 1 else tables[0]
+
+# keep the best hit of each query (see BEST_HIT_ORDER; ties keep the first hit in the file)
+def best_per_query(mmseqs: pd.DataFrame) -> pd.DataFrame:
+    by, ascending = BEST_HIT_ORDER
+    return mmseqs.sort_values(by=by, ascending=ascending, kind="stable").drop_duplicates(subset=["query"], keep="first")
+
+# read mmseqs results, keeping hits with fident >= min_fident and len_dif >= min_len_dif
+# if chunksize is given, the file is read and filtered in chunks, so only the unfiltered table is bounded in memory
+# hits to exclude_targets / from exclude_queries are dropped while reading; with best_only, only the best hit
+# of each query is kept (reduced per chunk, so memory is bounded by the number of queries)
+def read_hits(resultm8, min_fident: float, min_len_dif: float, chunksize=None,
+              exclude_targets=None, exclude_queries=None, best_only: bool = False) -> pd.DataFrame:
+
+    def keep(chunk):
+        chunk = prepare_hits(chunk)
+        chunk = chunk[(chunk["fident"] >= min_fident) & (chunk["len_dif"] >= min_len_dif)]
+        chunk = drop_queries(drop_targets(chunk, exclude_targets), exclude_queries)
+        return best_per_query(chunk) if best_only else chunk
+
+    if chunksize is None:
+        mmseqs = concat_hits([keep(pd.read_csv(resultm8, sep="\t", dtype=HIT_DTYPES))])
+        return best_per_query(mmseqs) if best_only else mmseqs.copy()
+
+    filtered = []
+    for chunk in pd.read_csv(resultm8, sep="\t", dtype=HIT_DTYPES, chunksize=chunksize):
+        filtered.append(keep(chunk))
+    logging.debug(f"Read {resultm8} in {len(filtered)} chunks of {chunksize} rows")
+
+    if not filtered:
+        return concat_hits([prepare_hits(pd.read_csv(resultm8, sep="\t", dtype=HIT_DTYPES, nrows=0))])
+    mmseqs = concat_hits(filtered)
+    return best_per_query(mmseqs) if best_only else mmseqs
+
+# rename the nodes of one column of a hit table (names: dict or function) in place of a row-wise string operation
+# (only the dictionary of names is rewritten; the other column keeps the original names)
+def rename_nodes(mmseqs: pd.DataFrame, column: str, names) -> pd.DataFrame:
+    rename = names if callable(names) else names.__getitem__
+    values = mmseqs[column].astype("category").cat.remove_unused_categories()
+    mmseqs[column] = values.cat.rename_categories([rename(c) for c in values.cat.categories])
+    return mmseqs
+
+def suffix_targets(mmseqs: pd.DataFrame, suffix: str) -> pd.DataFrame:
+    return rename_nodes(mmseqs, "target", lambda c: f"{c}{suffix}")
+
+# best mapping hit per query from a lower-threshold hit table (see --single-search)
+# MMseqs2 coverage (-c, --cov-mode 0) is approximated by alnlen / max(qlen, tlen)
+def mapping_hits(mmseqs: pd.DataFrame, min_fident: float, min_len_dif: float, min_coverage: float) -> pd.DataFrame:
+    coverage = mmseqs["alnlen"].to_numpy(dtype=np.float64) / np.maximum(mmseqs["qlen"], mmseqs["tlen"]).to_numpy(dtype=np.float64)
+    keep = (mmseqs["fident"] >= min_fident) & (mmseqs["len_dif"] >= min_len_dif) & (coverage >= min_coverage)
+    return best_per_query(mmseqs[keep])
+
+# pick one-to-one hits: highest fident, then highest len_dif (see calculation), then smallest evalue
+def best_one_to_one(mmseqs: pd.DataFrame) -> pd.DataFrame:
+
+    # sort by fident (highest first), len_dif (highest first -- see calculation), and evalue (lowest first)
+    by, ascending = BEST_HIT_ORDER
+    mmseqs_sorted = mmseqs.sort_values(by=by, ascending=ascending, kind="stable")
+
+    # only keep the first occurrence per unique query (highest fident, lowest length difference, then smallest evalue if tie)
+    mmseqs_filtered = mmseqs_sorted.drop_duplicates(subset=["query"], keep="first")
+    mmseqs_filtered = mmseqs_filtered.drop_duplicates(subset=["target"], keep="first") # test if dropping target vs. query duplicates first changes results
+
+    return mmseqs_filtered
+
+# drop hits to nodes that are no longer in the graph (e.g. after genome removal)
+def drop_targets(mmseqs: pd.DataFrame, targets) -> pd.DataFrame:
+    if not targets:
+        return mmseqs
+    return mmseqs[~mmseqs["target"].isin(list(targets))]
+
+# drop hits from query nodes that are no longer in their graph
+def drop_queries(mmseqs: pd.DataFrame, queries) -> pd.DataFrame:
+    if not queries:
+        return mmseqs
+    return mmseqs[~mmseqs["query"].isin(list(queries))]
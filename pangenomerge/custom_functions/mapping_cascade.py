@@ -0,0 +1,93 @@
+import logging
+from pathlib import Path
+from collections import defaultdict
+from Bio import SeqIO
+from custom_functions.native_search import verify_pair
+from custom_functions.hits import hits_from_rows
+from custom_functions.run_mmseqs import mmseqs_createdb, mmseqs_joindbs, mmseqs_linclust, mmseqs_db_names, \
+    mmseqs_db_records, mmseqs_db_files
+
+# mapping search as a cascade of cheaper stages (see --mapping-cascade)
+# queries identical to a base sequence are mapped by hash first (split_exact_queries), the rest are clustered together
+# with the base database by linclust at the mapping thresholds, and a query sharing a cluster with base nodes is
+# mapped to those it aligns to at the thresholds. only queries left without a hit go to the mapping search; hits of
+# every stage are resolved to one-to-one pairs by best_one_to_one as usual, and queries of the first two stages that
+# lose their nodes there are searched after all (in main)
+
+# queries are renamed in the clustered database so their names can't clash with base node names
+QUERY_PREFIX = "query|"
+
+# cluster the queries of query_fa with the base database(s) and verify the query-base pairs sharing a cluster
+# the base databases (e.g. every shard) are joined without copying them, and only the sequences of candidate base
+# nodes are read back; queries without a verified pair are written to leftover_fa
+# returns the hit table and the number of leftovers
+def linclust_queries(query_fa, target_dbs, leftover_fa, workdir, fident, coverage, threads, exclude_targets=None):
+
+    exclude_targets = exclude_targets or set()
+    workdir = Path(workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    queries = {record.id: str(record.seq) for record in SeqIO.parse(str(query_fa), "fasta")}
+    prefixed_fa = workdir / "cascade_query.fa"
+    with open(prefixed_fa, "w") as f:
+        for name, seq in queries.items():
+            f.write(f">{QUERY_PREFIX}{name}\n{seq}\n")
+
+    # one database of the queries (first, so their keys are unchanged) and every base database
+    query_db = str(workdir / "cascade_query_db")
+    combined = str(workdir / "cascade_db")
+    mmseqs_createdb(fasta=prefixed_fa, outdb=query_db, threads=threads, nt2aa=False)
+    first_keys = mmseqs_joindbs([query_db] + list(target_dbs), combined, tmpdir=str(workdir), threads=threads)
+    query_names = {key: name[len(QUERY_PREFIX):] for key, name in mmseqs_db_names(query_db)}
+    n_query_keys = first_keys[1] if len(first_keys) > 1 else len(query_names)
+
+    clusters_tsv = workdir / "cascade_clusters.tsv"
+    mmseqs_linclust(db=combined, outtsv=clusters_tsv, tmpdir=str(workdir / "tmp"), fident=fident,
+                    coverage=coverage, threads=threads)
+
+    # candidate pairs: queries and base nodes sharing a cluster
+    members = defaultdict(list)
+    with open(clusters_tsv) as f:
+        for line in f:
+            representative, member = line.rstrip("\n").split("\t")
+            members[int(representative)].append(int(member))
+    candidates = defaultdict(set)
+    for cluster in members.values():
+        cluster_queries = [k for k in cluster if k < n_query_keys]
+        cluster_targets = [k for k in cluster if k >= n_query_keys]
+        if cluster_targets:
+            for query in cluster_queries:
+                candidates[query].update(cluster_targets)
+
+    # sequences of the candidate base nodes only
+    needed = set().union(*candidates.values()) if candidates else set()
+    targets = {key: (name, seq) for key, name, seq in mmseqs_db_records(combined, needed, tmpdir=str(workdir))}
+    for db in (combined, query_db):
+        for f in mmseqs_db_files(db):
+            f.unlink()
+
+    # candidates are verified by alignment (cluster members were only aligned to their representative)
+    rows = []
+    for query_key, target_keys in candidates.items():
+        query = query_names[query_key]
+        seq = queries[query].upper().rstrip("*J")
+        for target_key in sorted(target_keys):
+            target, tseq = targets[target_key]
+            if target in exclude_targets:
+                continue
+            tseq = tseq.upper().rstrip("*J")
+            aln = verify_pair(seq, tseq, fident, coverage)
+            if aln is not None:
+                rows.append((query, target, round(aln[0], 3), aln[1], len(seq), len(tseq), 0.0))
+
+    mapped = {row[0] for row in rows}
+    n_left = 0
+    with open(leftover_fa, "w") as f:
+        for name, seq in queries.items():
+            if name not in mapped:
+                f.write(f">{name}\n{seq}\n")
+                n_left += 1
+
+    logging.info(f"[cascade] {len(mapped)} of {len(queries)} queries mapped by clustering; "
+                 f"{n_left} left for the mapping search")
+    return hits_from_rows(rows), n_left
@@ -0,0 +1,78 @@
+import os
+import re
+import gc
+import ctypes
+import logging
+import resource
+
+# parse a memory size such as "150G", "800M" or "2048" (MB, as in Slurm) into bytes
+def parse_memory(value) -> int:
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    match = re.fullmatch(r"\s*([0-9]*\.?[0-9]+)\s*([KMGT]?)B?\s*", str(value).upper())
+    if match is None:
+        raise ValueError(f"Could not parse memory size: {value}")
+    number, unit = match.groups()
+    return int(float(number) * units[unit or "M"])
+
+# resident set size of this process in bytes
+def current_rss() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # peak rather than current RSS, but better than nothing off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def fmt_bytes(n) -> str:
+    return f"{n / 1024**3:.2f}G"
+
+# monitor RSS against a hard memory limit and choose cheaper strategies before the limit is reached
+# every decision is logged so that a slower run can be explained after the fact
+class MemoryBudget:
+
+    def __init__(self, limit: int, soft_fraction: float = 0.8, worker_fraction: float = 0.3):
+        self.limit = int(limit)
+        self.soft_limit = int(limit * soft_fraction)
+        # fraction of the parent's RSS each forked worker is assumed to dirty (refcounts touch shared pages)
+        self.worker_fraction = worker_fraction
+
+    # log RSS at the start of a stage; free what we can if above the soft limit
+    def check(self, stage: str) -> int:
+        rss = current_rss()
+        logging.debug(f"[memory] {stage}: RSS {fmt_bytes(rss)} of {fmt_bytes(self.limit)}")
+        if rss > self.soft_limit:
+            gc.collect()
+            try:
+                ctypes.CDLL("libc.so.6").malloc_trim(0)
+            except (OSError, AttributeError):
+                pass
+            freed = rss - current_rss()
+            rss = current_rss()
+            logging.warning(f"[memory] {stage}: RSS {fmt_bytes(rss)} above soft limit {fmt_bytes(self.soft_limit)}; "
+                            f"released {fmt_bytes(max(freed, 0))} by garbage collection")
+        return rss
+
+    # decide whether a hit file should be read and filtered in chunks rather than parsed at once
+    # (a pandas table of m8 text takes roughly 3x its file size in memory)
+    # this bounds the raw table only; the hits passing the thresholds are still returned as one table
+    def hits_chunksize(self, resultm8, stage: str, row_bytes: int = 100):
+        rss = current_rss()
+        size = os.path.getsize(resultm8)
+        estimate = size * 3
+        if rss + estimate <= self.soft_limit:
+            return None
+        chunksize = max(10000, int((self.soft_limit - rss) / 4 / (row_bytes * 3))) if self.soft_limit > rss else 10000
+        logging.warning(f"[memory] {stage}: loading {fmt_bytes(size)} hit table would need ~{fmt_bytes(estimate)} "
+                        f"(RSS {fmt_bytes(rss)}); reading and filtering it in chunks of {chunksize} rows")
+        return chunksize
+
+    # shrink a forked worker pool so that the copy-on-write overhead of its workers fits in the budget
+    def pool_size(self, requested: int, stage: str) -> int:
+        rss = current_rss()
+        per_worker = max(1, int(rss * self.worker_fraction))
+        affordable = max(1, (self.soft_limit - rss) // per_worker)
+        n_jobs = int(max(1, min(requested, affordable)))
+        if n_jobs < requested:
+            logging.warning(f"[memory] {stage}: RSS {fmt_bytes(rss)}, ~{fmt_bytes(per_worker)} per worker; "
+                            f"reducing workers from {requested} to {n_jobs}")
+        return n_jobs
@@ -0,0 +1,121 @@
+import logging
+import numpy as np
+from pathlib import Path
+from Bio import SeqIO
+from custom_functions.components import component_proteins
+
+# amino acid alphabet used to pack protein k-mers into integers (5 bits per residue)
+AA_CODES = np.full(256, 31, dtype=np.uint64)
+for i, aa in enumerate("ACDEFGHIKLMNPQRSTVWY"):
+    AA_CODES[ord(aa)] = i
+
+# splitmix64 finaliser (vectorised) so k-mer hashes are uniform and identical across runs
+def mix64(x):
+    x = x.astype(np.uint64, copy=True)
+    with np.errstate(over="ignore"):
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return x
+
+# hash all protein k-mers of one sequence
+def protein_kmer_hashes(protein: str, k: int):
+    if len(protein) < k:
+        return np.empty(0, dtype=np.uint64)
+    codes = AA_CODES[np.frombuffer(protein.encode(), dtype=np.uint8)]
+    packed = np.zeros(len(protein) - k + 1, dtype=np.uint64)
+    for j in range(k):
+        packed = (packed << np.uint64(5)) | codes[j:len(codes) - k + 1 + j]
+    return mix64(packed)
+
+# FracMinHash sketch of a component's gene content: keep k-mer hashes below max_hash/scale
+# sketches of different components can then be combined and differenced directly
+def sketch_proteins(proteins, k: int = 7, scale: int = 100):
+    max_hash = np.uint64(np.iinfo(np.uint64).max // scale)
+    kept = []
+    n_genes = 0
+    for protein in proteins:
+        n_genes += 1
+        hashes = protein_kmer_hashes(protein, k)
+        kept.append(hashes[hashes < max_hash])
+    sketch = set(np.concatenate(kept).tolist()) if kept else set()
+    return sketch, n_genes
+
+def sketch_reference(reference_fa, k: int = 7, scale: int = 100):
+    proteins = (str(record.seq.translate()).replace("*", "") for record in SeqIO.parse(str(reference_fa), "fasta"))
+    return sketch_proteins(proteins, k=k, scale=scale)
+
+# estimated cost of merging components in a given order
+# base = sum of base graph sizes searched against; search = sum of query x base products
+def order_cost(sketches, order):
+    union = set()
+    base_total = 0
+    search_total = 0
+    for position, i in enumerate(order):
+        if position > 0:
+            base_total += len(union)
+            search_total += len(union) * len(sketches[i])
+        union |= sketches[i]
+    return base_total, search_total
+
+# greedy merge order: start from the most central component, then repeatedly add the
+# component contributing the fewest novel k-mers so the base graph grows as late as possible
+def greedy_merge_order(sketches):
+    n = len(sketches)
+    if n < 3:
+        return list(range(n))
+
+    centrality = []
+    for i in range(n):
+        total = 0.0
+        for j in range(n):
+            if i == j:
+                continue
+            union_size = len(sketches[i] | sketches[j])
+            if union_size:
+                total += len(sketches[i] & sketches[j]) / union_size
+        centrality.append(total / (n - 1))
+
+    first = int(np.argmax(centrality))
+    order = [first]
+    union = set(sketches[first])
+    remaining = set(range(n)) - {first}
+
+    while remaining:
+        # break ties on smallest component then original position for determinism
+        best = min(remaining, key=lambda i: (len(sketches[i] - union), len(sketches[i]), i))
+        order.append(best)
+        union |= sketches[best]
+        remaining.remove(best)
+
+    return order
+
+# sketch every component and choose a merge order that keeps intermediate graphs small
+def choose_merge_order(component_dirs, outdir, k: int = 7, scale: int = 100):
+    sketches = []
+    for component in component_dirs:
+        sketch, n_genes = sketch_proteins((protein for _, protein in component_proteins(component)), k=k, scale=scale)
+        logging.debug(f"Sketched {component}: {n_genes} genes, {len(sketch)} hashes")
+        sketches.append(sketch)
+
+    order = greedy_merge_order(sketches)
+
+    # report predicted savings relative to the TSV order
+    tsv_base, tsv_search = order_cost(sketches, list(range(len(sketches))))
+    auto_base, auto_search = order_cost(sketches, order)
+    base_saving = 100 * (1 - auto_base / tsv_base) if tsv_base else 0.0
+    search_saving = 100 * (1 - auto_search / tsv_search) if tsv_search else 0.0
+    logging.info(f"Predicted cumulative base graph size: {auto_base * scale} k-mers (TSV order: {tsv_base * scale}, {base_saving:.1f}% saving)")
+    logging.info(f"Predicted search work: {auto_search * scale * scale} k-mer pairs (TSV order: {tsv_search * scale * scale}, {search_saving:.1f}% saving)")
+
+    # record chosen order for reproducibility
+    order_out = Path(outdir) / "merge_order.tsv"
+    with open(order_out, "w") as f:
+        f.write("position\ttsv_position\tcomponent\test_kmers\n")
+        for position, i in enumerate(order):
+            f.write(f"{position+1}\t{i+1}\t{component_dirs[i]}\t{len(sketches[i]) * scale}\n")
+    logging.info(f"Merge order written to {order_out}")
+
+    return order
@@ -0,0 +1,225 @@
+import math
+import zlib
+import shutil
+import logging
+import multiprocessing as mp
+from pathlib import Path
+from collections import Counter, defaultdict
+import edlib
+from Bio import SeqIO
+from Bio.Seq import Seq
+
+# in-process homology search for small merges and environments without MMseqs2 (see --search-backend native)
+# "databases" are protein FASTA files at the database path; searches write the columns of the MMseqs2 backend's
+# convertalis output (query,target,fident,alnlen,qlen,tlen,evalue), so hits are read and filtered the same way
+#
+# candidates sharing k-mers with a query are aligned with edlib (unit costs), each sequence as an infix of the other,
+# and identity and coverage are measured over the aligned region as in MMseqs2. e-values are not computed (0.0)
+
+M8_COLUMNS = ["query", "target", "fident", "alnlen", "qlen", "tlen", "evalue"]
+
+# terminal stop codons (written '*' by translation, 'J' in graph proteins) are dropped so they don't count as mismatches
+def read_proteins(db):
+    return [(record.id, str(record.seq).upper().rstrip("*J")) for record in SeqIO.parse(str(db), "fasta")]
+
+# write a protein "database", translating nucleotide records in frame 1 (as mmseqs translatenucs)
+def native_createdb(fasta, outdb, nt2aa: bool):
+    Path(outdb).parent.mkdir(parents=True, exist_ok=True)
+    with open(outdb, "w") as out:
+        for record in SeqIO.parse(str(fasta), "fasta"):
+            seq = record.seq
+            if nt2aa:
+                seq = Seq(str(seq)[:len(seq) - len(seq) % 3]).translate()
+            out.write(f">{record.id}\n{str(seq)}\n")
+
+def native_concatdbs(db1, db2, outdb):
+    with open(outdb, "wb") as out:
+        for db in (db1, db2):
+            with open(db, "rb") as f:
+                shutil.copyfileobj(f, out)
+
+# several "databases" as one; returns the first key of each
+def native_joindbs(dbs, outdb):
+    first_keys, n = [], 0
+    with open(outdb, "w") as out:
+        for db in dbs:
+            first_keys.append(n)
+            for name, seq in read_proteins(db):
+                out.write(f">{name}\n{seq}\n")
+                n += 1
+    return first_keys
+
+# (key, name) of each record, keys being record numbers
+def native_db_names(db):
+    return [(key, name) for key, (name, _) in enumerate(read_proteins(db))]
+
+# (key, name, protein) of the records with the given keys
+def native_db_records(db, keys):
+    keys = set(keys)
+    return [(key, name, seq) for key, (name, seq) in enumerate(read_proteins(db)) if key in keys]
+
+# k-mer length for the prefilter: longer k-mers are selective enough at high identity
+def prefilter_k(fident: float) -> int:
+    return 5 if fident >= 0.9 else 4
+
+def kmers(seq: str, k: int) -> set:
+    return {seq[i:i + k] for i in range(len(seq) - k + 1)}
+
+# identity, alignment length and coverages of the best alignment of one sequence inside the other
+# each sequence is aligned as an infix of the other (edlib "HW": overhangs of the containing sequence are free) and
+# the alignment is trimmed to the span from its first to its last match, so a truncated copy of a protein aligns
+# at full identity (as in MMseqs2's local alignment); returns None if the edit distance exceeds max_edits both ways
+def align_pair(query: str, target: str, max_edits: int):
+    best = None
+    for a, b, swapped in ((query, target, False), (target, query, True)):
+        result = edlib.align(a, b, mode="HW", task="path", k=max_edits)
+        if result["editDistance"] < 0:
+            continue
+        ops = list(zip(*_cigar_ops(result["cigar"])))
+        while ops and ops[0][1] != "=":
+            ops.pop(0)
+        while ops and ops[-1][1] != "=":
+            ops.pop()
+        counts = Counter()
+        for length, op in ops:
+            counts[op] += length
+        if swapped: # insertions and deletions are relative to the query
+            counts["I"], counts["D"] = counts["D"], counts["I"]
+        alnlen = sum(counts.values())
+        if alnlen == 0:
+            continue
+        fident = counts["="] / alnlen
+        qcov = (counts["="] + counts["X"] + counts["I"]) / len(query)
+        tcov = (counts["="] + counts["X"] + counts["D"]) / len(target)
+        if best is None or (fident, alnlen) > best[:2]:
+            best = (fident, alnlen, qcov, tcov)
+    return best
+
+# alignment of a pair if it reaches identity fident and coverage of both sequences, otherwise None
+def verify_pair(query: str, target: str, fident: float, coverage: float):
+    if min(len(query), len(target)) < coverage * max(len(query), len(target)):
+        return None
+    max_edits = math.ceil((2 - fident - coverage) * (len(query) + len(target)))
+    aln = align_pair(query, target, max_edits)
+    if aln is None or aln[0] < fident or aln[2] < coverage or aln[3] < coverage:
+        return None
+    return aln
+
+def _cigar_ops(cigar: str):
+    lengths, ops, number = [], [], ""
+    for c in cigar:
+        if c.isdigit():
+            number += c
+        else:
+            lengths.append(int(number))
+            ops.append(c)
+            number = ""
+    return lengths, ops
+
+# search a batch of queries against the targets and their k-mer index
+def search_batch(queries, targets, index, params):
+
+    k, fident, coverage, max_candidates = params
+    rows = []
+    for name, seq in queries:
+        if not seq:
+            continue
+
+        # prefilter: targets sharing the most k-mers, with compatible lengths
+        # (a homolog at identity fident keeps ~fident^k of its k-mers; require a tenth of that, and at least 2)
+        query_kmers = kmers(seq, k)
+        min_shared = max(2, int(0.1 * fident ** k * len(query_kmers)))
+        shared = Counter()
+        for kmer in query_kmers:
+            shared.update(index.get(kmer, ()))
+        hits = []
+        for t, n_shared in shared.most_common(max_candidates):
+            if n_shared < min_shared:
+                break
+            tname, tseq = targets[t]
+            aln = verify_pair(seq, tseq, fident, coverage)
+            if aln is not None:
+                hits.append((name, tname, round(aln[0], 3), aln[1], len(seq), len(tseq), 0.0))
+
+        hits.sort(key=lambda h: -h[2])
+        rows.extend(hits)
+    return rows
+
+# targets, k-mer index and thresholds of forked workers (set in each worker, so concurrent searches
+# from different threads of the parent don't share them)
+WORKER_SEARCH = None
+
+def init_worker(targets, index, params):
+    global WORKER_SEARCH
+    WORKER_SEARCH = (targets, index, params)
+
+def search_batch_worker(queries):
+    return search_batch(queries, *WORKER_SEARCH)
+
+# search querydb against targetdb, writing hits above fident and coverage to resultm8
+def native_search(querydb, targetdb, resultm8, fident, coverage, threads, max_candidates: int = 300, batch_size: int = 256):
+
+    queries = read_proteins(querydb)
+    targets = read_proteins(targetdb)
+    k = prefilter_k(fident)
+
+    index = defaultdict(list)
+    for t, (_, seq) in enumerate(targets):
+        for kmer in kmers(seq, k):
+            index[kmer].append(t)
+    index = dict(index)
+    params = (k, float(fident), float(coverage), max_candidates)
+
+    batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+    # workers of an existing pool (e.g. assign mode) can't fork their own
+    if threads > 1 and len(batches) > 1 and not mp.current_process().daemon:
+        ctx = mp.get_context("fork")
+        with ctx.Pool(processes=min(threads, len(batches)), initializer=init_worker,
+                      initargs=(targets, index, params)) as pool:
+            results = pool.map(search_batch_worker, batches)
+    else:
+        results = [search_batch(batch, targets, index, params) for batch in batches]
+
+    n_hits = 0
+    with open(resultm8, "w") as f:
+        f.write("\t".join(M8_COLUMNS) + "\n")
+        for rows in results:
+            for row in rows:
+                f.write("\t".join(str(v) for v in row) + "\n")
+                n_hits += 1
+
+    logging.debug(f"[native search] {len(queries)} queries x {len(targets)} targets (k={k}): {n_hits} hits")
+    return resultm8
+
+# k-mers of a sequence selected for linclust-style grouping: the n with the lowest hash values (as linclust's
+# minimizer-like selection), so similar sequences tend to select the same k-mers
+def selected_kmers(seq: str, k: int, n: int):
+    return sorted(kmers(seq, k), key=lambda kmer: zlib.crc32(kmer.encode()))[:n]
+
+# linclust-style clustering of a protein "database": sequences sharing a selected k-mer are aligned to the longest
+# sequence of the group, which becomes their cluster representative if identity and coverage are reached
+# writes representative\tmember lines of keys (record numbers, see native_db_names)
+def native_linclust(db, outtsv, fident, coverage, k: int = 10, kmers_per_seq: int = 20):
+
+    seqs = read_proteins(db)
+    selected = [selected_kmers(seq, k, kmers_per_seq) for _, seq in seqs]
+    groups = defaultdict(list)
+    for i, chosen in enumerate(selected):
+        for kmer in chosen:
+            groups[kmer].append(i)
+
+    representative = {}
+    for i in sorted(range(len(seqs)), key=lambda i: -len(seqs[i][1])):
+        if i in representative:
+            continue
+        representative[i] = i
+        seq = seqs[i][1]
+        for j in {j for kmer in selected[i] for j in groups[kmer]}:
+            if j in representative:
+                continue
+            if verify_pair(seqs[j][1], seq, fident, coverage) is not None:
+                representative[j] = i
+
+    with open(outtsv, "w") as f:
+        for j, i in representative.items():
+            f.write(f"{i}\t{j}\n")
@@ -0,0 +1,84 @@
+import re
+import shutil
+import logging
+import networkx as nx
+from pathlib import Path
+from custom_functions.run_mmseqs import mmseqs_db_files
+from panaroo_functions.write_gml_metadata import conv_list
+
+# locate the artefacts of a finished pangenomerge output directory
+
+# number of the last completed iteration (from merged_graph_<N>.gml)
+def latest_iteration(outdir) -> int:
+    iterations = []
+    for f in Path(outdir).glob("merged_graph_*.gml"):
+        match = re.fullmatch(r"merged_graph_(\d+)\.gml", f.name)
+        if match:
+            iterations.append(int(match.group(1)))
+    if not iterations:
+        raise RuntimeError(f"No merged_graph_<N>.gml found in {outdir}; is this a pangenomerge output directory?")
+    return max(iterations)
+
+def merged_graph_path(outdir, iteration: int) -> Path:
+    return Path(outdir) / f"merged_graph_{iteration}.gml"
+
+# the database written after iteration N holds the nodes of merged_graph_<N>
+def base_db_path(outdir, iteration: int) -> Path:
+    return Path(outdir) / "mmseqs_tmp" / f"pan_genome_db_{iteration+1}"
+
+def sqlite_path(outdir) -> Path:
+    return Path(outdir) / "pangenome_metadata.sqlite"
+
+# list-valued attributes that GML may flatten to a scalar when they hold a single item
+NODE_LIST_ATTRS = ("members", "seqIDs", "lengths", "longCentroidID")
+
+# read a merged graph back into the in-memory form it had at the end of its iteration
+def load_merged_graph(path):
+    G = nx.read_gml(str(path))
+    for n in G.nodes():
+        for key in NODE_LIST_ATTRS:
+            if key in G.nodes[n]:
+                G.nodes[n][key] = conv_list(G.nodes[n][key])
+        if G.nodes[n]:
+            G.nodes[n]["name"] = n
+    for u, v in G.edges():
+        if "members" in G[u][v]:
+            G[u][v]["members"] = conv_list(G[u][v]["members"])
+    return G
+
+# restore the state of a finished run so new components can be merged onto it
+# returns the last completed iteration, its merged graph and the path of its base database in mmseqs_dir
+def restore_run(previous, mmseqs_dir, live_sqlite_path):
+
+    iteration = latest_iteration(previous)
+    previous_db = base_db_path(previous, iteration)
+    if not mmseqs_db_files(previous_db):
+        raise RuntimeError(f"Base database {previous_db} not found; cannot append to {previous}")
+    if not sqlite_path(previous).exists():
+        raise RuntimeError(f"SQLite database {sqlite_path(previous)} not found; cannot append to {previous}")
+
+    # copy database and SQLite metadata unless the run continues in place
+    base_db = Path(mmseqs_dir) / previous_db.name
+    if previous_db.resolve() != base_db.resolve():
+        logging.info(f"Copying base database {previous_db} to {mmseqs_dir}...")
+        for f in mmseqs_db_files(previous_db):
+            shutil.copy2(f, Path(mmseqs_dir) / f.name)
+    if sqlite_path(previous).resolve() != Path(live_sqlite_path).resolve():
+        logging.info(f"Copying SQLite database {sqlite_path(previous)} to {live_sqlite_path}...")
+        shutil.copy2(sqlite_path(previous), live_sqlite_path)
+
+    logging.info(f"Loading merged graph {merged_graph_path(previous, iteration)}...")
+    G = load_merged_graph(merged_graph_path(previous, iteration))
+
+    return iteration, G, str(base_db)
+
+# nodes removed from the graph but still present in the base database (see --mode remove)
+def removed_nodes_path(outdir) -> Path:
+    return Path(outdir) / "removed_nodes.txt"
+
+def read_removed_nodes(outdir) -> set:
+    path = removed_nodes_path(outdir)
+    if not path.exists():
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
@@ -0,0 +1,214 @@
+import re
+import shutil
+import logging
+import networkx as nx
+from pathlib import Path
+from custom_functions.sqlite import sqlite_connect, sqlite_init_schema, sqlite_create_indexes, sqlite_has_table
+from custom_functions.outputs import latest_iteration, merged_graph_path, base_db_path, sqlite_path, \
+    load_merged_graph, removed_nodes_path, read_removed_nodes
+from custom_functions.run_mmseqs import mmseqs_db_files
+
+# tables holding per-node rows, cleared when a node loses all of its members
+NODE_TABLES = ("nodes", "node_members", "node_seqids", "node_geneids", "node_centroids",
+               "node_lengths", "node_longCentroidID", "node_sequences")
+
+# member ids are "<index>_g<component>"; seqIDs are "<index>_<contig>_<gene>_g<component>"
+# (with one _g suffix per merge level when pangenomerge outputs were merged as components)
+def member_of_seqid(seqid: str) -> str:
+    parts = str(seqid).split("_")
+    suffixes = []
+    for part in reversed(parts[1:]):
+        if not re.fullmatch(r"g\d+", part):
+            break
+        suffixes.insert(0, part)
+    return "_".join([parts[0]] + suffixes)
+
+# one genome name (or member id, as stored in node_members.member, e.g. 12_g3) per line
+def read_genome_list(path) -> set:
+    with open(path) as f:
+        return {line.split("\t")[0].strip() for line in f if line.strip() and not line.startswith("#")}
+
+# member ids of the given genome names (names with no member of that genome are taken to be member ids)
+def resolve_members(con, genomes) -> set:
+    if not sqlite_has_table(con, "member_genomes"): # runs of older versions
+        return set(genomes)
+    members = set()
+    for genome in genomes:
+        rows = con.execute("SELECT member FROM member_genomes WHERE genome = ?", (genome,)).fetchall()
+        if rows:
+            members.update(m for (m,) in rows)
+        else:
+            members.add(genome)
+    return members
+
+# remove members from the SQLite database, touching only rows of the affected nodes and edges
+# returns the nodes and edges left without members, the new member lists of the others and the removed geneIDs
+def remove_members_sqlite(con, members):
+
+    cur = con.cursor()
+    cur.execute("BEGIN IMMEDIATE;")
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS removed_members (member TEXT PRIMARY KEY) WITHOUT ROWID;")
+    cur.execute("DELETE FROM removed_members;")
+    cur.executemany("INSERT OR IGNORE INTO removed_members(member) VALUES (?)", [(m,) for m in members])
+
+    # ---- nodes ----
+    node_rows = cur.execute("""
+        SELECT nm.node_id, nm.member FROM removed_members r
+        JOIN node_members nm ON nm.member = r.member
+    """).fetchall()
+    affected_nodes = {node_id for node_id, _ in node_rows}
+    cur.executemany("DELETE FROM node_members WHERE node_id = ? AND member = ?", node_rows)
+
+    seqid_rows = []
+    for node_id in affected_nodes:
+        for (seqid,) in cur.execute("SELECT seqid FROM node_seqids WHERE node_id = ?", (node_id,)).fetchall():
+            if member_of_seqid(seqid) in members:
+                seqid_rows.append((node_id, seqid))
+    cur.executemany("DELETE FROM node_seqids WHERE node_id = ? AND seqid = ?", seqid_rows)
+
+    # geneIDs are the annotation IDs of the seqIDs (from the components' gene_data.csv), or the seqIDs themselves
+    # once format_metadata_for_gml has rewritten them, so they are found through the removed seqIDs
+    geneid_rows = []
+    for node_id, seqid in seqid_rows:
+        geneid_rows.append((node_id, seqid))
+        for (geneid,) in cur.execute("SELECT geneid FROM seqid_geneids WHERE seqid = ?", (seqid,)).fetchall():
+            geneid_rows.append((node_id, geneid))
+    cur.executemany("DELETE FROM node_geneids WHERE node_id = ? AND geneid = ?", geneid_rows)
+    removed_geneids = {geneid for _, geneid in geneid_rows}
+
+    empty_nodes = set()
+    node_members = {}
+    for node_id in affected_nodes:
+        remaining = [m for (m,) in cur.execute("SELECT member FROM node_members WHERE node_id = ?", (node_id,))]
+        if remaining:
+            node_members[node_id] = remaining
+        else:
+            empty_nodes.add(node_id)
+
+    for node_id, remaining in node_members.items():
+        cur.execute("UPDATE nodes SET size = ?, genomeIDs = ? WHERE node_id = ?",
+                    (len(remaining), ";".join(remaining), node_id))
+    for table in NODE_TABLES:
+        cur.executemany(f"DELETE FROM {table} WHERE node_id = ?", [(n,) for n in empty_nodes])
+
+    # ---- edges ----
+    edge_rows = cur.execute("""
+        SELECT em.u, em.v, em.member FROM removed_members r
+        JOIN edge_members em ON em.member = r.member
+    """).fetchall()
+    affected_edges = {(u, v) for u, v, _ in edge_rows}
+    cur.executemany("DELETE FROM edge_members WHERE u = ? AND v = ? AND member = ?", edge_rows)
+
+    # edges of removed nodes go regardless of their remaining members
+    for node_id in empty_nodes:
+        affected_edges.update(cur.execute("SELECT u, v FROM edges WHERE u = ?", (node_id,)).fetchall())
+        affected_edges.update(cur.execute("SELECT u, v FROM edges WHERE v = ?", (node_id,)).fetchall())
+
+    empty_edges = set()
+    edge_members = {}
+    for u, v in affected_edges:
+        remaining = [m for (m,) in cur.execute("SELECT member FROM edge_members WHERE u = ? AND v = ?", (u, v))]
+        if remaining and u not in empty_nodes and v not in empty_nodes:
+            edge_members[(u, v)] = remaining
+        else:
+            empty_edges.add((u, v))
+
+    for (u, v), remaining in edge_members.items():
+        cur.execute("UPDATE edges SET size = ?, genomeIDs = ? WHERE u = ? AND v = ?",
+                    (len(remaining), ";".join(remaining), u, v))
+    cur.executemany("DELETE FROM edge_members WHERE u = ? AND v = ?", list(empty_edges))
+    cur.executemany("DELETE FROM edges WHERE u = ? AND v = ?", list(empty_edges))
+
+    # ---- degrees of surviving endpoints of removed edges ----
+    endpoints = {n for e in empty_edges for n in e} - empty_nodes
+    for node_id in endpoints:
+        (degree,) = cur.execute(
+            "SELECT (SELECT COUNT(*) FROM edges WHERE u = ?) + (SELECT COUNT(*) FROM edges WHERE v = ?)",
+            (node_id, node_id)).fetchone()
+        cur.execute("UPDATE nodes SET degrees = ? WHERE node_id = ?", (degree, node_id))
+
+    cur.execute("COMMIT;")
+
+    return empty_nodes, empty_edges, node_members, edge_members, removed_geneids
+
+# apply the removal to a merged graph (metadata is only updated if it was kept in the graph)
+def remove_members_graph(G, members, empty_nodes, empty_edges, node_members, edge_members, removed_geneids):
+
+    G.remove_nodes_from([n for n in empty_nodes if n in G])
+    G.remove_edges_from([e for e in empty_edges if G.has_edge(*e)])
+
+    for node_id, remaining in node_members.items():
+        if node_id not in G or not G.nodes[node_id].get("members"):
+            continue
+        data = G.nodes[node_id]
+        data["members"] = remaining
+        data["genomeIDs"] = ";".join(remaining)
+        data["size"] = len(remaining)
+        data["seqIDs"] = [s for s in data.get("seqIDs", []) if member_of_seqid(s) not in members]
+        data["geneIDs"] = ";".join(g for g in str(data.get("geneIDs", "")).split(";")
+                                   if g and g not in removed_geneids)
+
+    for (u, v), remaining in edge_members.items():
+        if not G.has_edge(u, v) or not G[u][v].get("members"):
+            continue
+        G[u][v]["members"] = remaining
+        G[u][v]["genomeIDs"] = ";".join(remaining)
+        G[u][v]["size"] = len(remaining)
+
+    for n in {n for e in empty_edges for n in e} - empty_nodes:
+        if n in G:
+            G.nodes[n]["degrees"] = int(G.degree[n])
+
+    return G
+
+# remove genomes from a finished merge, writing the updated run to outdir (may be the same directory)
+def run_remove(reference, outdir, genomes_file, sqlite_cache: int):
+
+    genomes = read_genome_list(genomes_file)
+    logging.info(f"Removing {len(genomes)} genomes from {reference}...")
+
+    iteration = latest_iteration(reference)
+    outdir = Path(outdir)
+    in_place = Path(reference).resolve() == outdir.resolve()
+
+    # copy the run to outdir first so the reference is left untouched
+    if not in_place:
+        (outdir / "mmseqs_tmp").mkdir(parents=True, exist_ok=True)
+        for f in mmseqs_db_files(base_db_path(reference, iteration)):
+            shutil.copy2(f, outdir / "mmseqs_tmp" / f.name)
+        shutil.copy2(sqlite_path(reference), sqlite_path(outdir))
+        if removed_nodes_path(reference).exists():
+            shutil.copy2(removed_nodes_path(reference), removed_nodes_path(outdir))
+
+    con = sqlite_connect(database=sqlite_path(outdir), sqlite_cache=sqlite_cache)
+    sqlite_init_schema(con) # runs of older versions have no member_genomes / seqid_geneids tables
+    sqlite_create_indexes(con) # member lookups below rely on these
+    members = resolve_members(con, genomes)
+    empty_nodes, empty_edges, node_members, edge_members, removed_geneids = remove_members_sqlite(con, members)
+    con.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    con.close()
+
+    logging.info(f"{len(node_members)} nodes and {len(edge_members)} edges updated; "
+                 f"{len(empty_nodes)} nodes and {len(empty_edges)} edges removed")
+
+    # rewrite the final merged graph(s)
+    for path in (merged_graph_path(reference, iteration),
+                 Path(reference) / f"merged_graph_{iteration}_nometadata.gml"):
+        if not path.exists():
+            continue
+        logging.info(f"Updating {path.name}...")
+        G = load_merged_graph(path)
+        remove_members_graph(G, members, empty_nodes, empty_edges, node_members, edge_members, removed_geneids)
+        nx.write_gml(G, str(outdir / path.name))
+
+    # removed nodes stay in the base database; later merges and assignments ignore hits to them
+    removed = read_removed_nodes(outdir) | empty_nodes
+    with open(removed_nodes_path(outdir), "w") as f:
+        for node_id in sorted(removed):
+            f.write(f"{node_id}\n")
+
+    with open(outdir / "removed_genomes.txt", "a") as f:
+        for m in sorted(members):
+            f.write(f"{m}\n")
+
+    return empty_nodes, empty_edges
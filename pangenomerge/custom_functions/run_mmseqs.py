@@ -1,8 +1,55 @@
+import os
+import re
+import shutil
+import logging
 import subprocess
+from pathlib import Path
+from Bio import SeqIO
+from custom_functions.db_writer import DbWriter
+from custom_functions.native_search import native_createdb, native_concatdbs, native_search, native_linclust, \
+    native_joindbs, native_db_names, native_db_records, read_proteins
 
-# create mmseqs database
+# search backend used by the functions below: "mmseqs" (MMseqs2 executables) or "native" (in-process, see
+# custom_functions/native_search.py), chosen once per run with --search-backend
+SEARCH_BACKEND = "mmseqs"
+
+def set_search_backend(backend: str):
+    global SEARCH_BACKEND
+    if backend not in ("mmseqs", "native"):
+        raise ValueError(f"Unknown search backend: {backend}")
+    SEARCH_BACKEND = backend
+
+# cache of translated reference databases (custom_functions/db_cache.py), set once per run with --db-cache
+DB_CACHE = None
+
+def set_db_cache(cache):
+    global DB_CACHE
+    DB_CACHE = cache
+
+# adaptive sensitivity schedule (custom_functions/sensitivity.py), set once per run with --adaptive-sensitivity
+SENSITIVITY_SCHEDULE = None
+
+def set_sensitivity_schedule(schedule):
+    global SENSITIVITY_SCHEDULE
+    SENSITIVITY_SCHEDULE = schedule
+
+# default sensitivity: three steps from -s 1 to 5.7, later steps only searching queries without hits
+DEFAULT_SENSITIVITY = "--start-sens 1 --sens-steps 3 -s 5.7"
+SENSITIVITY_STEPS = (1.0, 3.35, 5.7)
+
+# create mmseqs database (translated databases come from the cache if one is set)
 def mmseqs_createdb(fasta, outdb, threads, nt2aa: bool):
 
+    if nt2aa is True and DB_CACHE is not None:
+        return DB_CACHE.fetch(fasta=fasta, outdb=outdb, variant=SEARCH_BACKEND,
+                              build=lambda db: build_db(fasta=fasta, outdb=db, threads=threads, nt2aa=nt2aa))
+    return build_db(fasta=fasta, outdb=outdb, threads=threads, nt2aa=nt2aa)
+
+def build_db(fasta, outdb, threads, nt2aa: bool):
+
+    if SEARCH_BACKEND == "native":
+        return native_createdb(fasta=fasta, outdb=outdb, nt2aa=nt2aa)
+
     # create compressed amino acid database from fasta
     if nt2aa is True:
 
@@ -26,17 +73,39 @@ def mmseqs_createdb(fasta, outdb, threads, nt2aa: bool):
     
     return
 
+# write (name, protein) records to a database without an intermediate FASTA or createdb (see --direct-db)
+# fasta also keeps a FASTA copy of the records; returns the number of records
+def mmseqs_writedb(records, outdb, fasta=None):
+
+    if SEARCH_BACKEND == "native":
+        n = 0
+        with open(outdb, "w") as f:
+            for name, protein in records:
+                f.write(f">{name}\n{protein}\n")
+                n += 1
+        if fasta is not None:
+            shutil.copyfile(outdb, fasta)
+        return n
+
+    with DbWriter(outdb, fasta=fasta) as writer:
+        for name, protein in records:
+            writer.add(name, protein)
+    return writer.n
+
 # concatenate two mmseqs databases and index (used to create new pangenome database after graph is updated with new nodes)
 def mmseqs_concatdbs(db1, db2, outdb, tmpdir, threads):
 
-    cmd = f'mmseqs concatdbs {str(db1)} {str(db2)} {str(outdb)} --compressed 1 -v 3 --threads 1'
+    if SEARCH_BACKEND == "native":
+        return native_concatdbs(db1=db1, db2=db2, outdb=outdb)
+
+    cmd = f'mmseqs concatdbs {str(db1)} {str(db2)} {str(outdb)} --compressed 1 -v 3 --threads {str(threads)}'
     
     result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
     check_result(result)
 
     # now create the header database for outdb (doesn't happen automatically)
     
-    cmd = f"mmseqs concatdbs {str(db1)}_h {str(db2)}_h {str(outdb)}_h --threads 1"
+    cmd = f"mmseqs concatdbs {str(db1)}_h {str(db2)}_h {str(outdb)}_h --threads {str(threads)}"
 
     result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
     check_result(result)
@@ -44,6 +113,8 @@ def mmseqs_concatdbs(db1, db2, outdb, tmpdir, threads):
     return
 
 # run mmseqs search
+# searches of a known type (search_type, e.g. "mapping" or "collapse") follow the adaptive sensitivity schedule
+# if one is set; sensitivity runs a single step at that -s instead of the default steps
 def run_mmseqs_search(
         querydb,
         targetdb,
@@ -52,7 +123,21 @@ def run_mmseqs_search(
         tmpdir,
         fident,
         coverage,
-        threads):
+        threads,
+        search_type=None,
+        sensitivity=None):
+
+    if SENSITIVITY_SCHEDULE is not None and search_type is not None and sensitivity is None:
+        return SENSITIVITY_SCHEDULE.search(search_type, querydb=querydb, targetdb=targetdb, resultdb=resultdb,
+                                           resultm8=resultm8, tmpdir=tmpdir, fident=fident, coverage=coverage,
+                                           threads=threads)
+
+    if SEARCH_BACKEND == "native":
+        # the native prefilter's sensitivity is the number of candidates aligned per query (300 at -s 5.7)
+        max_candidates = 300 if sensitivity is None else max(10, int(round(50 * sensitivity)))
+        native_search(querydb=querydb, targetdb=targetdb, resultm8=resultm8, fident=fident, coverage=coverage,
+                      threads=threads, max_candidates=max_candidates)
+        return
 
     # remove any existing results db
     result = subprocess.run(f'rm -f -- {str(resultdb)}*', shell=True, check=True, capture_output=True, text=True)
@@ -68,7 +153,8 @@ def run_mmseqs_search(
     
     # minimum identity and sequential sensitivity steps for speedup
     # default mmseqs sensitivity is 5.7 so can lower last step to speed up if needed
-    cmd += f' --min-seq-id {str(fident)} --start-sens 1 --sens-steps 3 -s 5.7 -v 3 --threads {str(threads)}'
+    sensitivity_args = DEFAULT_SENSITIVITY if sensitivity is None else f'-s {str(sensitivity)}'
+    cmd += f' --min-seq-id {str(fident)} {sensitivity_args} -v 3 --threads {str(threads)}'
     
     result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
     check_result(result)
@@ -81,9 +167,270 @@ def run_mmseqs_search(
 
     return
 
+# search a query database against one or more target databases (e.g. an indexed base database and its side database)
+# writing one result table per target (resultm8, resultm8.1, ...); returns the result tables
+def run_mmseqs_search_targets(querydb, targetdbs, resultdb, resultm8, tmpdir, fident, coverage, threads, search_type=None):
+
+    if isinstance(targetdbs, (str, Path)):
+        targetdbs = [targetdbs]
+
+    resultm8s = []
+    for i, targetdb in enumerate(targetdbs):
+        m8 = str(resultm8) if i == 0 else f"{resultm8}.{i}"
+        run_mmseqs_search(
+            querydb=querydb,
+            targetdb=targetdb,
+            resultdb=resultdb,
+            resultm8=m8,
+            tmpdir=tmpdir,
+            fident=fident,
+            coverage=coverage,
+            threads=threads,
+            search_type=search_type)
+        resultm8s.append(m8)
+
+    return resultm8s
+
+# create a translated query database for a pangenome reference and search it against the target database(s)
+# (used to run the next iteration's mapping search in the background; fasta=None searches an existing querydb)
+def mmseqs_search_reference(fasta, querydb, targetdb, resultdb, resultm8, tmpdir, fident, coverage, threads,
+                            search_type=None):
+
+    Path(tmpdir).mkdir(parents=True, exist_ok=True)
+    if fasta is not None:
+        mmseqs_createdb(fasta=fasta, outdb=querydb, threads=threads, nt2aa=True)
+    return run_mmseqs_search_targets(
+        querydb=querydb,
+        targetdbs=targetdb,
+        resultdb=resultdb,
+        resultm8=resultm8,
+        tmpdir=tmpdir,
+        fident=fident,
+        coverage=coverage,
+        threads=threads,
+        search_type=search_type)
+
+# cluster a database at high identity in linear time (mmseqs linclust), writing representative\tmember lines of keys
+def mmseqs_linclust(db, outtsv, tmpdir, fident, coverage, threads):
+
+    if SEARCH_BACKEND == "native":
+        return native_linclust(db=db, outtsv=outtsv, fident=fident, coverage=coverage)
+
+    Path(tmpdir).mkdir(parents=True, exist_ok=True)
+    cludb = f'{str(outtsv)}_clu'
+    result = subprocess.run(f'rm -f -- {cludb}*', shell=True, check=True, capture_output=True, text=True)
+    check_result(result)
+
+    cmd = f'mmseqs linclust {str(db)} {cludb} {str(tmpdir)} --min-seq-id {str(fident)} -c {str(coverage)} --cov-mode 0 --compressed 0 -v 3 --threads {str(threads)}'
+    result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
+    check_result(result)
+
+    # each entry of the clustering lists the keys of its members, one per line (as createtsv reads them)
+    data = b"".join(f.read_bytes() for f in mmseqs_data_files(cludb))
+    with open(f"{cludb}.index") as index, open(outtsv, "w") as out:
+        for line in index:
+            key, offset, length = line.rstrip("\n").split("\t")
+            entry = data[int(offset):int(offset) + int(length)].rstrip(b"\0").decode()
+            for member in entry.split():
+                out.write(f"{key}\t{member}\n")
+
+    for f in mmseqs_db_files(cludb):
+        f.unlink()
+
+    return
+
+# data files of a database: the file itself, or the numbered parts of a split database in order
+def mmseqs_data_files(db):
+    db = Path(db)
+    if db.exists():
+        return [db]
+    parts = [f for f in mmseqs_db_files(db) if re.fullmatch(rf"{re.escape(db.name)}\.\d+", f.name)]
+    return sorted(parts, key=lambda f: int(f.name.rsplit(".", 1)[1]))
+
+# present several databases as one without copying their sequences: the data files of each are hard-linked as the
+# parts of a split database, which mmseqs reads as one address space, and the index is rewritten with keys
+# renumbered after the previous database's and offsets shifted past its data; returns the first key of each
+# (databases stored differently, e.g. compressed and uncompressed, can't share parts and are concatenated instead)
+def mmseqs_joindbs(dbs, outdb, tmpdir, threads):
+
+    if SEARCH_BACKEND == "native":
+        return native_joindbs(dbs=dbs, outdb=outdb)
+
+    dbs = [str(db) for db in dbs]
+    dbtypes = {(Path(f"{db}.dbtype").read_bytes(), Path(f"{db}_h.dbtype").read_bytes()) for db in dbs}
+    if len(dbtypes) > 1:
+        logging.debug(f"[joindbs] databases of different types; concatenating {len(dbs)} databases")
+        first_keys, combined = [], None
+        for i, db in enumerate(dbs):
+            first_keys.append(0 if combined is None else mmseqs_next_key(combined))
+            if combined is None:
+                mmseqs_linkdb(db, f"{outdb}_join_0")
+                combined = f"{outdb}_join_0"
+                continue
+            merged = str(outdb) if i == len(dbs) - 1 else f"{outdb}_join_{i}"
+            mmseqs_concatdbs(db1=combined, db2=db, outdb=merged, tmpdir=tmpdir, threads=threads)
+            for f in mmseqs_db_files(combined):
+                f.unlink()
+            combined = merged
+        return first_keys
+
+    outdb = Path(outdb)
+    outdb.parent.mkdir(parents=True, exist_ok=True)
+    first_keys = []
+    for suffix in ("", "_h"):
+        part, key_shift, first_keys = 0, 0, []
+        with open(f"{outdb}{suffix}.index", "w") as index:
+            data_shift = 0
+            for db in dbs:
+                first_keys.append(key_shift)
+                next_key = key_shift
+                with open(f"{db}{suffix}.index") as f:
+                    for line in f:
+                        key, offset, length = line.rstrip("\n").split("\t")
+                        index.write(f"{int(key) + key_shift}\t{int(offset) + data_shift}\t{length}\n")
+                        next_key = max(next_key, int(key) + key_shift + 1)
+                for data in mmseqs_data_files(f"{db}{suffix}"):
+                    dest = outdb.parent / f"{outdb.name}{suffix}.{part}"
+                    try:
+                        os.link(data, dest)
+                    except OSError:
+                        shutil.copy2(data, dest)
+                    data_shift += data.stat().st_size
+                    part += 1
+                key_shift = next_key
+        shutil.copy2(f"{dbs[0]}{suffix}.dbtype", f"{outdb}{suffix}.dbtype")
+
+    return first_keys
+
+# key following the last key of a database
+def mmseqs_next_key(db):
+    with open(f"{str(db)}.index") as f:
+        return max((int(line.split("\t", 1)[0]) + 1 for line in f), default=0)
+
+# (key, name) of each sequence of a database created by createdb
+def mmseqs_db_names(db):
+
+    if SEARCH_BACKEND == "native":
+        return native_db_names(db)
+
+    with open(f"{str(db)}.lookup") as f:
+        return [(int(key), name) for key, name, *_ in (line.rstrip("\n").split("\t") for line in f)]
+
+# (key, name, protein) of the sequences with the given keys, read from a subset of the database
+def mmseqs_db_records(db, keys, tmpdir):
+
+    if SEARCH_BACKEND == "native":
+        return native_db_records(db, keys)
+
+    keys = sorted(set(keys))
+    if not keys:
+        return []
+    Path(tmpdir).mkdir(parents=True, exist_ok=True)
+    subdb = Path(tmpdir) / f"{Path(db).name}_subset"
+    keys_file = f"{subdb}.keys"
+    with open(keys_file, "w") as f:
+        for key in keys:
+            f.write(f"{key}\n")
+    for suffix in ("", "_h"):
+        cmd = f'mmseqs createsubdb {keys_file} {str(db)}{suffix} {subdb}{suffix} -v 3'
+        result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
+        check_result(result)
+    cmd = f'mmseqs convert2fasta {subdb} {subdb}.fa -v 3'
+    result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
+    check_result(result)
+
+    # convert2fasta writes the entries in key order
+    records = [(key, record.id, str(record.seq)) for key, record in zip(keys, SeqIO.parse(f"{subdb}.fa", "fasta"))]
+    for f in mmseqs_db_files(subdb) + [Path(keys_file), Path(f"{subdb}.fa")]:
+        f.unlink()
+    return records
+
+# precompute the k-mer index of a target database (written next to it as <db>.idx and picked up by mmseqs search)
+def mmseqs_createindex(db, tmpdir, threads):
+
+    # the native backend builds its k-mer index per search
+    if SEARCH_BACKEND == "native":
+        return
+
+    Path(tmpdir).mkdir(parents=True, exist_ok=True)
+    cmd = f'mmseqs createindex {str(db)} {str(tmpdir)} --remove-tmp-files 1 -v 3 --threads {str(threads)}'
+    result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
+    check_result(result)
+
+    return
+
 def check_result(result):
     if result.returncode != 0:
         logging.error(f"MMseqs command failed: {cmd}")
         logging.error(f"STDOUT:\n{result.stdout}")
         logging.error(f"STDERR:\n{result.stderr}")
-        result.check_returncode()
\ No newline at end of file
+        result.check_returncode()
+
+# list the files making up an mmseqs database (data, index, dbtype, lookup/source, header db, precomputed
+# k-mer index, split data files); include_index=False leaves out the k-mer index
+def mmseqs_db_files(db, include_index: bool = True):
+    db = Path(db)
+    pattern = re.compile(rf"^{re.escape(db.name)}(_h)?(\.idx)?(\.\d+)?(\.index|\.dbtype|\.lookup|\.source)?$")
+    if not db.parent.is_dir():
+        return []
+    matches = ((f, pattern.match(f.name)) for f in db.parent.iterdir())
+    return sorted(f for f, m in matches if m and (include_index or m.group(2) is None))
+
+# copy an mmseqs database under a new name
+def mmseqs_copydb(db, outdb):
+    db, outdb = Path(db), Path(outdb)
+    outdb.parent.mkdir(parents=True, exist_ok=True)
+    for f in mmseqs_db_files(db):
+        shutil.copy2(f, outdb.parent / (outdb.name + f.name[len(db.name):]))
+
+# hard-link an mmseqs database under a new name (falls back to copying across filesystems)
+def mmseqs_linkdb(db, outdb):
+    db, outdb = Path(db), Path(outdb)
+    outdb.parent.mkdir(parents=True, exist_ok=True)
+    for f in mmseqs_db_files(db):
+        dest = outdb.parent / (outdb.name + f.name[len(db.name):])
+        try:
+            os.link(f, dest)
+        except OSError:
+            shutil.copy2(f, dest)
+
+# total size on disk of an mmseqs database in bytes (without its k-mer index, so indexed and unindexed
+# databases compare by their sequences)
+def mmseqs_db_size(db, include_index: bool = False):
+    return sum(f.stat().st_size for f in mmseqs_db_files(db, include_index=include_index))
+
+# number of sequences in a query database
+def mmseqs_count_queries(querydb) -> int:
+    if SEARCH_BACKEND == "native":
+        with open(querydb) as f:
+            return sum(1 for line in f if line.startswith(">"))
+    with open(f"{str(querydb)}.index") as f:
+        return sum(1 for _ in f)
+
+# write the queries of querydb without hits in resultdb/resultm8 to outdb; returns their number
+def mmseqs_queries_without_hits(querydb, resultdb, resultm8, outdb) -> int:
+
+    if SEARCH_BACKEND == "native":
+        with open(resultm8) as f:
+            next(f, None) # header
+            found = {line.split("\t", 1)[0] for line in f}
+        records = [(name, seq) for name, seq in read_proteins(querydb) if name not in found]
+        with open(outdb, "w") as out:
+            for name, seq in records:
+                out.write(f">{name}\n{seq}\n")
+        return len(records)
+
+    # result entries of queries without hits only hold the terminating null byte
+    with open(f"{str(resultdb)}.index") as f:
+        found = {line.split("\t")[0] for line in f if int(line.rstrip("\n").split("\t")[2]) > 1}
+    with open(f"{str(querydb)}.index") as f:
+        remaining = [line.split("\t")[0] for line in f if line.split("\t")[0] not in found]
+    keys = f"{str(outdb)}.keys"
+    with open(keys, "w") as f:
+        for key in remaining:
+            f.write(f"{key}\n")
+    for suffix in ("", "_h"):
+        cmd = f'mmseqs createsubdb {keys} {str(querydb)}{suffix} {str(outdb)}{suffix} -v 3'
+        result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
+        check_result(result)
+    return len(remaining)
@@ -0,0 +1,99 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# assign each phase of an iteration its share of --threads and run independent work concurrently
+# thread counts per phase are chosen from measured scaling instead of always using every core
+class ThreadScheduler:
+
+    def __init__(self, total_threads: int, adaptive: bool = True, min_efficiency: float = 0.5):
+        self.total = max(1, int(total_threads))
+        self.adaptive = adaptive
+        # doubling threads must give at least 1 + min_efficiency times the throughput to be worth it
+        self.min_efficiency = min_efficiency
+        self.throughput = {} # phase -> {threads: units per second (moving average)}
+        self.reserved = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2) if adaptive else None
+
+    # cores not held by background work
+    def available(self) -> int:
+        with self.lock:
+            return max(1, self.total - self.reserved)
+
+    # candidate thread counts for a phase: total, total/2, total/4, ... 1
+    def _candidates(self):
+        n = self.total
+        candidates = []
+        while n >= 1:
+            candidates.append(n)
+            if n == 1:
+                break
+            n = max(1, n // 2)
+        return candidates
+
+    # choose the thread count for the next run of a phase
+    def threads_for(self, phase: str) -> int:
+        if not self.adaptive:
+            return self.total
+
+        with self.lock:
+            measured = dict(self.throughput.get(phase, {}))
+        candidates = self._candidates()
+        chosen = candidates[0]
+
+        # walk down from the full budget while doubling threads is not worth it,
+        # trying each smaller count once before deciding
+        if chosen in measured:
+            for n, half in zip(candidates, candidates[1:]):
+                if half not in measured:
+                    chosen = half
+                    break
+                if measured[n] >= measured[half] * (1 + self.min_efficiency):
+                    chosen = n
+                    break
+                chosen = half
+
+        return min(chosen, self.available())
+
+    # time a phase and record its throughput at the given thread count
+    @contextmanager
+    def phase(self, phase: str, threads: int, units: float = 1.0):
+        start = time.perf_counter()
+        yield threads
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        rate = max(units, 1e-9) / elapsed
+        with self.lock: # background phases finish on the executor thread
+            measured = self.throughput.setdefault(phase, {})
+            measured[threads] = rate if threads not in measured else 0.5 * measured[threads] + 0.5 * rate
+        logging.debug(f"[threads] {phase}: {threads} threads, {elapsed:.1f}s, {rate:.3g} units/s")
+
+    # run fn in the background holding `threads` cores of the budget
+    # (units are recorded as for phase(), so background and foreground runs of a phase share a rate)
+    def submit(self, phase: str, threads: int, fn, *args, units: float = 1.0, **kwargs):
+        threads = max(1, min(threads, self.total - 1)) if self.total > 1 else 1
+        with self.lock:
+            self.reserved += threads
+
+        def run():
+            try:
+                with self.phase(phase, threads, units=units):
+                    return fn(*args, threads=threads, **kwargs)
+            finally:
+                with self.lock:
+                    self.reserved -= threads
+
+        return self.executor.submit(run)
+
+    def summary(self):
+        with self.lock:
+            throughput = {phase: dict(measured) for phase, measured in self.throughput.items()}
+        for phase, measured in sorted(throughput.items()):
+            rates = ", ".join(f"{n}t: {rate:.3g}/s" for n, rate in sorted(measured.items()))
+            logging.info(f"[threads] {phase}: {rates}")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from custom_functions.run_mmseqs import mmseqs_db_files
+
+# stage working mmseqs databases, temp files and the live SQLite database on node-local disk
+# artefacts are copied back to the output directory in a background thread
+class ScratchStager:
+
+    def __init__(self, scratch, outdir):
+        self.root = Path(scratch) / f"pangenomerge_{os.getpid()}"
+        self.outdir = Path(outdir)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = {}
+        logging.info(f"Staging working files in {self.root}")
+
+    def _copy_files(self, files, dest_dir):
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        for f in files:
+            shutil.copy2(f, dest_dir / f.name)
+        return len(files)
+
+    # copy an mmseqs database back to the same relative location in outdir without blocking
+    def copy_db_back(self, db):
+        db = Path(db)
+        dest_dir = self.outdir / db.parent.relative_to(self.root)
+        files = mmseqs_db_files(db)
+        self.pending[str(db)] = self.executor.submit(self._copy_files, files, dest_dir)
+        logging.debug(f"Queued copy of {db.name} ({len(files)} files) to {dest_dir}")
+
+    # remove a database that has been superseded, once any copy of it has finished
+    def remove_db(self, db):
+        future = self.pending.pop(str(db), None)
+        if future is not None:
+            future.result()
+        for f in mmseqs_db_files(db):
+            f.unlink()
+        logging.debug(f"Removed superseded database {db} from scratch")
+
+    # copy a single file (e.g. the closed SQLite database) back synchronously
+    def copy_file_back(self, path):
+        path = Path(path)
+        dest = self.outdir / path.relative_to(self.root)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(path, dest)
+        return dest
+
+    # wait for all background copies, raising any error
+    def flush(self):
+        for future in self.pending.values():
+            future.result()
+        self.pending = {}
+
+    # wait for outstanding copies and remove the scratch directory (even if a copy failed)
+    def cleanup(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown()
+            shutil.rmtree(self.root, ignore_errors=True)
+            logging.info(f"Removed scratch directory {self.root}")
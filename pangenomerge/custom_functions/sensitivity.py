@@ -0,0 +1,106 @@
+import time
+import logging
+import threading
+from pathlib import Path
+from collections import defaultdict
+from custom_functions.run_mmseqs import run_mmseqs_search, mmseqs_count_queries, mmseqs_queries_without_hits, \
+    SENSITIVITY_STEPS
+
+# choose the MMseqs2 sensitivity steps of each search type from the hit yield of each step (see --adaptive-sensitivity)
+# steps are run one at a time, each searching the queries left without hits by the previous steps (as MMseqs2 does
+# with --start-sens/--sens-steps), and the share of a search's queries that first find a hit at each step is
+# recorded per search type. the first probe_searches searches of a type (and every reprobe_every-th search after)
+# run every step; other searches stop after the last step whose yield reached min_yield
+
+def sensitivity_metrics_path(outdir) -> Path:
+    return Path(outdir) / "sensitivity_metrics.tsv"
+
+class SensitivitySchedule:
+
+    def __init__(self, metrics_path, probe_searches: int = 3, min_yield: float = 0.001, reprobe_every: int = 10,
+                 steps=SENSITIVITY_STEPS):
+        self.metrics_path = Path(metrics_path)
+        self.probe_searches = int(probe_searches)
+        self.min_yield = float(min_yield)
+        self.reprobe_every = int(reprobe_every)
+        self.steps = tuple(steps)
+        self.searches = defaultdict(int) # search type -> number of searches run
+        self.searched = defaultdict(lambda: [0] * len(self.steps)) # queries of the searches that ran each step
+        self.found = defaultdict(lambda: [0] * len(self.steps)) # queries first finding a hit at each step
+        self.lock = threading.Lock() # speculative searches run in a second thread
+        with open(self.metrics_path, "w") as f:
+            f.write("search_type\tsearch\tstep\tsensitivity\tqueries\tqueries_with_hits\tstep_yield\tseconds\n")
+
+    # share of the queries of a search type that first found a hit at each step
+    def yields(self, search_type):
+        return [found / searched if searched else 0.0
+                for found, searched in zip(self.found[search_type], self.searched[search_type])]
+
+    # number of steps for the next search of a type (and its number)
+    def next_search(self, search_type):
+        with self.lock:
+            n = self.searches[search_type]
+            self.searches[search_type] += 1
+            if n < self.probe_searches or n % self.reprobe_every == 0:
+                return n, len(self.steps)
+            useful = [i for i, y in enumerate(self.yields(search_type)) if y >= self.min_yield]
+            return n, (max(useful) + 1) if useful else 1
+
+    def record(self, search_type, search, step, n_queries, n_searched, n_found, seconds):
+        with self.lock:
+            self.searched[search_type][step] += n_queries
+            self.found[search_type][step] += n_found
+            with open(self.metrics_path, "a") as f:
+                f.write(f"{search_type}\t{search}\t{step + 1}\t{self.steps[step]}\t{n_searched}\t{n_found}\t"
+                        f"{n_found / n_queries if n_queries else 0.0:.4f}\t{seconds:.2f}\n")
+
+    # search querydb step by step, writing the hits of every step to resultm8
+    def search(self, search_type, querydb, targetdb, resultdb, resultm8, tmpdir, fident, coverage, threads):
+
+        search, n_steps = self.next_search(search_type)
+        n_queries = mmseqs_count_queries(querydb)
+        remaining, n_remaining = querydb, n_queries
+        step_m8s = []
+        for step in range(n_steps):
+            start = time.time()
+            step_db, step_m8 = f"{resultdb}_s{step + 1}", f"{resultm8}.s{step + 1}"
+            run_mmseqs_search(querydb=remaining, targetdb=targetdb, resultdb=step_db, resultm8=step_m8, tmpdir=tmpdir,
+                              fident=fident, coverage=coverage, threads=threads, sensitivity=self.steps[step])
+            step_m8s.append(step_m8)
+
+            n_found = count_queries_with_hits(step_m8)
+            self.record(search_type, search, step, n_queries, n_remaining, n_found, time.time() - start)
+            n_remaining -= n_found
+            if n_remaining == 0 or step + 1 == n_steps:
+                break
+
+            # the next step only searches queries without hits
+            next_queries = f"{resultdb}_queries_s{step + 2}"
+            mmseqs_queries_without_hits(remaining, step_db, step_m8, next_queries)
+            remaining = next_queries
+
+        concat_m8(step_m8s, resultm8)
+        logging.debug(f"[sensitivity] {search_type} search {search}: {len(step_m8s)} of {len(self.steps)} steps, "
+                      f"{n_queries - n_remaining} of {n_queries} queries with hits")
+
+    # chosen number of steps and yields per search type
+    def summary(self):
+        for search_type in sorted(self.searches):
+            yields = ", ".join(f"-s {s}: {y:.2%}" for s, y in zip(self.steps, self.yields(search_type)))
+            logging.info(f"[sensitivity] {search_type} searches: {self.searches[search_type]} ({yields})")
+
+def count_queries_with_hits(resultm8) -> int:
+    with open(resultm8) as f:
+        next(f, None) # header
+        return len({line.split("\t", 1)[0] for line in f})
+
+# concatenate result tables written with a header line (--format-mode 4)
+def concat_m8(m8s, resultm8):
+    with open(resultm8, "w") as out:
+        for i, m8 in enumerate(m8s):
+            with open(m8) as f:
+                header = next(f, None)
+                if i == 0 and header is not None:
+                    out.write(header)
+                for line in f:
+                    out.write(line)
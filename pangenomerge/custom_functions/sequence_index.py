@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import pandas as pd
+from pathlib import Path
+from collections import defaultdict
+from custom_functions.hits import hits_from_rows, concat_hits, drop_targets
+
+# exact-sequence index of the base pangenome database (see --dedup-sequences)
+# each distinct protein is stored once in the base database under a representative node; other nodes with the
+# same sequence are kept in a multiplicity map and added back to hit tables by expand()
+
+# stop codons (written '*' or 'J') are dropped so translated references and stored proteins hash alike
+def normalise_protein(protein: str) -> str:
+    return str(protein).upper().replace("J", "").replace("*", "")
+
+# 128-bit digest of a normalised protein
+def protein_digest(protein: str) -> bytes:
+    return hashlib.blake2b(normalise_protein(protein).encode(), digest_size=16).digest()
+
+def sequence_index_path(outdir) -> Path:
+    return Path(outdir) / "sequence_index.tsv"
+
+class SequenceIndex:
+
+    def __init__(self):
+        self.representatives = {} # digest -> node stored in the base database
+        self.duplicates = defaultdict(list) # representative -> other nodes with the same sequence
+
+    def __len__(self):
+        return len(self.representatives)
+
+    def clear(self):
+        self.representatives = {}
+        self.duplicates = defaultdict(list)
+
+    # record a node; returns True if its sequence is new (and the node must be written to the base database)
+    def add(self, node, protein) -> bool:
+        digest = protein_digest(protein)
+        representative = self.representatives.get(digest)
+        if representative is None:
+            self.representatives[digest] = node
+            return True
+        if representative != node:
+            self.duplicates[representative].append(node)
+        return False
+
+    # representative of an identical sequence already in the base database, if any
+    def lookup(self, protein):
+        return self.representatives.get(protein_digest(protein))
+
+    def n_duplicates(self) -> int:
+        return sum(len(d) for d in self.duplicates.values())
+
+    # the nodes of exclude_targets whose hits can be dropped before expand(): a removed representative is kept
+    # while a node sharing its sequence remains, as hits to it are that node's only hits
+    def prefilter_targets(self, exclude_targets):
+        exclude_targets = set(exclude_targets or ())
+        return {n for n in exclude_targets if not any(d not in exclude_targets for d in self.duplicates.get(n, ()))}
+
+    # add a row for every duplicate of each hit's target (same scores), dropping hits to exclude_targets
+    def expand(self, mmseqs: pd.DataFrame, exclude_targets=None) -> pd.DataFrame:
+        if self.duplicates and len(mmseqs):
+            pairs = pd.DataFrame(
+                [(r, d) for r, dups in self.duplicates.items() for d in dups], columns=["target", "duplicate"])
+            extra = mmseqs.assign(target=mmseqs["target"].astype(str)).merge(pairs, on="target")
+            if len(extra):
+                extra["target"] = extra.pop("duplicate")
+                mmseqs = concat_hits([mmseqs, extra[mmseqs.columns]])
+                mmseqs = mmseqs.drop_duplicates(subset=["query", "target"], keep="first")
+        return drop_targets(mmseqs, exclude_targets)
+
+    def write(self, path):
+        with open(path, "w") as f:
+            f.write("digest\tnode\trepresentative\n")
+            for digest, node in self.representatives.items():
+                f.write(f"{digest.hex()}\t{node}\t{node}\n")
+                for duplicate in self.duplicates.get(node, []):
+                    f.write(f"{digest.hex()}\t{duplicate}\t{node}\n")
+
+    @classmethod
+    def read(cls, path):
+        index = cls()
+        table = pd.read_csv(path, sep="\t", dtype=str)
+        for digest, node, representative in zip(table["digest"], table["node"], table["representative"]):
+            if node == representative:
+                index.representatives[bytes.fromhex(digest)] = node
+            else:
+                index.duplicates[representative].append(node)
+        return index
+
+    # index the proteins of a component or finished run, e.g. (name, protein) from component_proteins()
+    @classmethod
+    def from_proteins(cls, proteins):
+        index = cls()
+        for name, protein in proteins:
+            index.add(name, protein)
+        return index
+
+# split query proteins into exact matches of the base database (returned as hits at 100% identity)
+# and the rest, written to query_fa for MMseqs2; returns the hit table and the number of queries written
+def split_exact_queries(proteins, index: SequenceIndex, query_fa, exclude_targets=None, exclude_queries=None):
+
+    exclude_targets = exclude_targets or set()
+    exclude_queries = exclude_queries or set()
+    rows = []
+    n_written = 0
+    with open(query_fa, "w") as f:
+        for name, protein in proteins:
+            if name in exclude_queries:
+                continue
+            target = index.lookup(protein)
+            if target is not None and target not in exclude_targets:
+                length = len(normalise_protein(protein))
+                rows.append((name, target, 1.0, length, length, length, 0.0))
+            else:
+                f.write(f">{name}\n{protein}\n")
+                n_written += 1
+
+    logging.info(f"[dedup] {len(rows)} queries identical to a base sequence; {n_written} left to search")
+    return hits_from_rows(rows), n_written
@@ -0,0 +1,85 @@
+import logging
+from pathlib import Path
+from custom_functions.run_mmseqs import mmseqs_createindex, mmseqs_concatdbs, mmseqs_linkdb, mmseqs_copydb, \
+    mmseqs_db_files, mmseqs_db_size
+
+# keep the base pangenome database as a list of append-only shards instead of rewriting it every iteration
+# (see --sharded-db). the nodes added by an iteration become a new shard, and the newest two shards are merged while
+# the older is at most merge_factor times the size of the newer, so shard sizes grow geometrically: there are
+# O(log n) shards and each sequence is rewritten O(log n) times rather than once per iteration. searches run over
+# every shard; the full base database is only written out after the last iteration
+class ShardedDb:
+
+    def __init__(self, directory, indexed: bool = False, merge_factor: float = 2.0):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.indexed = indexed # precompute an MMseqs2 index of each shard (with --target-index)
+        self.merge_factor = float(merge_factor)
+        self.shards = []
+        self.version = 0
+
+    # databases to search, oldest shard first
+    @property
+    def targets(self):
+        return list(self.shards)
+
+    def size(self) -> int:
+        return sum(mmseqs_db_size(db) for db in self.shards)
+
+    def _next(self) -> str:
+        self.version += 1
+        return str(self.directory / f"shard_{self.version}")
+
+    def _index(self, db, threads):
+        if self.indexed:
+            mmseqs_createindex(db, self.directory / "tmp", threads)
+
+    # start from a complete base database as a single shard; returns the superseded shards
+    def reset(self, base_db, threads):
+        superseded = self.targets
+        shard = self._next()
+        mmseqs_linkdb(base_db, shard) # base databases are never rewritten once created
+        self._index(shard, threads)
+        self.shards = [shard]
+        logging.info(f"[shards] {Path(base_db).name} is the first shard ({mmseqs_db_size(shard) / 1e6:.1f} MB)")
+        return superseded
+
+    # add the nodes of an iteration as a new shard and compact; returns the superseded shards
+    def append(self, new_nodes_db, threads):
+
+        shard = self._next()
+        mmseqs_copydb(new_nodes_db, shard) # not linked: the new nodes database is rewritten every iteration
+        self.shards.append(shard)
+
+        superseded = []
+        while len(self.shards) > 1 and mmseqs_db_size(self.shards[-2]) <= self.merge_factor * mmseqs_db_size(self.shards[-1]):
+            older, newer = self.shards[-2], self.shards[-1]
+            merged = self._next()
+            mmseqs_concatdbs(db1=older, db2=newer, outdb=merged, tmpdir=str(self.directory), threads=threads)
+            self.shards[-2:] = [merged]
+            superseded += [older, newer]
+        self._index(self.shards[-1], threads)
+
+        logging.debug(f"[shards] {len(self.shards)} shards: "
+                      + ", ".join(f"{mmseqs_db_size(db) / 1e6:.1f}" for db in self.shards) + " MB")
+        return superseded
+
+    # write every shard into one complete base database at outdb
+    def consolidate(self, outdb, threads):
+        if len(self.shards) == 1:
+            mmseqs_linkdb(self.shards[0], outdb)
+        else:
+            combined = self.shards[0]
+            for i, shard in enumerate(self.shards[1:], start=1):
+                merged = str(outdb) if i == len(self.shards) - 1 else str(self.directory / f"consolidate_{i}")
+                mmseqs_concatdbs(db1=combined, db2=shard, outdb=merged, tmpdir=str(self.directory), threads=threads)
+                if combined not in self.shards:
+                    self.remove([combined])
+                combined = merged
+        logging.info(f"[shards] consolidated {len(self.shards)} shards into {Path(outdb).name}")
+
+    # delete superseded databases and their indexes (once no search reads them)
+    def remove(self, dbs):
+        for db in dbs:
+            for f in mmseqs_db_files(db):
+                f.unlink()
@@ -18,6 +18,14 @@ def sqlite_connect(database: str, sqlite_cache: int) -> sqlite3.Connection:
     con.execute(f"PRAGMA cache_size=-{sqlite_cache};")
     return con
 
+# read-only connection to the database of a finished run, which must not be modified
+def sqlite_connect_readonly(database: str, sqlite_cache: int) -> sqlite3.Connection:
+    con = sqlite3.connect(f"{Path(database).resolve().as_uri()}?mode=ro", uri=True)
+    con.execute("PRAGMA temp_store=MEMORY;")
+    con.execute("PRAGMA busy_timeout=5000;")
+    con.execute(f"PRAGMA cache_size=-{sqlite_cache};")
+    return con
+
 def sqlite_init_schema(con: sqlite3.Connection):
     # cumulative tables keyed by node_id / (u,v)
     con.executescript("""
@@ -94,6 +102,18 @@ def sqlite_init_schema(con: sqlite3.Connection):
         member TEXT,
         PRIMARY KEY (u, v, member)
     ) WITHOUT ROWID;
+
+    -- genome name of each member and annotation (gene) ID of each seqID, as given by the components
+    CREATE TABLE IF NOT EXISTS member_genomes (
+        member TEXT PRIMARY KEY,
+        genome TEXT
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS seqid_geneids (
+        seqid TEXT,
+        geneid TEXT,
+        PRIMARY KEY (seqid, geneid)
+    ) WITHOUT ROWID;
     """)
     con.commit()
 
@@ -103,9 +123,25 @@ def sqlite_create_indexes(con: sqlite3.Connection):
     CREATE INDEX IF NOT EXISTS idx_node_members_member ON node_members(member);
     CREATE INDEX IF NOT EXISTS idx_node_seqids_seqid ON node_seqids(seqid);
     CREATE INDEX IF NOT EXISTS idx_node_geneids_geneid ON node_geneids(geneid);
+    CREATE INDEX IF NOT EXISTS idx_edge_members_member ON edge_members(member);
+    CREATE INDEX IF NOT EXISTS idx_edges_v ON edges(v);
+    CREATE INDEX IF NOT EXISTS idx_member_genomes_genome ON member_genomes(genome);
     """)
     con.commit()
 
+def sqlite_has_table(con: sqlite3.Connection, table: str) -> bool:
+    return con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+# store the member genome names and seqID -> geneID pairs of a component, with the suffix of its merge (_g<number>)
+def add_component_ids_to_sqlite(con: sqlite3.Connection, number: int, genomes, gene_ids):
+    cur = con.cursor()
+    cur.execute("BEGIN IMMEDIATE;")
+    cur.executemany("INSERT OR REPLACE INTO member_genomes(member, genome) VALUES (?, ?)",
+                    ((f"{member}_g{number}", genome) for member, genome in genomes))
+    cur.executemany("INSERT OR IGNORE INTO seqid_geneids(seqid, geneid) VALUES (?, ?)",
+                    ((f"{seqid}_g{number}", f"{geneid}_g{number}") for seqid, geneid in gene_ids))
+    cur.execute("COMMIT;")
+
 def _norm_text_or_none(x):
     # treat empty string/None as None
     if x is None:
@@ -121,6 +157,35 @@ def _is_placeholder_seq(dna, protein):
     prot_txt = ";".join(protein) if isinstance(protein, list) else (protein or "")
     return (dna_txt.strip() == "" and prot_txt.strip() == "")
 
+# check for payload (any form of non-placeholder metadata) on a node
+def node_has_metadata(data) -> bool:
+    members = data.get("members") or []
+    seqids  = data.get("seqIDs") or []
+    geneIDs = (data.get("geneIDs") or "").strip()
+    centroids = data.get("centroid") or []
+    lengths = data.get("lengths") or []
+    longcid = data.get("longCentroidID") or []
+
+    dna = data.get("dna")
+    protein = data.get("protein")
+    has_seq = not _is_placeholder_seq(dna, protein)
+
+    return (
+        bool(members) or bool(seqids) or bool(geneIDs) or bool(centroids) or
+        bool(lengths) or bool(longcid) or has_seq or
+        bool(_norm_text_or_none(data.get("annotation"))) or
+        bool(_norm_text_or_none(data.get("description"))) or
+        bool(_norm_text_or_none(data.get("genomeIDs"))) or
+        bool(_norm_text_or_none(data.get("maxLenId"))) or
+        bool(_norm_text_or_none(data.get("mergedDNA"))) or
+        data.get("hasEnd") not in (None, 0) or
+        data.get("paralog") not in (None, 0)
+    )
+
+# placeholder edges have neither members nor genomeIDs
+def edge_has_metadata(edata) -> bool:
+    return bool(edata.get("members")) or _norm_text_or_none(edata.get("genomeIDs")) is not None
+
 def add_metadata_to_sqlite(G, iteration: int, con: sqlite3.Connection):
     cur = con.cursor()
     cur.execute("BEGIN IMMEDIATE;")
@@ -138,32 +203,8 @@ def add_metadata_to_sqlite(G, iteration: int, con: sqlite3.Connection):
     for node_id, data in G.nodes(data=True):
         node_id = str(node_id)
 
-        # check for payload (any form of non-placeholder metadata)
-        members = data.get("members") or []
-        seqids  = data.get("seqIDs") or []
-        geneIDs = (data.get("geneIDs") or "").strip()
-        centroids = data.get("centroid") or []
-        lengths = data.get("lengths") or []
-        longcid = data.get("longCentroidID") or []
-
-        dna = data.get("dna")
-        protein = data.get("protein")
-        has_seq = not _is_placeholder_seq(dna, protein)
-
-        has_payload = (
-            bool(members) or bool(seqids) or bool(geneIDs) or bool(centroids) or
-            bool(lengths) or bool(longcid) or has_seq or
-            bool(_norm_text_or_none(data.get("annotation"))) or
-            bool(_norm_text_or_none(data.get("description"))) or
-            bool(_norm_text_or_none(data.get("genomeIDs"))) or
-            bool(_norm_text_or_none(data.get("maxLenId"))) or
-            bool(_norm_text_or_none(data.get("mergedDNA"))) or
-            data.get("hasEnd") not in (None, 0) or
-            data.get("paralog") not in (None, 0)
-        )
-
         # if no non-placeholder metadata, skip node
-        if not has_payload:
+        if not node_has_metadata(data):
             continue 
 
         # change any placeholder metadata to NULL
@@ -274,7 +315,7 @@ def add_metadata_to_sqlite(G, iteration: int, con: sqlite3.Connection):
     cur.executemany("INSERT INTO node_seqids(node_id,seqid) VALUES (?,?)", seqid_rows)
     cur.executemany("INSERT INTO node_geneids(node_id,geneid) VALUES (?,?)", geneid_rows)
     cur.executemany("INSERT INTO node_centroids(node_id,centroid) VALUES (?,?)", centroid_rows)
-    cur.executemany("INSERT INTO node_longCentroidID(node_id,tag) VALUES (?,?)", longcid_rows)
+    cur.executemany("INSERT OR IGNORE INTO node_longCentroidID(node_id,tag) VALUES (?,?)", longcid_rows)
 
     # update lengths (increment counts if the length is already present)
     cur.executemany("""
@@ -313,7 +354,7 @@ def add_metadata_to_sqlite(G, iteration: int, con: sqlite3.Connection):
         genomeIDs = _norm_text_or_none(edata.get("genomeIDs"))
 
         # skip placeholder edges
-        if not emembers and genomeIDs is None:
+        if not edge_has_metadata(edata):
             continue
 
         edge_rows.append((u, v, size_val, genomeIDs, int(iteration)))
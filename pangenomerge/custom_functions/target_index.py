@@ -0,0 +1,68 @@
+import logging
+from pathlib import Path
+from custom_functions.run_mmseqs import mmseqs_createindex, mmseqs_concatdbs, mmseqs_linkdb, mmseqs_copydb, \
+    mmseqs_db_files, mmseqs_db_size
+
+# keep a precomputed MMseqs2 target index of the base pangenome database between iterations
+# the main database is indexed once and shared by the mapping and collapse searches of every iteration;
+# nodes added since then go into a small, separately indexed side database, which is compacted into the main
+# database (and the main index rebuilt) once it grows past compact_fraction of the main database
+class TargetIndex:
+
+    def __init__(self, directory, compact_fraction: float = 0.2):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.compact_fraction = float(compact_fraction)
+        self.main = None
+        self.side = None
+        self.version = 0
+
+    # databases to search, main first
+    @property
+    def targets(self):
+        return [db for db in (self.main, self.side) if db is not None]
+
+    def _next(self, prefix: str) -> str:
+        self.version += 1
+        return str(self.directory / f"{prefix}_{self.version}")
+
+    # index a complete base database as the new main database; returns the superseded databases
+    def rebuild(self, base_db, threads):
+        superseded = self.targets
+        self.main = self._next("main")
+        self.side = None
+        mmseqs_linkdb(base_db, self.main) # base databases are never rewritten once created
+        mmseqs_createindex(self.main, self.directory / "tmp", threads)
+        logging.info(f"[index] indexed {Path(base_db).name} as main target database ({mmseqs_db_size(self.main) / 1e6:.1f} MB)")
+        return superseded
+
+    # add the nodes of an iteration to the side database, compacting into base_db if it has grown too large
+    # returns the superseded databases
+    def add(self, new_nodes_db, base_db, threads):
+
+        if self.main is None:
+            return self.rebuild(base_db, threads)
+
+        superseded = [self.side] if self.side is not None else []
+        side = self._next("side")
+        if self.side is None:
+            mmseqs_copydb(new_nodes_db, side) # not linked: the new nodes database is rewritten every iteration
+        else:
+            mmseqs_concatdbs(db1=self.side, db2=new_nodes_db, outdb=side, tmpdir=str(self.directory), threads=threads)
+
+        side_size, main_size = mmseqs_db_size(side), mmseqs_db_size(self.main)
+        if side_size > self.compact_fraction * main_size:
+            logging.info(f"[index] side database is {side_size / max(main_size, 1):.0%} of main; compacting")
+            self.side = side
+            return superseded + self.rebuild(base_db, threads)
+
+        self.side = side
+        mmseqs_createindex(self.side, self.directory / "tmp", threads)
+        logging.debug(f"[index] side database: {side_size / 1e6:.1f} MB (main {main_size / 1e6:.1f} MB)")
+        return superseded
+
+    # delete superseded databases and their indexes (once no search reads them)
+    def remove(self, dbs):
+        for db in dbs:
+            for f in mmseqs_db_files(db):
+                f.unlink()
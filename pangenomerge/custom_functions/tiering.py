@@ -0,0 +1,114 @@
+import logging
+import networkx as nx
+
+# keep low-frequency nodes and edges out of the working graph between checkpoints
+# cold nodes keep their attributes and edges in a separate graph; hot nodes that still have cold edges
+# appear there as attribute-less stubs. cold nodes hit by a mapping or family search are promoted back,
+# and both tiers are reconciled at checkpoints and at the end of the run
+# (cold nodes stay in the base database and are still searched: tiering bounds graph memory, not search work)
+class TierStore:
+
+    def __init__(self, min_size: int):
+        self.min_size = int(min_size)
+        self.cold = nx.Graph()
+        self.nodes = set() # cold nodes (everything else in self.cold is a stub of a hot node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def is_cold(self, node) -> bool:
+        return node in self.nodes
+
+    # number of cold edges of a hot node
+    def cold_degree(self, node) -> int:
+        return self.cold.degree[node] if node in self.cold and node not in self.nodes else 0
+
+    # add the cold edges of hot nodes to their degrees (for export)
+    def add_cold_degrees(self, G):
+        for n in self.cold.nodes():
+            if n not in self.nodes and n in G:
+                G.nodes[n]["degrees"] = int(G.nodes[n].get("degrees", 0)) + self.cold.degree[n]
+
+    # move nodes and edges with size below min_size from G to the cold store
+    def demote(self, G, node_sizes: dict, edge_sizes: dict):
+
+        nodes = [n for n in G.nodes() if node_sizes.get(n, self.min_size) < self.min_size]
+        edges = [(u, v) for u, v in G.edges() if edge_sizes.get((u, v), edge_sizes.get((v, u), self.min_size)) < self.min_size]
+
+        for n in nodes:
+            self.cold.add_node(n, **G.nodes[n])
+            self.nodes.add(n)
+            for nb in G.neighbors(n):
+                self.cold.add_edge(n, nb, **G[n][nb])
+        for u, v in edges:
+            if not self.cold.has_edge(u, v):
+                self.cold.add_edge(u, v, **G[u][v])
+
+        G.remove_edges_from(edges)
+        G.remove_nodes_from(nodes)
+
+        logging.info(f"[tiers] demoted {len(nodes)} nodes and {len(edges)} edges below size {self.min_size}; "
+                     f"hot: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges; "
+                     f"cold: {len(self.nodes)} nodes, {self.cold.number_of_edges()} edges")
+
+    # add a cold edge to G, combining members with an edge added there since it was demoted
+    def _restore_edge(self, G, u, v, data, hu, hv):
+        if G.has_edge(hu, hv):
+            members = list(data.get("members") or [])
+            seen = set(members)
+            members.extend(m for m in (G[hu][hv].get("members") or []) if m not in seen)
+            G[hu][hv]["members"] = members
+            G[hu][hv]["genomeIDs"] = ";".join(str(m) for m in members)
+            G[hu][hv]["size"] = str(len(members)) if members else G[hu][hv].get("size", 1)
+        else:
+            G.add_edge(hu, hv, **data)
+        self.cold.remove_edge(u, v)
+
+    # move cold nodes back to G; hot node names in G carry `suffix` (e.g. "_target" during a merge)
+    def promote(self, G, nodes, suffix: str = ""):
+
+        nodes = [n for n in set(nodes) if n in self.nodes]
+        for n in nodes:
+            data = self.cold.nodes[n]
+            G.add_node(n + suffix, **data)
+            G.nodes[n + suffix]["name"] = n + suffix
+            self.nodes.discard(n)
+
+        # edges whose endpoints are now both hot
+        touched = set(nodes)
+        for n in nodes:
+            for nb in list(self.cold.neighbors(n)):
+                if nb not in self.nodes:
+                    self._restore_edge(G, n, nb, self.cold[n][nb], n + suffix, nb + suffix)
+                    touched.add(nb)
+
+        # drop stubs without cold edges
+        self.cold.remove_nodes_from([n for n in touched if self.cold.degree[n] == 0])
+
+        if nodes:
+            logging.debug(f"[tiers] promoted {len(nodes)} cold nodes")
+        return nodes
+
+    # move cold edges between hot nodes back to G (they are demoted again at the next checkpoint)
+    def restore_hot_edges(self, G, suffix: str = ""):
+        edges = [(u, v) for u, v in self.cold.edges() if u not in self.nodes and v not in self.nodes]
+        for u, v in edges:
+            self._restore_edge(G, u, v, self.cold[u][v], u + suffix, v + suffix)
+        self.cold.remove_nodes_from([n for n in list(self.cold.nodes()) if n not in self.nodes and self.cold.degree[n] == 0])
+
+    # bring everything back into G
+    def reconcile(self, G, suffix: str = ""):
+        n_nodes = len(self.nodes)
+        self.promote(G, list(self.nodes), suffix)
+        self.restore_hot_edges(G, suffix)
+        logging.info(f"[tiers] reconciled {n_nodes} cold nodes; graph has {G.number_of_nodes()} nodes, {G.number_of_edges()} edges")
+
+# node and edge sizes for tiering, from the graph when it keeps metadata, otherwise from SQLite
+def tier_sizes(G, con, keep_metadata: bool):
+    if keep_metadata:
+        node_sizes = {n: int(d["size"]) for n, d in G.nodes(data=True) if d.get("size") is not None}
+        edge_sizes = {(u, v): int(d["size"]) for u, v, d in G.edges(data=True) if d.get("size") is not None}
+    else:
+        node_sizes = {n: int(s) for n, s in con.execute("SELECT node_id, size FROM nodes WHERE size IS NOT NULL")}
+        edge_sizes = {(u, v): int(s) for u, v, s in con.execute("SELECT u, v, size FROM edges WHERE size IS NOT NULL")}
+    return node_sizes, edge_sizes
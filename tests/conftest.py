@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the package modules import each other as top-level custom_functions / panaroo_functions packages
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "pangenomerge"))
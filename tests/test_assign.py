@@ -0,0 +1,35 @@
+import networkx as nx
+from custom_functions.assign import load_base_graph
+from custom_functions.collapse import accept_pairs
+from custom_functions.outputs import merged_graph_path, sqlite_path
+from custom_functions.sqlite import sqlite_connect, sqlite_init_schema
+
+# finished run whose exported graph carries no metadata (as written without --metadata-in-graph)
+def finished_run(outdir):
+    G = nx.Graph()
+    G.add_node("n1", size=2)
+    G.add_node("n2", size=1)
+    G.add_edge("n1", "n2")
+    nx.write_gml(G, str(merged_graph_path(outdir, 2)))
+    con = sqlite_connect(str(sqlite_path(outdir)), 2000)
+    sqlite_init_schema(con)
+    con.executemany("INSERT INTO node_members VALUES (?, ?)", [("n1", "0_g1"), ("n1", "1_g2"), ("n2", "0_g1")])
+    con.commit()
+    con.close()
+
+def test_base_members_from_sqlite(tmp_path):
+    finished_run(tmp_path)
+    G = load_base_graph(tmp_path, 2, 2000)
+    assert sorted(G.nodes["n1"]["members"]) == ["0_g1", "1_g2"]
+    assert G.nodes["n2"]["members"] == ["0_g1"]
+
+def test_shared_member_blocks_assignment(tmp_path):
+    finished_run(tmp_path)
+    G = load_base_graph(tmp_path, 2, 2000)
+    # n1 already holds a gene of component genome 0 (added by a mapped node), so r_query of that genome
+    # cannot join it; q_query of another genome can join n2
+    G.nodes["n1"]["members"] = G.nodes["n1"]["members"] + ["0_query"]
+    G.add_node("r_query", members=["0_query"])
+    G.add_node("q_query", members=["1_query"])
+    scores = [("n1", "r_query", 0.9, (1.0, 1.0, 1.0)), ("n2", "q_query", 0.9, (1.0, 1.0, 1.0))]
+    assert [(a, b) for a, b, _, _ in accept_pairs(G, scores, 0.7, 0.9)] == [("n2", "q_query")]
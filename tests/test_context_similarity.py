@@ -0,0 +1,32 @@
+import pandas as pd
+from custom_functions.context_similarity import partition_candidate_pairs
+
+def hits(pairs):
+    return pd.DataFrame(pairs, columns=["query", "target"])
+
+def test_connected_pairs_share_a_group():
+    mmseqs = hits([("a", "x_target"), ("b", "x_target"), ("c", "y_target"), ("c", "z_target"), ("d", "w_target")])
+    bins = partition_candidate_pairs(mmseqs, 8)
+    groups = sorted(sorted(rows) for b in bins for rows in b)
+    assert groups == [[0, 1], [2, 3], [4]]
+
+def test_every_row_is_placed_once_and_in_order():
+    mmseqs = hits([(f"q{i}", f"t{i % 3}_target") for i in range(10)])
+    bins = partition_candidate_pairs(mmseqs, 2)
+    rows = [i for b in bins for group in b for i in group]
+    assert sorted(rows) == list(range(10))
+    for b in bins:
+        for group in b:
+            assert group == sorted(group)
+
+def test_groups_are_balanced_largest_first():
+    # groups of 4, 3, 2 and 1 rows into two bins: {4, 1} and {3, 2}
+    pairs = [(f"a{i}", "A") for i in range(4)] + [(f"b{i}", "B") for i in range(3)] \
+        + [(f"c{i}", "C") for i in range(2)] + [("d0", "D")]
+    bins = partition_candidate_pairs(hits(pairs), 2)
+    assert sorted(sum(len(g) for g in b) for b in bins) == [5, 5]
+
+def test_empty_bins_are_dropped():
+    bins = partition_candidate_pairs(hits([("a", "x")]), 4)
+    assert bins == [[[0]]]
+    assert partition_candidate_pairs(hits([]), 0) == []
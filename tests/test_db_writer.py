@@ -0,0 +1,39 @@
+import struct
+from custom_functions.db_writer import DbWriter, AA_DBTYPE, HEADER_DBTYPE
+
+RECORDS = [("n1", "MKV"), ("group_2", "MAAAL"), ("n3", "M")]
+
+def write_db(tmp_path, fasta=None):
+    outdb = tmp_path / "db" / "base_db"
+    with DbWriter(outdb, fasta=fasta) as db:
+        for name, protein in RECORDS:
+            db.add(name, protein)
+    return outdb
+
+def read_index(path):
+    return [tuple(int(x) for x in line.split("\t")) for line in open(path).read().splitlines()]
+
+def test_entries_and_index(tmp_path):
+    outdb = write_db(tmp_path)
+    data = open(outdb, "rb").read()
+    headers = open(f"{outdb}_h", "rb").read()
+    assert data == b"MKV\n\0MAAAL\n\0M\n\0"
+    assert headers == b"n1\n\0group_2\n\0n3\n\0"
+    # every index entry points at its record (length includes the null byte)
+    for (key, offset, length), (name, protein) in zip(read_index(f"{outdb}.index"), RECORDS):
+        assert data[offset:offset + length] == f"{protein}\n".encode() + b"\0"
+    for (key, offset, length), (name, protein) in zip(read_index(f"{outdb}_h.index"), RECORDS):
+        assert headers[offset:offset + length] == f"{name}\n".encode() + b"\0"
+    assert [key for key, _, _ in read_index(f"{outdb}.index")] == [0, 1, 2]
+
+def test_dbtype_lookup_source(tmp_path):
+    outdb = write_db(tmp_path)
+    assert struct.unpack("<i", open(f"{outdb}.dbtype", "rb").read()) == (AA_DBTYPE,)
+    assert struct.unpack("<i", open(f"{outdb}_h.dbtype", "rb").read()) == (HEADER_DBTYPE,)
+    assert open(f"{outdb}.lookup").read() == "0\tn1\t0\n1\tgroup_2\t0\n2\tn3\t0\n"
+    assert open(f"{outdb}.source").read() == "0\tbase_db\n"
+
+def test_fasta_copy(tmp_path):
+    fasta = tmp_path / "base.fa"
+    write_db(tmp_path, fasta=fasta)
+    assert fasta.read_text() == ">n1\nMKV\n>group_2\nMAAAL\n>n3\nM\n"
@@ -0,0 +1,47 @@
+import pytest
+from custom_functions.decision_log import DecisionLog, HEADER, read_decision_log, replay_components
+
+def log_two_iterations(path):
+    log = DecisionLog(path)
+    log.append(1, ["c1", "c2"], [("a", "b")], ["n1"], [("x_target", "y", 0.9, (0.8, 0.7, 0.6), {"attrs": 1})])
+    log.append(2, ["c3"], [], ["n2", "n3"], [])
+    return log
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "decisions.log"
+    log_two_iterations(path)
+    records = read_decision_log(path)
+    assert sorted(records) == [1, 2]
+    assert records[1]["mapping"] == [["a", "b"]]
+    assert records[1]["new_nodes"] == ["n1"]
+    # contraction payloads are not logged; replay recomputes them
+    assert records[1]["collapse"] == [("x_target", "y", 0.9, (0.8, 0.7, 0.6), None)]
+    assert records[2]["new_nodes"] == ["n2", "n3"]
+    assert replay_components(records, 2) == ["c1", "c2", "c3"]
+
+def test_later_record_replaces_earlier(tmp_path):
+    path = tmp_path / "decisions.log"
+    log_two_iterations(path)
+    DecisionLog(path, truncate=False).append(2, ["c4"], [], [], [])
+    assert read_decision_log(path)[2]["components"] == ["c4"]
+
+def test_truncated_record_is_ignored(tmp_path):
+    path = tmp_path / "decisions.log"
+    log_two_iterations(path)
+    data = path.read_bytes()
+    path.write_bytes(data[:-3])
+    assert sorted(read_decision_log(path)) == [1]
+    path.write_bytes(data + data[:HEADER.size - 1])
+    assert sorted(read_decision_log(path)) == [1, 2]
+
+def test_bad_magic(tmp_path):
+    path = tmp_path / "decisions.log"
+    path.write_bytes(HEADER.pack(b"XXXX", 1, 1, 0, 0))
+    with pytest.raises(RuntimeError):
+        read_decision_log(path)
+
+def test_missing_iteration(tmp_path):
+    path = tmp_path / "decisions.log"
+    log_two_iterations(path)
+    with pytest.raises(RuntimeError):
+        replay_components(read_decision_log(path), 3)
@@ -0,0 +1,59 @@
+import pandas as pd
+from custom_functions.hits import HIT_DTYPES, read_hits, best_one_to_one, hits_from_rows
+
+# (query, target, fident, alnlen, qlen, tlen, evalue)
+ROWS = [
+    ("q1", "t1", 0.99, 100, 100, 100, 1e-5),
+    ("q1", "t2", 1.00, 100, 100, 99, 1e-6),
+    ("q2", "t2", 1.00, 100, 100, 100, 1e-9),
+    ("q2", "t3", 0.99, 100, 100, 100, 1e-9),
+    ("q3", "t3", 0.50, 100, 100, 100, 1e-2), # below fident
+    ("q3", "t4", 0.99, 50, 50, 100, 1e-5), # below len_dif
+    ("q4", "t1", 0.98, 100, 100, 100, 1e-5),
+    ("q4", "t5", 0.98, 100, 100, 100, 1e-7),
+    ("q5", "t6", 0.99, 100, 100, 100, 1e-5),
+]
+
+def write_m8(path, rows=ROWS):
+    pd.DataFrame(rows, columns=list(HIT_DTYPES)).to_csv(path, sep="\t", index=False)
+    return str(path)
+
+def pairs(mmseqs):
+    return sorted(zip(mmseqs["query"].astype(str), mmseqs["target"].astype(str)))
+
+def test_best_one_to_one():
+    best = best_one_to_one(hits_from_rows(ROWS[:4] + ROWS[6:]))
+    # q1 and q2 both prefer t2; q2's is the better hit, so q1 loses its target rather than falling back to t1
+    assert pairs(best) == [("q2", "t2"), ("q4", "t5"), ("q5", "t6")]
+
+def test_read_hits_filters(tmp_path):
+    mmseqs = read_hits(write_m8(tmp_path / "hits.m8"), min_fident=0.9, min_len_dif=0.9)
+    assert "q3" not in set(mmseqs["query"].astype(str))
+    assert len(mmseqs) == 7
+
+def test_chunked_read_matches_full_read(tmp_path):
+    m8 = write_m8(tmp_path / "hits.m8")
+    for best_only in (False, True):
+        full = read_hits(m8, min_fident=0.9, min_len_dif=0.9, best_only=best_only)
+        for chunksize in (1, 2, 3, 100):
+            chunked = read_hits(m8, min_fident=0.9, min_len_dif=0.9, chunksize=chunksize, best_only=best_only)
+            assert pairs(chunked) == pairs(full)
+
+def test_best_only_chunks_then_one_to_one(tmp_path):
+    m8 = write_m8(tmp_path / "hits.m8")
+    full = best_one_to_one(read_hits(m8, min_fident=0.9, min_len_dif=0.9))
+    chunked = best_one_to_one(read_hits(m8, min_fident=0.9, min_len_dif=0.9, chunksize=2, best_only=True))
+    assert pairs(chunked) == pairs(full)
+    assert len(read_hits(m8, min_fident=0.9, min_len_dif=0.9, chunksize=2, best_only=True)) == 4
+
+def test_excluded_targets_and_queries(tmp_path):
+    m8 = write_m8(tmp_path / "hits.m8")
+    mmseqs = read_hits(m8, min_fident=0.9, min_len_dif=0.9, chunksize=2, exclude_targets={"t2"}, exclude_queries={"q5"})
+    assert pairs(mmseqs) == [("q1", "t1"), ("q2", "t3"), ("q4", "t1"), ("q4", "t5")]
+
+def test_no_hits_pass(tmp_path):
+    m8 = write_m8(tmp_path / "hits.m8")
+    for chunksize in (None, 2):
+        mmseqs = read_hits(m8, min_fident=1.1, min_len_dif=0.9, chunksize=chunksize)
+        assert len(mmseqs) == 0
+        assert "len_dif" in mmseqs.columns
@@ -0,0 +1,59 @@
+import pytest
+from custom_functions.sqlite import sqlite_connect, sqlite_init_schema
+from custom_functions.remove import member_of_seqid, resolve_members, remove_members_sqlite
+
+# genome A is member 0_g1, genome B is member 1_g1
+# n1 holds a gene of both genomes, n2 and n3 one gene each; edges n1-n2 (A) and n1-n3 (B)
+@pytest.fixture
+def con(tmp_path):
+    con = sqlite_connect(str(tmp_path / "pangenome_metadata.sqlite"), 2000)
+    sqlite_init_schema(con)
+    nodes = {"n1": ["0_g1", "1_g1"], "n2": ["0_g1"], "n3": ["1_g1"]}
+    seqids = {"n1": ["0_0_0_g1", "1_0_0_g1"], "n2": ["0_0_1_g1"], "n3": ["1_0_1_g1"]}
+    annotations = {"0_0_0_g1": "geneA", "1_0_0_g1": "geneB", "0_0_1_g1": "geneC", "1_0_1_g1": "geneD"}
+    for n, members in nodes.items():
+        con.execute("INSERT INTO nodes(node_id, name, size, degrees, genomeIDs) VALUES (?, ?, ?, ?, ?)",
+                    (n, n, len(members), 2 if n == "n1" else 1, ";".join(members)))
+        con.executemany("INSERT INTO node_members VALUES (?, ?)", [(n, m) for m in members])
+        con.executemany("INSERT INTO node_seqids VALUES (?, ?)", [(n, s) for s in seqids[n]])
+        # exported geneIDs are the seqIDs; annotation IDs are only found through seqid_geneids
+        con.executemany("INSERT INTO node_geneids VALUES (?, ?)", [(n, s) for s in seqids[n]])
+    con.executemany("INSERT INTO seqid_geneids VALUES (?, ?)", annotations.items())
+    con.executemany("INSERT INTO member_genomes VALUES (?, ?)", [("0_g1", "A"), ("1_g1", "B")])
+    for (u, v), members in {("n1", "n2"): ["0_g1"], ("n1", "n3"): ["1_g1"]}.items():
+        con.execute("INSERT INTO edges(u, v, size, genomeIDs) VALUES (?, ?, ?, ?)", (u, v, len(members), ";".join(members)))
+        con.executemany("INSERT INTO edge_members VALUES (?, ?, ?)", [(u, v, m) for m in members])
+    con.commit()
+    yield con
+    con.close()
+
+def test_member_of_seqid():
+    assert member_of_seqid("12_3_4_g2") == "12_g2"
+    assert member_of_seqid("12_3_4_g2_g5") == "12_g2_g5"
+    assert member_of_seqid("7_contig_g1_10_g3") == "7_g3"
+
+def test_resolve_members(con):
+    assert resolve_members(con, {"A"}) == {"0_g1"}
+    # names without a genome are taken to be member ids
+    assert resolve_members(con, {"B", "5_g2"}) == {"1_g1", "5_g2"}
+
+def test_resolve_members_without_genome_table(con):
+    con.execute("DROP TABLE member_genomes")
+    assert resolve_members(con, {"A", "0_g1"}) == {"A", "0_g1"}
+
+def test_remove_members_sqlite(con):
+    empty_nodes, empty_edges, node_members, edge_members, removed_geneids = \
+        remove_members_sqlite(con, resolve_members(con, {"A"}))
+
+    assert empty_nodes == {"n2"}
+    assert empty_edges == {("n1", "n2")}
+    assert node_members == {"n1": ["1_g1"]}
+    assert edge_members == {}
+    assert removed_geneids == {"0_0_0_g1", "geneA", "0_0_1_g1", "geneC"}
+
+    assert con.execute("SELECT node_id FROM nodes ORDER BY node_id").fetchall() == [("n1",), ("n3",)]
+    assert con.execute("SELECT size, genomeIDs, degrees FROM nodes WHERE node_id = 'n1'").fetchone() == (1, "1_g1", 1)
+    assert con.execute("SELECT seqid FROM node_seqids WHERE node_id = 'n1'").fetchall() == [("1_0_0_g1",)]
+    assert con.execute("SELECT geneid FROM node_geneids WHERE node_id = 'n1'").fetchall() == [("1_0_0_g1",)]
+    assert con.execute("SELECT u, v FROM edges").fetchall() == [("n1", "n3")]
+    assert con.execute("SELECT COUNT(*) FROM node_members WHERE member = '0_g1'").fetchone() == (0,)
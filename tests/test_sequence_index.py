@@ -0,0 +1,54 @@
+from custom_functions.hits import hits_from_rows
+from custom_functions.sequence_index import SequenceIndex, normalise_protein, split_exact_queries
+
+def index():
+    return SequenceIndex.from_proteins([("n1", "MKV*"), ("n2", "MKV"), ("n3", "MAAJ"), ("n4", "MKV"), ("n5", "MLL")])
+
+def pairs(mmseqs):
+    return sorted(zip(mmseqs["query"].astype(str), mmseqs["target"].astype(str)))
+
+def test_normalise_protein():
+    assert normalise_protein("mkv*") == "MKV"
+    assert normalise_protein("MKJV") == "MKV"
+
+def test_add_and_lookup():
+    idx = index()
+    assert len(idx) == 3
+    assert idx.n_duplicates() == 2
+    assert idx.lookup("MKV") == "n1"
+    assert idx.lookup("maa*") == "n3"
+    assert idx.lookup("MWW") is None
+    # a node re-added with its own sequence is not its own duplicate
+    assert not idx.add("n1", "MKV")
+    assert idx.n_duplicates() == 2
+
+def test_expand():
+    idx = index()
+    mmseqs = hits_from_rows([("q1", "n1", 0.9, 3, 3, 3, 1e-5), ("q2", "n5", 0.8, 3, 3, 3, 1e-5)])
+    assert pairs(idx.expand(mmseqs)) == [("q1", "n1"), ("q1", "n2"), ("q1", "n4"), ("q2", "n5")]
+    assert pairs(idx.expand(mmseqs, exclude_targets={"n1", "n5"})) == [("q1", "n2"), ("q1", "n4")]
+
+def test_prefilter_targets():
+    idx = index()
+    # n1 is kept while n2 or n4 remain, as hits to n1 are theirs too
+    assert idx.prefilter_targets({"n1", "n2", "n5"}) == {"n2", "n5"}
+    assert idx.prefilter_targets({"n1", "n2", "n4"}) == {"n1", "n2", "n4"}
+    assert idx.prefilter_targets(None) == set()
+
+def test_write_read(tmp_path):
+    idx = index()
+    idx.write(tmp_path / "sequence_index.tsv")
+    read = SequenceIndex.read(tmp_path / "sequence_index.tsv")
+    assert read.representatives == idx.representatives
+    assert dict(read.duplicates) == dict(idx.duplicates)
+
+def test_split_exact_queries(tmp_path):
+    idx = index()
+    query_fa = tmp_path / "query.fa"
+    proteins = [("a", "MKV*"), ("b", "MWW"), ("c", "MLL"), ("d", "MAA")]
+    exact, n_written = split_exact_queries(proteins, idx, query_fa, exclude_targets={"n5"}, exclude_queries={"d"})
+    assert pairs(exact) == [("a", "n1")]
+    assert exact["fident"].tolist() == [1.0]
+    assert exact["qlen"].tolist() == [3]
+    assert n_written == 2
+    assert query_fa.read_text() == ">b\nMWW\n>c\nMLL\n"